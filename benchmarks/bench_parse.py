@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Compare parsing whole pages with parsing only what bukkitadmin reads.
+
+    python benchmarks/bench_parse.py [--search PAGE] [--file-page PAGE]
+                                     [--jenkins-build PAGE] [--jenkins-module PAGE]
+
+Pass pages saved from dev.bukkit.org / a jenkins server to time those; any
+kind not given is timed on a generated page of a similar size.
+"""
+from __future__ import absolute_import
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from bs4 import BeautifulSoup
+
+from bukkitadmin import bukkitdev, jenkins, util
+
+FILLER = '<div class="sidebar"><ul>%s</ul><p>%s</p></div>' % (
+    '<li><a href="/x/">Some navigation link</a></li>' * 40, "Lorem ipsum dolor sit amet. " * 60)
+
+
+def generated_search_page(rows=20):
+    row = ('<tr class="row-joined-to-next"><td class="col-project"><h2><a href="/bukkit-plugins/p%(i)s/">Plugin%(i)s</a>'
+           '</h2></td><td class="col-category"><a class="category">Admin Tools</a></td><td class="col-date">'
+           '<span class="standard-date" data-epoch="1389000000">Jan 6</span></td><td class="col-status">Release</td>'
+           '<td class="col-user"><a>someone</a></td></tr><tr><td>%(summary)s</td></tr>')
+    return ('<html><head><title>Search</title></head><body>%s<div class="listing-pagination listing-pagination-top">'
+            '<ul><li class="listing-pagination-pages-next"><a href="?page=2">Next</a></li></ul></div>'
+            '<table class="listing listing-project"><tbody>%s</tbody></table>%s</body></html>') % (
+        FILLER * 3, "".join(row % {'i': i, 'summary': "A plugin. " * 10} for i in range(rows)), FILLER * 3)
+
+
+def generated_file_page():
+    return '<html><body>%s<a href="http://example.com/P.jar">Download</a>%s</body></html>' % (FILLER * 4, FILLER * 4)
+
+
+def generated_build_page(modules=30):
+    return '<html><body>%s<h2>Module Builds</h2><table>%s</table>%s</body></html>' % (
+        FILLER * 3, "".join('<tr><td><a href="mod%s/">Module%s</a></td></tr>' % (i, i) for i in range(modules)), FILLER * 3)
+
+
+def generated_module_page(files=10):
+    return '<html><body>%s<table class="fileList">%s</table>%s</body></html>' % (
+        FILLER * 3, "".join('<tr><td><a href="f%s.jar">f%s.jar</a></td></tr>' % (i, i) for i in range(files)), FILLER * 3)
+
+
+PAGES = (
+    ('search', bukkitdev.SEARCH_STRAINER, generated_search_page),
+    ('file-page', bukkitdev.LINK_STRAINER, generated_file_page),
+    ('jenkins-build', jenkins.BUILD_STRAINER, generated_build_page),
+    ('jenkins-module', jenkins.ARTIFACT_STRAINER, generated_module_page),
+)
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    for kind, _, _ in PAGES:
+        parser.add_argument("--%s" % (kind,), metavar="PAGE", help="saved %s page" % (kind,))
+    parser.add_argument("--number", "-n", type=int, default=20, help="parses per measurement")
+    options = parser.parse_args()
+
+    print "parser: %s" % (util.SOUP_PARSER,)
+    print "%-16s %10s %12s %12s %8s" % ("page", "size", "full (ms)", "strained", "speedup")
+    for kind, strainer, generate in PAGES:
+        path = getattr(options, kind.replace("-", "_"))
+        if path:
+            with open(path) as f:
+                markup = f.read().decode('utf-8', 'replace')
+        else:
+            markup = generate()
+        full = best_of(lambda: BeautifulSoup(markup, util.SOUP_PARSER), options.number)
+        strained = best_of(lambda: util.parse_soup(markup, parse_only=strainer), options.number)
+        print "%-16s %10s %12.2f %12.2f %7.1fx" % (
+            kind + ("" if path else "*"), len(markup), full * 1000, strained * 1000, full / strained)
+    print "* generated page"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Memory held by an inventory of plugin jars: PluginFile objects versus
+keeping every parsed plugin.yml around.
+
+    python benchmarks/bench_pluginfile_memory.py [--jars 5000] [--commands 40]
+
+Each measurement runs in a fresh process and reports the growth of its
+resident set while loading the jars.
+"""
+from __future__ import absolute_import
+
+import argparse
+import gc
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import yaml
+
+from bukkitadmin.plugins import PluginFile
+from bukkitadmin.util import extract_plugin_info
+
+COMMON_DEPENDENCIES = ['Vault', 'ProtocolLib', 'WorldEdit', 'Essentials', 'PlaceholderAPI']
+
+
+def create_jars(directory, count, commands):
+    for i in range(count):
+        plugin_yml = {
+            'name': 'Plugin%s' % (i,),
+            'version': '1.%s.%s' % (i % 10, i % 7),
+            'main': 'com.example.plugin%s.Plugin%s' % (i, i),
+            'authors': ['author%s' % (i % 50,), 'someone'],
+            'depend': COMMON_DEPENDENCIES[:i % 3],
+            'softdepend': COMMON_DEPENDENCIES[2:2 + i % 4],
+            'description': 'Plugin number %s, it does things.' % (i,),
+            'commands': dict(('cmd%s' % (c,), {
+                'description': 'Command %s of plugin %s' % (c, i),
+                'usage': '/<command> [player] [amount]',
+                'aliases': ['c%s' % (c,), 'p%sc%s' % (i, c)],
+                'permission': 'plugin%s.cmd%s' % (i, c),
+            }) for c in range(commands)),
+            'permissions': dict(('plugin%s.cmd%s' % (i, c), {
+                'description': 'Allows /cmd%s' % (c,),
+                'default': 'op',
+            }) for c in range(commands)),
+        }
+        zf = zipfile.ZipFile(os.path.join(directory, 'Plugin%s.jar' % (i,)), mode='w')
+        zf.writestr('plugin.yml', yaml.safe_dump(plugin_yml))
+        zf.close()
+
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def measure(args):
+    mode, directory = args
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory))
+    gc.collect()
+    before = rss_kb()
+    if mode == 'plugin.yml dicts':
+        held = [(path, extract_plugin_info(path)) for path in paths]
+    else:
+        held = [PluginFile(path) for path in paths]
+    gc.collect()
+    return rss_kb() - before, len(held)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--jars", type=int, default=5000)
+    parser.add_argument("--commands", type=int, default=40, help="commands (and permissions) per plugin.yml")
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp("bukkitadmin-bench")
+    try:
+        print "creating %s jars..." % (options.jars,)
+        create_jars(directory, options.jars, options.commands)
+        results = {}
+        for mode in ('plugin.yml dicts', 'PluginFile'):
+            # a new process per measurement so one doesn't reuse the other's memory
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                results[mode], count = pool.apply(measure, ((mode, directory),))
+            finally:
+                pool.close()
+                pool.join()
+            print "%-18s %8.1f MB for %s jars (%.0f bytes each)" % (
+                mode, results[mode] / 1024.0, count, results[mode] * 1024.0 / count)
+        print "PluginFile uses %.1fx less memory" % (results['plugin.yml dicts'] / float(max(1, results['PluginFile'])),)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
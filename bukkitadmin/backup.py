@@ -0,0 +1,317 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from .console import send_command
+
+BACKUP_DIR = "backups"
+
+# worlds are chunked on region file sector boundaries: chunks inside .mca
+# files are sector aligned, so an edited or moved chunk only changes the
+# backup chunks around it instead of shifting every boundary after it.
+SECTOR_SIZE = 4096
+MIN_SECTORS = 4
+MAX_SECTORS = 64
+# a sector whose crc has these bits clear ends a chunk, ~16 sectors apart
+BOUNDARY_MASK = 0xF
+READ_SIZE = SECTOR_SIZE * 256
+
+COMPRESS_LEVEL = 6
+
+# seconds the world files must stay untouched after save-all before we
+# trust them to be flushed
+SAVE_SETTLE = 2.0
+SAVE_TIMEOUT = 120
+
+
+class BackupError(Exception):
+    pass
+
+
+def iter_chunks(fileobj):
+    """
+    Split the contents of `fileobj` into content defined chunks, reading it
+    once in large blocks.
+    """
+    sectors = []
+    while True:
+        block = fileobj.read(READ_SIZE)
+        if not block:
+            break
+        for offset in xrange(0, len(block), SECTOR_SIZE):
+            sector = block[offset:offset + SECTOR_SIZE]
+            sectors.append(sector)
+            if len(sectors) >= MAX_SECTORS or (
+                    len(sectors) >= MIN_SECTORS and zlib.crc32(sector) & BOUNDARY_MASK == 0):
+                yield "".join(sectors)
+                sectors = []
+    if sectors:
+        yield "".join(sectors)
+
+
+def find_worlds(rootdir):
+    """World directories of a server, those holding a level.dat."""
+    return sorted(d for d in os.listdir(rootdir)
+                  if os.path.isfile(os.path.join(rootdir, d, "level.dat")))
+
+
+def _walk_files(rootdir, worlds):
+    for world in worlds:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(rootdir, world)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    yield os.path.relpath(path, rootdir), path
+
+
+def _stat_key(st):
+    return [st.st_size, int(st.st_mtime * 1000), st.st_ino]
+
+
+def _file_matches(path, entry):
+    """
+    Whether the file at `path` still holds what the snapshot `entry`
+    recorded: it is the very file that was backed up, or a file of the same
+    size whose chunks hash to the same digests.
+    """
+    st = os.stat(path)
+    if _stat_key(st) == entry['stat']:
+        return True
+    if st.st_size != entry['stat'][0]:
+        return False
+    with open(path, 'rb') as f:
+        digests = [hashlib.sha256(data).hexdigest() for data in iter_chunks(f)]
+    return digests == entry['chunks']
+
+
+def wait_for_quiet(rootdir, worlds, settle=SAVE_SETTLE, timeout=SAVE_TIMEOUT):
+    """
+    Wait until no world file has been modified for `settle` seconds.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        newest = max([os.path.getmtime(path) for _, path in _walk_files(rootdir, worlds)] or [0])
+        if time.time() - newest >= settle:
+            return True
+        time.sleep(min(settle, max(0.1, settle - (time.time() - newest))))
+    return False
+
+
+class BackupStore(object):
+    """
+    Snapshots of one server's worlds, sharing a deduplicated store of zlib
+    compressed chunks.
+    """
+
+    @classmethod
+    def get(cls, server, rootdir=None):
+        if rootdir is None:
+            rootdir = os.getcwd()
+        return BackupStore(os.path.join(rootdir, BACKUP_DIR, server.name))
+
+    def __init__(self, path):
+        self.path = path
+        self.chunk_dir = os.path.join(path, "chunks")
+        self.snapshot_dir = os.path.join(path, "snapshots")
+        for d in (self.chunk_dir, self.snapshot_dir):
+            if not os.path.exists(d):
+                os.makedirs(d)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def has_chunk(self, digest):
+        return os.path.exists(self._chunk_path(digest))
+
+    def put_chunk(self, data):
+        """
+        Store a chunk unless we already have it, returns (digest, bytes written).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.mkdir(os.path.dirname(path))
+            except OSError:
+                # another worker got there first
+                pass
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.rename(tmp, path)
+        return digest, len(compressed)
+
+    def get_chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def snapshots(self):
+        return sorted(f[:-len(".json")] for f in os.listdir(self.snapshot_dir) if f.endswith(".json"))
+
+    def load_snapshot(self, name):
+        path = os.path.join(self.snapshot_dir, "%s.json" % (name,))
+        if not os.path.exists(path):
+            raise BackupError("no snapshot named %s" % (name,))
+        # json rather than yaml, a snapshot lists every chunk of every world
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_snapshot(self, name, snapshot):
+        fd, tmp = tempfile.mkstemp(dir=self.snapshot_dir, prefix=".tmp-")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp, os.path.join(self.snapshot_dir, "%s.json" % (name,)))
+
+    def backup(self, server, threads=None):
+        """
+        Snapshot the worlds of `server`.  A running server is told to stop
+        saving through its console for the duration.  Returns the snapshot
+        name and a dict of statistics.
+        """
+        rootdir = server.get_root_dir()
+        worlds = find_worlds(rootdir)
+        if not worlds:
+            raise BackupError("%s has no worlds to back up" % (server.name,))
+
+        live = server.is_running()
+        if live:
+            send_command(server, "save-off")
+        try:
+            if live:
+                send_command(server, "save-all")
+                if not wait_for_quiet(rootdir, worlds):
+                    raise BackupError("%s kept writing its worlds after save-all" % (server.name,))
+            return self._backup(rootdir, worlds, threads)
+        finally:
+            if live:
+                send_command(server, "save-on")
+
+    def _backup(self, rootdir, worlds, threads):
+        snapshots = self.snapshots()
+        previous = self.load_snapshot(snapshots[-1])['files'] if snapshots else {}
+        stats = dict(files=0, unchanged=0, read=0, chunks=0, new=0, stored=0)
+        files = {}
+        threads = threads or multiprocessing.cpu_count()
+        pool = ThreadPool(threads)
+        pending = collections.deque()
+        try:
+            for relpath, path in _walk_files(rootdir, worlds):
+                try:
+                    st = os.stat(path)
+                    key = _stat_key(st)
+                    old = previous.get(relpath, None)
+                    if old is not None and old['stat'] == key and all(self.has_chunk(d) for d in old['chunks']):
+                        stats['files'] += 1
+                        stats['unchanged'] += 1
+                        files[relpath] = old
+                        continue
+                    f = open(path, 'rb')
+                except (OSError, IOError) as e:
+                    # a live server may remove files while we walk its worlds
+                    if e.errno == errno.ENOENT:
+                        continue
+                    raise BackupError("could not read %s: %s" % (relpath, e.strerror or e))
+                stats['files'] += 1
+                entry = files[relpath] = {'stat': key, 'mode': st.st_mode & 0o7777, 'mtime': st.st_mtime, 'chunks': []}
+                with f:
+                    try:
+                        for data in iter_chunks(f):
+                            stats['read'] += len(data)
+                            result = pool.apply_async(self.put_chunk, (data,))
+                            entry['chunks'].append(result)
+                            pending.append(result)
+                            # don't read far ahead of the compressors
+                            while len(pending) > threads * 4:
+                                pending.popleft().wait()
+                    except IOError as e:
+                        raise BackupError("could not read %s: %s" % (relpath, e.strerror or e))
+            for entry in files.values():
+                digests = []
+                for chunk in entry['chunks']:
+                    if isinstance(chunk, basestring):
+                        digests.append(chunk)
+                        continue
+                    digest, written = chunk.get()
+                    stats['chunks'] += 1
+                    if written:
+                        stats['new'] += 1
+                        stats['stored'] += written
+                    digests.append(digest)
+                entry['chunks'] = digests
+        finally:
+            pool.close()
+            pool.join()
+
+        name = time.strftime("%Y%m%d-%H%M%S")
+        if name in snapshots:
+            name = "%s-%s" % (name, len(snapshots))
+        self._save_snapshot(name, {'created': time.time(), 'worlds': worlds, 'files': files})
+        return name, stats
+
+    def restore(self, server, name=None, threads=None):
+        """
+        Restore the worlds of a stopped server from a snapshot, the latest one
+        by default.  Files that still match the snapshot are left alone and
+        files the snapshot doesn't know about are removed.  Returns a dict of
+        statistics.
+        """
+        if server.is_running():
+            raise BackupError("refusing to restore %s while it is running" % (server.name,))
+        if name is None:
+            snapshots = self.snapshots()
+            if not snapshots:
+                raise BackupError("there are no backups of %s" % (server.name,))
+            name = snapshots[-1]
+        snapshot = self.load_snapshot(name)
+        rootdir = server.get_root_dir()
+        files = snapshot['files']
+
+        missing = set(d for entry in files.values() for d in entry['chunks'] if not self.has_chunk(d))
+        if missing:
+            raise BackupError("snapshot %s is missing %s chunks" % (name, len(missing)))
+
+        stats = dict(files=len(files), restored=0, removed=0)
+        for relpath, path in list(_walk_files(rootdir, [w for w in snapshot['worlds'] if os.path.isdir(os.path.join(rootdir, w))])):
+            if relpath not in files:
+                os.unlink(path)
+                stats['removed'] += 1
+
+        def restore_file(item):
+            relpath, entry = item
+            path = os.path.join(rootdir, relpath)
+            if os.path.isfile(path) and _file_matches(path, entry):
+                return False
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".restore-")
+            with os.fdopen(fd, 'wb') as f:
+                for digest in entry['chunks']:
+                    f.write(self.get_chunk(digest))
+            os.chmod(tmp, entry['mode'])
+            os.utime(tmp, (entry['mtime'], entry['mtime']))
+            os.rename(tmp, path)
+            return True
+
+        pool = ThreadPool(threads or multiprocessing.cpu_count())
+        try:
+            stats['restored'] = sum(pool.imap_unordered(restore_file, files.iteritems()))
+        finally:
+            pool.close()
+            pool.join()
+        return stats
@@ -6,54 +6,80 @@ from bs4 import NavigableString
 
 import feedparser
 import requests
-import time
 
-from .util import download_file, get_page_soup, get_request_session, feed_parse
+from .util import download_file, get_page_soup, get_request_session, get_result_cache, conditional_feed_parse, tag_strainer
 
 DEBUG = 'BUKKITADMIN_DEBUG' in os.environ
 
+# the parts of the pages we actually read
+SEARCH_STRAINER = tag_strainer(("table", "listing"), ("div", "listing-pagination-top"))
+LISTING_STRAINER = tag_strainer(("table", "listing"))
+LINK_STRAINER = tag_strainer(("a", None))
+
+# how long parsed results are reused, in seconds
+SEARCH_TTL = 6 * 60 * 60
+SLUG_TTL = 7 * 24 * 60 * 60
+# a plugin not found is looked up again after this long, it may be an outage
+SLUG_MISS_TTL = 15 * 60
+DOWNLOAD_URL_TTL = 60 * 60
+# meta keys describing a resolved download url
+FEED_META_KEYS = ('feed_guid', 'feed_published', 'feed_etag', 'feed_download_url')
+
 class  PluginSource(object):
 
     source_type = "bukkitdev"
     name = 'bukkitdev'
 
+    FILES_FEED_URL = "http://dev.bukkit.org/bukkit-plugins/%s/files.rss"
+
     def search_result_url(self, search_result):
-        url = self._get_download_url(search_result['slug'])
-        return url, {'slug': search_result['slug'], 'last_download_url': url}
+        meta = {'slug': search_result['slug']}
+        url = self._get_download_url(search_result['slug'], meta)
+        meta['last_download_url'] = url
+        return url, meta
 
     def search(self, searchstr):
-        base_url = "http://dev.bukkit.org/bukkit-plugins/?search=%s" % (urllib.quote(searchstr),)
         page = 1
         has_next = True
         while has_next:
-            url = base_url
-            if page > 1:
-                url += "&page=%s" % (page,)
-            soup = get_page_soup(url)
-            tbl = soup.find("table", {'class': "listing"}).find("tbody").findAll('tr', {'class': 'row-joined-to-next'})
-            pages = soup.find("div", "listing-pagination-top")
-            has_next = pages.find("li", "listing-pagination-pages-next") is not None
-            for row in tbl:
-                link = row.find('h2').contents[0]
-                next = row.nextSibling
-                while isinstance(next, NavigableString):
-                    next = next.nextSibling
-                yield dict(
-                    name=link.text,
-                    categories=[a.text for a in row.find('td', 'col-category').findAll('a', 'category')],
-                    last_updated=datetime.fromtimestamp(int(row.find('td', 'col-date').find('span', 'standard-date')['data-epoch'])),
-                    stage=row.find('td', 'col-status').text,
-                    authors=[a.text for a in row.find('td', 'col-user').findAll('a')],
-                    summary=next.td.get_text(),
-                    slug=link['href'].strip('/').split('/')[-1],
-                )
+            rows, has_next = get_result_cache().cached("bukkitdev.search:%s" % (page,), searchstr, SEARCH_TTL,
+                                                       self._search_page, searchstr, page)
+            for row in rows:
+                yield row
             page += 1
 
-
+    def _search_page(self, searchstr, page):
+        url = "http://dev.bukkit.org/bukkit-plugins/?search=%s" % (urllib.quote(searchstr),)
+        if page > 1:
+            url += "&page=%s" % (page,)
+        soup = get_page_soup(url, parse_only=SEARCH_STRAINER)
+        tbl = soup.find("table", {'class': "listing"}).find("tbody").findAll('tr', {'class': 'row-joined-to-next'})
+        pages = soup.find("div", "listing-pagination-top")
+        has_next = pages.find("li", "listing-pagination-pages-next") is not None
+        rows = []
+        for row in tbl:
+            link = row.find('h2').contents[0]
+            next = row.nextSibling
+            while isinstance(next, NavigableString):
+                next = next.nextSibling
+            rows.append(dict(
+                name=unicode(link.text),
+                categories=[unicode(a.text) for a in row.find('td', 'col-category').findAll('a', 'category')],
+                last_updated=datetime.fromtimestamp(int(row.find('td', 'col-date').find('span', 'standard-date')['data-epoch'])),
+                stage=unicode(row.find('td', 'col-status').text),
+                authors=[unicode(a.text) for a in row.find('td', 'col-user').findAll('a')],
+                summary=unicode(next.td.get_text()),
+                slug=link['href'].strip('/').split('/')[-1],
+            ))
+        return rows, has_next
 
     def get_slug(self, plugin_name):
-        time.sleep(0.5)
-        soup = get_page_soup("http://dev.bukkit.org/bukkit-plugins/?search=%s" % (plugin_name,))
+        return get_result_cache().cached("bukkitdev.slug", plugin_name, SLUG_TTL, self._get_slug, plugin_name,
+                                         negative_ttl=SLUG_MISS_TTL)
+
+    def _get_slug(self, plugin_name):
+        soup = get_page_soup("http://dev.bukkit.org/bukkit-plugins/?search=%s" % (plugin_name,),
+                             parse_only=LISTING_STRAINER)
         if DEBUG:
             print "results soup", soup
         tbl = soup.find("table", {'class': "listing"}).find("tbody").findAll('tr', {'class': 'row-joined-to-next'})
@@ -62,37 +88,85 @@ class  PluginSource(object):
             if link.text.lower() == plugin_name.lower():
                 return str(link['href'].strip('/').split('/')[-1])
 
-    def _get_download_url(self, slug):
-        feed_url = "http://dev.bukkit.org/bukkit-plugins/%s/files.rss" % (slug,)
+    def _get_download_url(self, slug, meta=None):
+        """
+        Resolve the download url of the newest file of `slug`.
+
+        If `meta` is given it is used to remember the newest feed entry
+        (guid, publish date and the feed's ETag) along with the url it
+        resolved to.  As long as the feed answers 304 or still lists the same
+        newest entry, that url is returned without scraping the file page.
+        Within DOWNLOAD_URL_TTL of resolving it the feed isn't even fetched.
+        """
+        if meta is None:
+            meta = {}
+        cached = get_result_cache().get("bukkitdev.download", slug, None)
+        if cached is not None:
+            meta.update(cached)
+            return cached['feed_download_url']
+        url = self._resolve_download_url(slug, meta)
+        if url is not None:
+            get_result_cache().set("bukkitdev.download", slug,
+                                   dict((k, meta.get(k, None)) for k in FEED_META_KEYS), DOWNLOAD_URL_TTL)
+        return url
+
+    def _resolve_download_url(self, slug, meta):
+        feed_url = self.FILES_FEED_URL % (slug,)
+        known_url = meta.get('feed_download_url', None)
         if DEBUG:
             print "fetching %s" % (feed_url,)
-        time.sleep(0.5)
-        feed = feed_parse(feed_url)
+        feed, etag = conditional_feed_parse(feed_url, etag=meta.get('feed_etag') if known_url else None)
+        if feed is None:
+            if DEBUG:
+                print "feed not modified"
+            return known_url
         if DEBUG:
             print "feed Entries: ", len(feed.entries)
         if not feed.entries:
             return None
-        url = feed.entries[0]['links'][0]['href']
-        time.sleep(0.5)
+        entry = feed.entries[0]
+        url = entry['links'][0]['href']
+        guid = entry.get('id', url)
+        if known_url and guid == meta.get('feed_guid', None):
+            meta['feed_etag'] = etag
+            return known_url
+
         if DEBUG:
             print "fetching %s" % (url,)
-        soup = get_page_soup(url)
-        if DEBUG:
-            print "page: ", soup.find("title")
-        return soup.find('a', text="Download")['href']
+        soup = get_page_soup(url, parse_only=LINK_STRAINER)
+        download_url = soup.find('a', text="Download")['href']
+        meta.update(feed_guid=guid, feed_published=entry.get('published', None),
+                    feed_etag=etag, feed_download_url=download_url)
+        return download_url
 
     def get_download_url(self, plugin):
-        meta = plugin.get_meta()
-        if meta is None or not meta.get('slug', None):
-            if meta is None:
-                meta = {}
+        meta = plugin.get_meta() or {}
+        before = dict(meta)
+        if not meta.get('slug', None):
             meta['slug'] = self.get_slug(plugin.name)
             if meta['slug'] is None:
                 return None
-            else:
-                plugin.set_meta(meta)
-        return self._get_download_url(meta['slug'])
+        url = self._get_download_url(meta['slug'], meta)
+        # most lookups change nothing, those don't rewrite the meta file
+        changed = dict((k, v) for k, v in meta.iteritems() if k not in before or before[k] != v)
+        if changed:
+            with plugin.edit_meta() as current:
+                current.update(changed)
+        return url
+
+    def invalidate(self, plugin):
+        """Forget the cached results about `plugin`, and its remembered feed entry."""
+        cache = get_result_cache()
+        cache.invalidate(key=plugin.name)
+        with plugin.edit_meta() as meta:
+            if meta.get('slug', None):
+                cache.invalidate(key=meta['slug'])
+            for key in FEED_META_KEYS:
+                meta.pop(key, None)
+
+    def download(self, url):
+        return download_file(url)
 
     def download_plugin(self, plugin):
-        return download_file(self.get_download_url(plugin))
+        return self.download(self.get_download_url(plugin))
 
@@ -0,0 +1,240 @@
+"""
+Library bundles: one file holding a plugin library's jars, their meta files
+and .sources.yml, to bring up a new node without searching and downloading
+every plugin again.
+
+A bundle is an uncompressed tar, so it can be written to a pipe and later
+exports can be appended to it.  Each export ends with a manifest of the
+sha256 digests of everything in the bundle; the last manifest wins.
+"""
+from __future__ import absolute_import
+
+import binascii
+import hashlib
+import os
+import tarfile
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+from .locking import locked
+from .util import hashfile
+
+MANIFEST_NAME = "bukkitadmin-bundle.yml"
+SOURCES_NAME = "sources.yml"
+PLUGIN_DIR = "plugins"
+BLOCK_SIZE = 65536
+
+
+class BundleError(Exception):
+    pass
+
+
+class _HashingReader(object):
+    """A file wrapper hashing what tarfile reads from it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+
+def _add_file(tar, path, arcname, files):
+    info = tar.gettarinfo(path, arcname)
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    with open(path, 'rb') as f:
+        reader = _HashingReader(f)
+        tar.addfile(info, reader)
+    files[arcname] = {'sha256': reader.hasher.hexdigest(), 'size': info.size}
+
+
+def _add_bytes(tar, data, arcname):
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = time.time()
+    info.mode = 0o644
+    tar.addfile(info, _BytesReader(data))
+
+
+class _BytesReader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size < 0 else self.pos + size
+        chunk = self.data[self.pos:end]
+        self.pos += len(chunk)
+        return chunk
+
+
+def read_manifest(path):
+    """The last manifest of the bundle at `path`."""
+    try:
+        with tarfile.open(path, 'r:') as tar:
+            manifest = None
+            for member in tar:
+                if member.name == MANIFEST_NAME:
+                    manifest = member
+            if manifest is None:
+                raise BundleError("%s has no manifest, was the export interrupted?" % (path,))
+            data = yaml.safe_load(tar.extractfile(manifest).read()) or {}
+    except (IOError, tarfile.TarError) as e:
+        raise BundleError("%s is not a bundle: %s" % (path, e))
+    data.setdefault('files', {})
+    data.setdefault('plugins', {})
+    return data
+
+
+def export_library(library, out, names=None, append=False):
+    """
+    Write `library` (only the plugins in `names` if given) as a bundle to
+    `out`, a path or a stream.  With append=True the plugins are added to an
+    existing bundle file, skipping the jars it already has.  Returns the
+    manifest written.
+    """
+    manifest = {'files': {}, 'plugins': {}}
+    if append and isinstance(out, basestring) and os.path.exists(out):
+        manifest = read_manifest(out)
+    known = set(entry['sha256'] for entry in manifest['files'].values())
+
+    plugins = library.plugins
+    if names is not None:
+        wanted = set(name.lower() for name in names)
+        plugins = [p for p in plugins if p.name.lower() in wanted]
+
+    if isinstance(out, basestring):
+        tar = tarfile.open(out, 'a:' if append and os.path.exists(out) else 'w:', format=tarfile.PAX_FORMAT)
+    else:
+        tar = tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT)
+    with tar:
+        for plugin in sorted(plugins, key=lambda p: p.name.lower()):
+            jarname = "%s/%s" % (PLUGIN_DIR, os.path.basename(plugin.jarpath))
+            with plugin.lock(exclusive=False):
+                digest = binascii.hexlify(hashfile(path=plugin.jarpath))
+                if digest not in known or jarname not in manifest['files']:
+                    _add_file(tar, plugin.jarpath, jarname, manifest['files'])
+                metaname = None
+                if plugin.has_meta():
+                    metaname = "%s/%s" % (PLUGIN_DIR, os.path.basename(plugin._get_meta_path()))
+                    _add_file(tar, plugin._get_meta_path(), metaname, manifest['files'])
+            manifest['plugins'][plugin.name] = {'version': str(plugin.version), 'jar': jarname, 'meta': metaname}
+
+        sources_path = os.path.join(library.path, ".sources.yml")
+        if os.path.exists(sources_path):
+            with locked(sources_path, exclusive=False):
+                _add_file(tar, sources_path, SOURCES_NAME, manifest['files'])
+
+        manifest['created'] = time.time()
+        _add_bytes(tar, yaml.safe_dump(manifest, default_flow_style=False), MANIFEST_NAME)
+    return manifest
+
+
+def _extract_verified(bundle_path, member, entry, dest):
+    """
+    Copy `member` out of the bundle to `dest` through a temporary file,
+    renaming it into place only once its digest matches the manifest.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".%s." % (os.path.basename(dest),), dir=os.path.dirname(dest))
+    try:
+        hasher = hashlib.sha256()
+        # every worker reads the bundle through its own file
+        with open(bundle_path, 'rb') as bundle, os.fdopen(fd, 'wb') as out:
+            bundle.seek(member.offset_data)
+            left = member.size
+            while left > 0:
+                data = bundle.read(min(BLOCK_SIZE, left))
+                if not data:
+                    raise BundleError("%s is truncated" % (bundle_path,))
+                hasher.update(data)
+                out.write(data)
+                left -= len(data)
+        if hasher.hexdigest() != entry['sha256']:
+            raise BundleError("%s does not match its digest in the bundle manifest" % (member.name,))
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, dest)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def import_bundle(library, bundle_path, threads=8, force=False):
+    """
+    Add the plugins of a bundle to `library`.  Plugins the library already
+    has are skipped (replaced with force=True if they differ), jars and meta
+    files are verified against the manifest in parallel and renamed into
+    place.  Sources the library doesn't know are registered.  Returns
+    {'imported': [names], 'skipped': [names], 'sources': [names]}.
+    """
+    manifest = read_manifest(bundle_path)
+    with tarfile.open(bundle_path, 'r:') as tar:
+        # the last copy of a file in the bundle is the current one
+        members = dict((m.name, m) for m in tar if m.isfile())
+
+    jobs = []
+    skipped = []
+    for name, plugin in sorted(manifest['plugins'].iteritems()):
+        entry = manifest['files'].get(plugin['jar'], None)
+        if entry is None or plugin['jar'] not in members:
+            raise BundleError("%s of %s is missing from the bundle" % (plugin['jar'], name))
+        existing = library.get_plugin(name)
+        if existing is not None:
+            unchanged = binascii.hexlify(hashfile(path=existing.jarpath)) == entry['sha256']
+            if unchanged or not force:
+                skipped.append(name)
+                continue
+        jobs.append((name, plugin, existing))
+
+    def install(job):
+        name, plugin, existing = job
+        dest = os.path.join(library.path, os.path.basename(plugin['jar']))
+        metapath = os.path.splitext(dest)[0] + ".yml"
+        with locked(metapath):
+            _extract_verified(bundle_path, members[plugin['jar']], manifest['files'][plugin['jar']], dest)
+            if plugin.get('meta', None) and plugin['meta'] in members:
+                _extract_verified(bundle_path, members[plugin['meta']], manifest['files'][plugin['meta']], metapath)
+        if existing is not None and os.path.abspath(existing.jarpath) != os.path.abspath(dest):
+            # replaced by a differently named jar
+            with existing.lock():
+                os.unlink(existing.jarpath)
+                if existing.has_meta():
+                    os.unlink(existing._get_meta_path())
+        return name
+
+    imported = []
+    if jobs:
+        pool = ThreadPool(max(1, min(threads, len(jobs))))
+        try:
+            imported = pool.map(install, jobs)
+        finally:
+            pool.close()
+    library.reload()
+
+    added_sources = []
+    if SOURCES_NAME in members and SOURCES_NAME in manifest['files']:
+        with tarfile.open(bundle_path, 'r:') as tar:
+            data = tar.extractfile(members[SOURCES_NAME]).read()
+        if hashlib.sha256(data).hexdigest() != manifest['files'][SOURCES_NAME]['sha256']:
+            raise BundleError("%s does not match its digest in the bundle manifest" % (SOURCES_NAME,))
+        sources = yaml.safe_load(data) or {}
+        with library.edit_sources():
+            for source_name, cfg in sorted(sources.iteritems()):
+                if source_name in library.sources:
+                    continue
+                cfg = dict(cfg)
+                source_type = cfg.pop('type', None)
+                try:
+                    library.add_source(source_name, source_type, **cfg)
+                except KeyError:
+                    continue
+                added_sources.append(source_name)
+    return {'imported': imported, 'skipped': skipped, 'sources': added_sources}
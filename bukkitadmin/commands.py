@@ -4,19 +4,28 @@ from __future__ import absolute_import
 
 import argparse
 from collections import defaultdict
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
+import signal
 import sys
+import time
 import yaml
 
 import argcomplete
 import feedparser
 
-from . import __version__, servers, jenkins
-from .plugins import InvalidPlugin, Library, NoPluginSource
-from .servers import list_servers, get_servers_file, get_server, save_servers_file, ServerNotFound
-from .util import download_file, format_as_kwargs, query_yes_no, chdir, get_request_session, feed_parse
-from .runserver import run_server
+from . import __version__, servers, jenkins, jvm, lag, loadorder, lockfile, mirror, procstats, shading, supervisor, worlds
+from .backup import BackupError, BackupStore
+from .bundle import BundleError, export_library, import_bundle
+from .plugins import InvalidPlugin, Library, NoPluginSource, PluginNotFound, SearchFailed
+from .search import DEFAULT_TIMEOUT
+from .servers import list_servers, get_server, edit_servers_file, ServerNotFound, find_startup_regressions
+from .console import ConsoleNotAvailable, request
+from .serverjars import ServerJarCache, jar_version
+from .util import atomic_copy, download_file, emit_json, format_as_kwargs, query_yes_no, chdir, get_request_session, feed_parse
+from .runserver import run_server, get_server_command
 from .servers import InvalidServerJar
 
 
@@ -31,6 +40,26 @@ class Option(object):
         self.completer = kwargs.pop('completer', None)
         self.kwargs = kwargs
 
+# accepted after any command that supports it, as well as before the command
+JSON_OPTION = Option("--json", action="store_true", default=argparse.SUPPRESS,
+                     help="print one JSON object per line instead of text.")
+
+def format_process_stats(stats):
+    """The columns of a server's /proc sample, as shown by `servers -v`."""
+    state = "running" if stats['running'] else ("stale" if stats['stale'] else "stopped")
+    return (
+        state,
+        str(stats['pid']) if stats['pid'] else "-",
+        "%.0f MB" % (stats['rss'] / 1048576.0,) if stats['rss'] is not None else "-",
+        "%.1f%%" % (stats['cpu'],) if stats['cpu'] is not None else "-",
+        str(stats['threads']) if stats['threads'] is not None else "-",
+        str(stats['open_files']) if stats['open_files'] is not None else "-",
+        procstats.format_uptime(stats['uptime']),
+    )
+
+PROCESS_STATS_FORMAT = "%-8s %7s %9s %7s %7s %6s %8s"
+PROCESS_STATS_HEADER = PROCESS_STATS_FORMAT % ("STATE", "PID", "RSS", "CPU", "THREADS", "FILES", "UPTIME")
+
 def plugin_completer(prefix, **kwargs):
     """
     argcomplete completion handler for registered plugins
@@ -94,29 +123,31 @@ class ServerCreate(Command):
     )
 
     @classmethod
-    def download_spigot_jar(cls, options):
+    def spigot_jar_url(cls, options):
         if options.version != 'recommended':
             print "Version Ignored -- Only using daily builds of Spigot."
-        url = jenkins.PluginSource("md5", host="ci.md-5.net")._get_download_url("Spigot")
-        return download_file(url)
+        return jenkins.PluginSource("md5", host="ci.md-5.net")._get_download_url("Spigot")
 
     @classmethod
-    def download_craftbukkit_jar(cls, options):
+    def craftbukkit_jar_url(cls, options):
         versions = dict(dev='dev', beta='beta', recommended='rb')
         feed_url = "http://dl.bukkit.org/downloads/craftbukkit/feeds/latest-%s.rss" % (versions[options.version],)
         feed = feed_parse(feed_url)
         link = feed.entries[0].links[0]['href']
         parts = link.rsplit('/', 3)
-        url = '/'.join([parts[0], 'get'] + parts[2:3] + ['craftbukkit.jar'])
-        return download_file(url)
-
+        return '/'.join([parts[0], 'get'] + parts[2:3] + ['craftbukkit.jar'])
 
     @classmethod
-    def download_server_jar(cls, options):
+    def fetch_server_jar(cls, options):
+        """
+        Returns the path of the requested server jar in the shared server jar
+        cache, downloading it only if it isn't cached yet.
+        """
         if options.type == 'craftbukkit':
-            return cls.download_craftbukkit_jar(options)
+            url = cls.craftbukkit_jar_url(options)
         elif options.type == 'spigot':
-            return cls.download_spigot_jar(options)
+            url = cls.spigot_jar_url(options)
+        return ServerJarCache.get().fetch(url)
 
     @classmethod
     def execute(cls, options):
@@ -138,11 +169,10 @@ class ServerCreate(Command):
         else:
             os.mkdir(options.directory)
         jarpath = os.path.join(options.directory, "%s.jar" % (options.type,))
-        shutil.move(cls.download_server_jar(options), jarpath)
+        atomic_copy(cls.fetch_server_jar(options), jarpath, link=True)
         server = servers.Server(name, jarpath)
-        data = get_servers_file(create=True)
-        data[name] = {'path': jarpath, 'type': options.type, 'version': options.version}
-        save_servers_file(data)
+        with edit_servers_file(create=True) as data:
+            data[name] = {'path': jarpath, 'type': options.type, 'version': options.version}
 
 
 class ServerImport(Command):
@@ -163,15 +193,21 @@ class ServerImport(Command):
         except ServerNotFound:
             pass
         server = servers.Server(name, options.server_jar)
-        sfile = get_servers_file(create=True)
-        sfile[name] = dict(path=server.jarpath)
-        save_servers_file(sfile)
+        with edit_servers_file(create=True) as sfile:
+            sfile[name] = dict(path=server.jarpath)
         print "successfully imported new server %s" % (name,)
 
 
 class ServerRun(Command):
     name = 'run'
 
+    options = (
+        Option("--lag-interval", type=float, metavar="SECONDS",
+               help="ask the server for its TPS this often (default: the server's lag_sampler setting, 0 disables)."),
+        Option("--lag-command", action="append", metavar="COMMAND",
+               help="console command reporting the TPS (default: tps), may be given more than once."),
+    )
+
     @classmethod
     def execute(cls, options):
         server = get_server(options.server)
@@ -179,7 +215,67 @@ class ServerRun(Command):
             print "unknown server %s" % (options.server,)
             return 1
 
-        run_server(server)
+        run_server(server, lag_commands=options.lag_command, lag_interval=options.lag_interval)
+
+
+class ServerLag(Command):
+
+    name = 'lag'
+
+    options = (
+        Option("--since", "-s", default="1h", metavar="DURATION",
+               help="summarize this far back, e.g. 30m, 12h, 7d (default: 1h)."),
+        Option("--buckets", "-b", type=int, default=6, help="periods to break the summary into (0 for none)."),
+        JSON_OPTION,
+    )
+
+    @classmethod
+    def execute(cls, options):
+        server = get_server(options.server)
+        try:
+            since = lag.parse_duration(options.since)
+        except ValueError as e:
+            print e
+            return 1
+        end = time.time()
+        samples = lag.get_lag_log(server).samples(since=end - since)
+        summary = lag.summarize(samples)
+        rows = lag.timeline(samples, end - since, end, options.buckets) if options.buckets > 0 else []
+        if options.json:
+            summary['server'] = server.name
+            summary['since'] = end - since
+            summary['timeline'] = [{'start': start, 'tps': tps, 'overloaded': count, 'behind_ms': behind}
+                                   for start, tps, count, behind in rows]
+            emit_json(summary)
+            return
+
+        if not samples:
+            print "No lag samples for %s in the last %s." % (server.name, options.since)
+            print "Run the server with --lag-interval, or set lag_sampler in servers.yml, to sample its TPS."
+            return
+        clock = lambda t: datetime.fromtimestamp(t).strftime("%m-%d %H:%M:%S")
+        print "Lag of %s in the last %s (%s samples)" % (server.name, options.since, summary['samples'])
+        if 'tps' in summary:
+            tps = summary['tps']
+            print "  TPS: latest %.1f, average %.1f, lowest %.1f at %s" % (
+                tps['latest'], tps['average'], tps['min'], clock(tps['min_at']))
+        overloaded = summary['overloaded']
+        if overloaded['count']:
+            print "  Can't keep up: %s warnings, %s ms behind, %s ticks skipped, last at %s" % (
+                overloaded['count'], overloaded['behind_ms'], overloaded['skipped_ticks'], clock(overloaded['last_at']))
+        else:
+            print "  Can't keep up: no warnings"
+        if 'memory' in summary:
+            memory = summary['memory']
+            print "  Memory: %.0f MB used of %.0f MB allocated, at most %.0f MB" % (
+                memory['latest_mb'], memory['allocated_mb'], memory['max_mb'])
+        if rows:
+            print
+            print "  %-14s %7s %7s %9s %10s" % ("FROM", "AVG TPS", "MIN TPS", "WARNINGS", "BEHIND")
+            for start, tps, count, behind in rows:
+                print "  %-14s %7s %7s %9s %8sms" % (
+                    clock(start), "%.1f" % (tps['average'],) if tps else "-", "%.1f" % (tps['min'],) if tps else "-",
+                    count, behind)
 
 
 class ServerRemove(Command):
@@ -199,9 +295,8 @@ class ServerRemove(Command):
             print "unknown server %s" % (options.server,)
             sys.exit(1)
 
-        servers = get_servers_file()
-        del servers[server.name]
-        save_servers_file(servers)
+        with edit_servers_file() as servers:
+            servers.pop(server.name, None)
         print "server %s removed from registry." % (server.name,)
         if options.delete:
             if server.is_running():
@@ -222,31 +317,67 @@ class ServerInfo(Command):
 
     options = (
         Option('--verbose', '-v', action='count'),
+        JSON_OPTION,
     )
 
     @classmethod
-    def execute(cls, options):
-        server = get_server(options.server)
-        print "Server", server.name
-        print "=" * (len(server.name) + 7)
-        print "Running: %s" % (server.is_running(),)
-        print "Server Jar: %s" % (os.path.relpath(os.path.abspath(server.jarpath)))
+    def describe(cls, server, verbose=0):
+        process = procstats.collect([server])[server.name]
+        info = {
+            'name': server.name,
+            'running': process['running'],
+            'process': process,
+            'jar': os.path.relpath(os.path.abspath(server.jarpath)),
+            'jvm_profile': server.config.get('jvm_profile', jvm.DEFAULT_PROFILE),
+        }
+        try:
+            info['command'] = get_server_command(server)
+        except (jvm.UnknownProfile, ValueError) as e:
+            info['command'] = None
+            info['command_error'] = str(e)
 
-        if options.verbose:
-            if options.verbose >= 3:
+        if verbose:
+            if verbose >= 3:
                 keys = list(server.manifest.keys())
-            elif options.verbose >= 2:
+            elif verbose >= 2:
                 keys = ['Implementation-Title', 'Implementation-Version',
                         "Implementation-Vendor", "Build-Jdk", "Specification-Title", "Specification-Version"]
             else:
                 keys = ['Implementation-Title', 'Implementation-Version']
+            info['manifest'] = [(k, server.manifest.get(k, None)) for k in keys]
 
-            for k in keys:
-                print "    %s: %s" % (k, server.manifest[k])
+        info['plugins'] = [{'name': plugin.name, 'version': plugin.version, 'live': plugin.is_live()}
+                           for plugin in server.find_plugins()]
+        return info
+
+    @classmethod
+    def execute(cls, options):
+        server = get_server(options.server)
+        info = cls.describe(server, options.verbose)
+        if options.json:
+            info['manifest'] = dict(info.get('manifest', []))
+            emit_json(info)
+            return
+
+        print "Server", server.name
+        print "=" * (len(server.name) + 7)
+        print "Running: %s" % (info['running'],)
+        if info['running'] or info['process']['stale']:
+            print "Process: %s" % (PROCESS_STATS_HEADER,)
+            print "         %s" % (PROCESS_STATS_FORMAT % format_process_stats(info['process']),)
+        print "Server Jar: %s" % (info['jar'],)
+        print "JVM Profile: %s" % (info['jvm_profile'],)
+        if info['command'] is not None:
+            print "Command: %s" % (" ".join(info['command']),)
+        else:
+            print "Command: invalid JVM settings (%s)" % (info['command_error'],)
+
+        for k, v in info.get('manifest', []):
+            print "    %s: %s" % (k, v)
 
         print "Plugins:"
-        for plugin in server.find_plugins():
-            print "    %s %s" % (plugin, "" if plugin.is_live() else "(pending restart)")
+        for plugin in info['plugins']:
+            print "    %s-%s %s" % (plugin['name'], plugin['version'], "" if plugin['live'] else "(pending restart)")
 
 
 class ServerAddPlugin(Command):
@@ -334,28 +465,399 @@ class ServerUpdate(Command):
         ServerAddPlugin.install_plugins(server, lib, plugins)
 
 
+class ServerSync(Command):
+
+    name = 'sync'
+
+    options = (
+        Option("lockfile", metavar="LOCKFILE"),
+        Option("--dry-run", "-n", action="store_true", default=False, help="only show what would change."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        return Sync.sync(options, [server])
+
+
+class ServerBackup(Command):
+
+    name = 'backup'
+
+    options = (
+        Option("--list", "-l", action="store_true", default=False, help="list existing snapshots instead."),
+        Option("--threads", "-j", type=int, default=None, help="number of compression threads."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        store = BackupStore.get(server)
+        if options.list:
+            snapshots = store.snapshots()
+            if not snapshots:
+                print "No backups of %s." % (server.name,)
+            for name in snapshots:
+                print name
+            return 0
+        try:
+            name, stats = store.backup(server, threads=options.threads)
+        except (BackupError, ConsoleNotAvailable) as e:
+            print "Backup of %s failed: %s" % (server.name, e)
+            return 1
+        print "Created snapshot %s of %s: %s files (%s unchanged), read %.1f MB, stored %.1f MB in %s new chunks" % (
+            name, server.name, stats['files'], stats['unchanged'], stats['read'] / 1048576.0,
+            stats['stored'] / 1048576.0, stats['new'])
+
+
+class ServerRestore(Command):
+
+    name = 'restore'
+
+    options = (
+        Option("snapshot", metavar="SNAPSHOT", nargs="?", help="snapshot to restore (default: the latest)."),
+        Option("--threads", "-j", type=int, default=None),
+        Option("--yes", "-y", help="do not confirm overwriting the worlds.", dest='noconfirm', action="store_true", default=False),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        if server.is_running():
+            print "Cannot restore worlds while the server is running."
+            return 1
+        if not (options.noconfirm or query_yes_no(
+                "Replace the worlds of %s with snapshot %s?" % (server.name, options.snapshot or "(latest)"), default="no")):
+            return 1
+        try:
+            stats = BackupStore.get(server).restore(server, options.snapshot, threads=options.threads)
+        except BackupError as e:
+            print "Restore failed: %s" % (e,)
+            return 1
+        print "Restored %s of %s files, removed %s" % (stats['restored'], stats['files'], stats['removed'])
+
+
+class ServerWorldsAnalyze(Command):
+
+    name = 'analyze'
+
+    options = (
+        Option("--threshold", "-t", type=float, default=60.0,
+               help="chunks inhabited for fewer seconds than this are prunable."),
+        Option("--prune", action="store_true", default=False,
+               help="remove the prunable chunks (the server must be stopped)."),
+        Option("--top", "-n", type=int, default=5, help="number of largest regions to list per dimension."),
+        Option("--processes", "-j", type=int, default=None),
+        Option("--yes", "-y", help="do not confirm pruning.", dest='noconfirm', action="store_true", default=False),
+        JSON_OPTION,
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        if options.prune and server.is_running():
+            print "Cannot prune worlds while the server is running."
+            return 1
+
+        rootdir = server.get_root_dir()
+        regions = worlds.find_region_files(rootdir)
+        if not regions:
+            if not options.json:
+                print "No region files found for %s." % (server.name,)
+            return 1
+        dimension_of = dict((path, dimension) for dimension, path in regions)
+        threshold = int(options.threshold * worlds.TICKS_PER_SECOND)
+
+        dimensions = defaultdict(list)
+        for info in worlds.analyze_regions([path for _, path in regions], processes=options.processes):
+            dimensions[dimension_of[info['path']]].append({
+                'region': os.path.relpath(info['path'], rootdir),
+                'size': info['size'],
+                'chunks': len(info['chunks']),
+                'prunable': worlds.prunable_chunks(info, threshold),
+            })
+
+        for dimension in sorted(dimensions):
+            regs = sorted(dimensions[dimension], key=lambda r: -r['size'])
+            summary = {
+                'dimension': dimension,
+                'regions': len(regs),
+                'size': sum(r['size'] for r in regs),
+                'chunks': sum(r['chunks'] for r in regs),
+                'prunable': sum(len(r['prunable']) for r in regs),
+            }
+            if options.json:
+                summary['largest'] = [dict(r, prunable=len(r['prunable'])) for r in regs[:options.top]]
+                emit_json(summary)
+                continue
+            print "%s: %s regions, %s chunks, %.1f MB, %s chunks inhabited < %ss" % (
+                dimension, summary['regions'], summary['chunks'], summary['size'] / 1048576.0,
+                summary['prunable'], options.threshold)
+            for r in regs[:options.top]:
+                print "    %-40s %8.1f MB %5s chunks (%s prunable)" % (
+                    r['region'], r['size'] / 1048576.0, r['chunks'], len(r['prunable']))
+
+        if not options.prune:
+            return 0
+        pruning = dict((os.path.join(rootdir, r['region']), r['prunable'])
+                       for regs in dimensions.values() for r in regs if r['prunable'])
+        if not pruning:
+            if not options.json:
+                print "Nothing to prune."
+            return 0
+        count = sum(len(p) for p in pruning.values())
+        if not (options.noconfirm or query_yes_no(
+                "Permanently remove %s chunks from %s region files?" % (count, len(pruning)), default="no")):
+            return 1
+        # starting a server takes the same lock, so it can't start while the
+        # region files are rewritten
+        with server.lock():
+            if server.is_running():
+                print "Cannot prune worlds while the server is running."
+                return 1
+            freed = worlds.prune_regions(pruning, processes=options.processes)
+        if options.json:
+            emit_json({'pruned': count, 'regions': len(pruning), 'freed': freed})
+        else:
+            print "Pruned %s chunks, freed %.1f MB" % (count, freed / 1048576.0)
+
+
+class ServerWorlds(Command):
+
+    name = 'worlds'
+
+    subcommands = (
+        ServerWorldsAnalyze,
+    )
+
+
+class ServerLoadOrder(Command):
+
+    name = 'loadorder'
+
+    options = (
+        JSON_OPTION,
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        inventory = server.get_inventory()
+        order, failed = loadorder.load_order(inventory)
+        after, _ = loadorder.build_graph(inventory)
+        timings, timing_source = loadorder.get_enable_timings(server)
+        total, chain = loadorder.critical_path(order, after, timings)
+        dependents = defaultdict(int)
+        for name in order:
+            for dep in after[name]:
+                dependents[dep] += 1
+
+        if options.json:
+            for position, name in enumerate(order):
+                emit_json({'plugin': name, 'position': position + 1, 'load': inventory[name]['load'],
+                           'seconds': timings.get(name, None), 'dependents': dependents[name],
+                           'critical': name in chain})
+            for name, reason in sorted(failed.iteritems()):
+                emit_json({'plugin': name, 'position': None, 'error': reason})
+            return 0
+
+        if not inventory:
+            print "No plugins installed on %s." % (server.name,)
+            return 0
+        print "Enable order for %s%s:" % (server.name, " (timings from %s)" % (timing_source,) if timings else "")
+        for position, name in enumerate(order):
+            print "  %3s. %-30s %-9s %8s  %s%s" % (
+                position + 1, name, inventory[name]['load'],
+                "%.2fs" % (timings[name],) if name in timings else "",
+                "%s dependents" % (dependents[name],) if dependents[name] else "",
+                " *" if name in chain and len(chain) > 1 else "")
+        for name, reason in sorted(failed.iteritems()):
+            print "  %-35s will not load: %s" % (name, reason)
+
+        if timings:
+            print "Plugins took %.2fs to enable, the longest dependency chain (*) %.2fs: %s" % (
+                sum(timings.get(n, 0) for n in order), total, " -> ".join(chain))
+            slow = sorted([n for n in order if n in timings and not dependents[n]], key=lambda n: -timings[n])[:3]
+            if slow:
+                print "Slowest plugins nothing depends on: %s" % (
+                    ", ".join("%s (%.2fs)" % (n, timings[n]) for n in slow),)
+        else:
+            print "Longest dependency chain (*): %s" % (" -> ".join(chain),)
+            print "No enable timings yet, start the server with 'bukkit server %s run' to measure them." % (server.name,)
+
+
+class ServerStartups(Command):
+
+    name = 'startups'
+
+    options = (
+        Option("--limit", "-n", type=int, default=20, help="number of recent startups to show."),
+        Option("--threshold", "-t", type=float, default=10.0,
+               help="percentage by which startup must slow down to be reported."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            server = get_server(options.server, validate=False)
+        except ServerNotFound:
+            print "unknown server %s" % (options.server,)
+            return 1
+        history = server.get_startup_history()
+        if not history:
+            print "No startups recorded for %s yet." % (server.name,)
+            return 1
+
+        print "Startup history for %s (last %s of %s)" % (server.name, min(options.limit, len(history)), len(history))
+        for entry in history[-options.limit:]:
+            print "  %s  %8.3fs  %s  [plugins %s]" % (
+                datetime.fromtimestamp(entry['timestamp']).strftime("%Y-%m-%d %H:%M:%S"),
+                entry['duration'], entry.get('version') or 'unknown version', entry['plugins_digest'][:8])
+
+        regressions = find_startup_regressions(history, threshold=options.threshold / 100.0)
+        if not regressions:
+            print "No startup slowdowns found."
+            return 0
+        print "Startup got slower after:"
+        for reg in regressions:
+            changes = []
+            if reg['entry'].get('version') != reg['previous'].get('version'):
+                changes.append("server %s -> %s" % (reg['previous'].get('version'), reg['entry'].get('version')))
+            if reg['added']:
+                changes.append("added %s" % (", ".join(reg['added']),))
+            if reg['removed']:
+                changes.append("removed %s" % (", ".join(reg['removed']),))
+            for name, old, new in reg['updated']:
+                changes.append("updated %s %s -> %s" % (name, old, new))
+            print "  %s  %.3fs -> %.3fs (+%.0f%%): %s" % (
+                datetime.fromtimestamp(reg['entry']['timestamp']).strftime("%Y-%m-%d %H:%M:%S"),
+                reg['before'], reg['after'], (reg['after'] / reg['before'] - 1) * 100 if reg['before'] else 0,
+                "; ".join(changes) or "no plugin changes")
+
+
 class Servers(Command):
 
     name = 'servers'
 
     options = (
+        Option("action", nargs='?', choices=['list', 'upgrade-jar'], default='list'),
         Option("--verbose", "-v", action='count'),
+        JSON_OPTION,
+        Option("--type", "-t", choices=['craftbukkit', 'spigot'], default=None,
+               help="upgrade-jar: server type to upgrade (default: craftbukkit, or the type of --jar)."),
+        Option("--version", choices=['dev', 'beta', 'recommended'], default='recommended',
+               help="upgrade-jar: release channel to upgrade to."),
+        Option("--jar", metavar="PATH_TO_JAR", help="upgrade-jar: use this jar instead of downloading one."),
+        Option("--server", "-s", dest="names", metavar="SERVER_NAME", action="append", completer=server_name_completer,
+               help="upgrade-jar: only upgrade these servers (default: all servers of --type)."),
     )
 
     @classmethod
     def execute(cls, options):
         all_servers = servers.list_servers()
         if not all_servers:
-            print "No registered servers."
+            if not options.json:
+                print "No registered servers."
             return 1
 
-        for servername in list_servers():
-            server = get_server(servername, validate=False)
-            print servername,
+        if options.action == 'upgrade-jar':
+            return cls.upgrade_jar(options)
+
+        names = list_servers()
+        if options.verbose:
+            # every server sampled at once, they share the wait for cpu usage
+            stats = procstats.collect([get_server(name, validate=False) for name in names])
+            if not options.json:
+                width = max(len(name) for name in names)
+                print "%-*s %s" % (width, "NAME", PROCESS_STATS_HEADER)
+        for servername in names:
+            if options.json:
+                info = {'name': servername}
+                if options.verbose:
+                    info.update(stats[servername])
+                emit_json(info)
+                continue
             if not options.verbose:
-                print
+                print servername
                 continue
-            print "(%srunning)" % ("" if server.is_running() else "not ",)
+            print "%-*s %s" % (width, servername, PROCESS_STATS_FORMAT % format_process_stats(stats[servername]))
+
+    @classmethod
+    def upgrade_jar(cls, options):
+        cache = ServerJarCache.get()
+        if options.jar:
+            try:
+                jar_type = servers.Server("upgrade", options.jar).get_type()
+            except InvalidServerJar as e:
+                print "%s is not a valid server jar: %s" % (options.jar, e)
+                return 1
+            # a given jar only goes to servers of its own type
+            if options.type is not None and options.type != jar_type:
+                print "%s is a %s jar, not %s." % (options.jar, jar_type, options.type)
+                return 1
+            options.type = jar_type
+            newjar = cache.add(options.jar)
+        else:
+            options.type = options.type or 'craftbukkit'
+            newjar = ServerCreate.fetch_server_jar(options)
+        version = jar_version(newjar)
+
+        skipped = []
+        if options.names:
+            targets = []
+            for server in [get_server(name, validate=False) for name in options.names]:
+                if server.get_type() != options.type:
+                    print "%s: is a %s server, not putting a %s jar on it." % (server.name, server.get_type(), options.type)
+                    skipped.append(server)
+                else:
+                    targets.append(server)
+        else:
+            targets = [get_server(name, validate=False) for name in list_servers()]
+            targets = [s for s in targets if s.get_type() == options.type]
+        if not targets:
+            print "No %s servers to upgrade." % (options.type,)
+            return 1
+
+        def upgrade(server):
+            # starting a server takes the same lock, so it can't start
+            # between the check and the swap
+            with server.lock():
+                if os.path.exists(server.jarpath) and jar_version(server.jarpath) == version:
+                    return "%s: already running %s" % (server.name, version)
+                if server.is_running():
+                    server.stage_jar(newjar)
+                    return "%s: running, upgrade to %s queued for the next restart" % (server.name, version)
+                server.replace_jar(newjar)
+                return "%s: upgraded to %s" % (server.name, version)
+
+        pool = ThreadPool(min(8, len(targets)))
+        try:
+            for line in pool.imap(upgrade, targets):
+                print line
+        finally:
+            pool.close()
+        if skipped:
+            return 1
 
 
 class Server(Command):
@@ -374,6 +876,13 @@ class Server(Command):
         ServerCreate,
         ServerAddPlugin,
         ServerUpdate,
+        ServerStartups,
+        ServerSync,
+        ServerBackup,
+        ServerRestore,
+        ServerWorlds,
+        ServerLoadOrder,
+        ServerLag,
     )
 
 
@@ -423,6 +932,11 @@ class PluginUpdate(Command):
 
     name = 'update'
 
+    options = (
+        Option("--force", "-f", action="store_true", default=False,
+               help="ignore cached search and download url results and re-download."),
+    )
+
     @classmethod
     def execute(cls, options):
         lib = Library.get()
@@ -434,7 +948,7 @@ class PluginUpdate(Command):
 
         print "Checking for updates to %s" % (repr(plugin),)
         try:
-            if not lib.update_plugin(plugin):
+            if not lib.update_plugin(plugin, force=options.force):
                 print "No update found for %s" % (repr(plugin),)
                 return 1
         except NoPluginSource:
@@ -477,12 +991,11 @@ class PluginSetSource(Command):
         if not source:
             print "unknown source %s" % (options.source,)
             return 1
-        meta = plugin.get_meta()
-        if source.source_type == 'bukkitdev':
-            del meta['source']
-        else:
-            meta['source'] = source.name
-        plugin.set_meta(meta)
+        with plugin.edit_meta() as meta:
+            if source.source_type == 'bukkitdev':
+                meta.pop('source', None)
+            else:
+                meta['source'] = source.name
         print "%s now using source %s" % (plugin, source.name)
 
 class PluginAdd(Command):
@@ -490,7 +1003,10 @@ class PluginAdd(Command):
     name = 'add'
 
     options = (
-        Option("--source", "-s", default='bukkitdev', completer=plugin_source_completer),
+        Option("--source", "-s", default=None, completer=plugin_source_completer,
+               help="only search this source (default: search all sources at once)."),
+        Option("--timeout", type=float, default=DEFAULT_TIMEOUT, metavar="SECONDS",
+               help="give up on a source not done searching after this long (default: %s)." % (DEFAULT_TIMEOUT,)),
     )
 
     @classmethod
@@ -502,7 +1018,12 @@ class PluginAdd(Command):
             print "Plugin %s already installed." % (existing.name,)
             return 1
 
-        lib.register_new_plugin(options.plugin, source=options.source)
+        try:
+            lib.register_new_plugin(options.plugin, source=options.source, timeout=options.timeout)
+        except SearchFailed as e:
+            print "Searching failed, no source could be reached: %s" % (
+                ", ".join("%s (%s)" % item for item in sorted(e.errors.iteritems())),)
+            return 1
 
 
 class PluginInfo(Command):
@@ -511,8 +1032,47 @@ class PluginInfo(Command):
 
     options = (
         Option("--verbose", "-v", action='count'),
+        JSON_OPTION,
     )
 
+    @classmethod
+    def describe(cls, lib, plugin, verbose=0):
+        plugin_yml = plugin.plugin_yml
+        info = {
+            'name': plugin.name,
+            'version': plugin.version,
+            'website': plugin_yml.get('website', None),
+            'description': plugin_yml.get('description', None),
+            'source': lib.get_plugin_source(plugin).name,
+        }
+        if verbose:
+            info.update(
+                authors=plugin.authors,
+                file=os.path.relpath(plugin.jarpath),
+                dependencies=plugin.dependencies,
+                soft_dependencies=plugin.soft_dependencies,
+            )
+        return info
+
+    @classmethod
+    def show(cls, info):
+        print info['name']
+        print "=" * len(info['name'])
+        print "Version: %s" % (info['version'],)
+        if info['website']:
+            print "Website: %s" % (info['website'],)
+        if info['description']:
+            print "Description: %s" % (info['description'],)
+
+        print "Source: %s" % (info['source'],)
+        if 'authors' in info:
+            print "Author(s): %s" % (", ".join(info['authors'],),)
+            print "File: %s" % (info['file'],)
+            for k, v in (("Dependencies", info['dependencies']),
+                         ("Soft-Dependencies", info['soft_dependencies'])):
+                if v:
+                    print "%s: %s" % (k, ", ".join(v),)
+
     @classmethod
     def execute(cls, options):
         lib = Library.get()
@@ -520,22 +1080,11 @@ class PluginInfo(Command):
         if plugin is None:
             print "unknown plugin %s" % (options.plugin,)
             return 1
-        print plugin.name
-        print "=" * len(plugin.name)
-        print "Version: %s" % (plugin.version,)
-        if 'website' in plugin._plugin_yml:
-            print "Website: %s" % (plugin._plugin_yml['website'],)
-        if 'description' in plugin._plugin_yml:
-            print "Description: %s" % (plugin._plugin_yml['description'],)
-
-        print "Source: %s" % (lib.get_plugin_source(plugin).name,)
-        if options.verbose:
-            print "Author(s): %s" % (", ".join(plugin.authors,),)
-            print "File: %s" % (os.path.relpath(plugin.jarpath,))
-            for k, v in (("Dependencies", plugin.dependencies),
-                         ("Soft-Dependencies", plugin._plugin_yml.get('softdepend', None))):
-                if v:
-                    print "%s: %s" % (k, ", ".join(v),)
+        info = cls.describe(lib, plugin, options.verbose)
+        if options.json:
+            emit_json(info)
+        else:
+            cls.show(info)
 
 
 class Plugins(Command):
@@ -544,19 +1093,25 @@ class Plugins(Command):
 
     options = (
         Option("--verbose", '-v', action='count'),
+        JSON_OPTION,
     )
 
     @classmethod
     def execute(cls, options):
         lib = Library.get()
         if not lib.plugins:
-            print "No plugins found."
+            if not options.json:
+                print "No plugins found."
             return 1
 
         for plugin in lib.plugins:
-            if options.verbose >= 2:
-                suboptions = parser.parse_args(['plugin', plugin.name, 'info', '-v'])
-                PluginInfo.execute(suboptions)
+            if options.json:
+                if options.verbose:
+                    emit_json(PluginInfo.describe(lib, plugin, options.verbose - 1))
+                else:
+                    emit_json({'name': plugin.name, 'version': plugin.version})
+            elif options.verbose >= 2:
+                PluginInfo.show(PluginInfo.describe(lib, plugin, verbose=1))
                 print ""
             elif options.verbose:
                 print plugin
@@ -602,8 +1157,8 @@ class SourceRemove(Command):
             if not query_yes_no("Are you sure you wish to permanently remove this plugin source?"):
                 return 1
 
-        lib.remove_source(options.source.lower())
-        lib.save_sources()
+        with lib.edit_sources():
+            lib.remove_source(options.source.lower())
 
 
 class SourceAdd(Command):
@@ -611,8 +1166,8 @@ class SourceAdd(Command):
     name = 'add'
 
     options = (
-        Option("--type", "-t", choices=['jenkins'], default='jenkins'),
-        Option("--host", "-H", help="Hostname of plugin source."),
+        Option("--type", "-t", choices=['jenkins', 'mirror'], default='jenkins'),
+        Option("--host", "-H", help="Hostname of plugin source (host:port for mirrors)."),
     )
 
     @classmethod
@@ -622,13 +1177,13 @@ class SourceAdd(Command):
         if options.source in lowerkeys:
             print "source %s is already registered."
             return 1
-        if options.type.lower() == 'jenkins':
+        if options.type.lower() in ('jenkins', 'mirror'):
             if options.host is None:
-                print "Jenkins sources require a --host option"
+                print "%s sources require a --host option" % (options.type.capitalize(),)
                 return 1
             kwargs = {'host': options.host}
-        lib.add_source(options.source, type=options.type, **kwargs)
-        lib.save_sources()
+        with lib.edit_sources():
+            lib.add_source(options.source, type=options.type, **kwargs)
         print "Successfully registered new plugin source %s" % (options.source,)
 
 
@@ -650,17 +1205,288 @@ class Sources(Command):
 
     name = 'sources'
 
+    options = (
+        JSON_OPTION,
+    )
+
     @classmethod
     def execute(cls, options):
         lib = Library.get()
         for source in lib.sources.values():
-            if source.name == 'bukkitdev':
+            if options.json:
+                if source.source_type == 'bukkitdev':
+                    info = {'type': source.source_type}
+                else:
+                    info = source.serialize()
+                info.update(name=source.name, default=source.source_type == 'bukkitdev')
+                emit_json(info)
+            elif source.name == 'bukkitdev':
                 print "bukkitdev [default]"
             else:
                 print source.name,"(%s)" % (format_as_kwargs(source.serialize(), priority_keys=['type']),)
 
 
 
+class Lock(Command):
+
+    name = 'lock'
+
+    options = (
+        Option("plugins", metavar="PLUGIN_NAME", nargs="*", completer=plugin_completer,
+               help="only lock these library plugins and their dependencies."),
+        Option("--server", "-s", metavar="SERVER_NAME", completer=server_name_completer,
+               help="lock the plugins installed on a server instead of the library."),
+        Option("--output", "-o", metavar="FILE", help="write the lockfile here instead of stdout."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        if options.server:
+            try:
+                lock = lockfile.from_server(get_server(options.server, validate=False))
+            except ServerNotFound:
+                print "unknown server %s" % (options.server,)
+                return 1
+        else:
+            try:
+                lock = lockfile.from_library(Library.get(), options.plugins or None)
+            except PluginNotFound as e:
+                print "%s is not a registered plugin" % (e,)
+                return 1
+        if options.output:
+            lockfile.save(lock, options.output)
+            print "Locked %s plugins in %s" % (len(lock), options.output)
+        else:
+            lockfile.dump(lock, sys.stdout)
+
+
+class Sync(Command):
+
+    name = 'sync'
+
+    options = (
+        Option("lockfile", metavar="LOCKFILE"),
+        Option("servers", metavar="SERVER_NAME", nargs="*", completer=server_name_completer),
+        Option("--all", "-a", action="store_true", default=False, help="sync every registered server."),
+        Option("--dry-run", "-n", action="store_true", default=False, help="only show what would change."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        names = list_servers() if options.all else options.servers
+        if not names:
+            print "No servers to sync (name some, or use --all)."
+            return 1
+        try:
+            targets = [get_server(name, validate=False) for name in names]
+        except ServerNotFound as e:
+            print "unknown server %s" % (e,)
+            return 1
+        return cls.sync(options, targets)
+
+    @classmethod
+    def sync(cls, options, targets):
+        try:
+            lock = lockfile.load(options.lockfile)
+            results = list(lockfile.sync_servers(targets, Library.get(), lock, dry_run=options.dry_run))
+        except (IOError, lockfile.LockfileError) as e:
+            print "Unable to sync: %s" % (e,)
+            return 1
+        failed = False
+        for server, result in results:
+            if isinstance(result, Exception):
+                failed = True
+                print "%s: failed: %s" % (server.name, result)
+            elif not result:
+                print "%s: up to date" % (server.name,)
+            else:
+                print "%s: %s%s" % (server.name, "would " if options.dry_run else "", ", ".join(result))
+        return 1 if failed else 0
+
+
+class Shading(Command):
+
+    name = 'shading'
+
+    options = (
+        Option("--server", "-s", metavar="SERVER_NAME", completer=server_name_completer,
+               help="analyze a server's plugins instead of the library."),
+        Option("--top", "-n", type=int, default=20, help="number of duplicated packages to show."),
+        Option("--processes", "-j", type=int, default=None),
+        JSON_OPTION,
+    )
+
+    @classmethod
+    def execute(cls, options):
+        if options.server:
+            try:
+                server = get_server(options.server, validate=False)
+            except ServerNotFound:
+                print "unknown server %s" % (options.server,)
+                return 1
+            jars = dict((name, entry['path']) for name, entry in server.get_inventory().iteritems())
+        else:
+            jars = dict((p.name, p.jarpath) for p in Library.get().plugins)
+
+        duplicates = shading.find_duplicates(jars, processes=options.processes)
+        if options.json:
+            for dup in duplicates[:options.top]:
+                emit_json(dup)
+            return 0
+        if not duplicates:
+            print "No packages are bundled by more than one of %s plugins." % (len(jars),)
+            return 0
+        print "%s packages are bundled more than once, wasting ~%.1f MB of classes" % (
+            len(duplicates), sum(d['waste'] for d in duplicates) / 1048576.0)
+        for dup in duplicates[:options.top]:
+            print "  %-40s %8.1f KB wasted, %s classes in %s plugins: %s" % (
+                dup['package'], dup['waste'] / 1024.0, dup['classes'], len(dup['plugins']), ", ".join(dup['plugins']))
+            relocated = [p for p in dup['packages'] if p != dup['package']]
+            if relocated:
+                print "      also relocated as %s" % (", ".join(relocated),)
+
+
+class SupervisorRun(Command):
+
+    name = 'run'
+
+    options = (
+        Option("servers", metavar="SERVER_NAME", nargs="*", completer=server_name_completer,
+               help="servers to start right away (default: all registered servers)"),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        names = options.servers or list_servers()
+        sup = supervisor.Supervisor()
+        signal.signal(signal.SIGTERM, lambda sig, frame: sup.shutdown())
+        signal.signal(signal.SIGINT, lambda sig, frame: sup.shutdown())
+        sup.run(names)
+
+
+class SupervisorSend(Command):
+
+    name = 'send'
+
+    options = (
+        Option("target", metavar="SERVER_NAME", completer=server_name_completer,
+               help="server to send the command to, or '*' for all supervised servers"),
+        Option("command", metavar="COMMAND", nargs="+",
+               help="one of start, %s" % (", ".join(supervisor.CONSOLE_COMMANDS),)),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            reply = request(supervisor.get_control_socket_path(),
+                            " ".join([options.target] + options.command))
+        except ConsoleNotAvailable:
+            print "The supervisor is not running."
+            return 1
+        print reply
+        if not reply.startswith("ok"):
+            return 1
+
+
+class Supervisor(Command):
+
+    name = 'supervisor'
+
+    subcommands = (
+        SupervisorRun,
+        SupervisorSend,
+    )
+
+
+class MirrorServe(Command):
+
+    name = 'serve'
+
+    options = (
+        Option("--bind", "-b", default="0.0.0.0", help="address to listen on."),
+        Option("--port", "-p", type=int, default=mirror.DEFAULT_PORT),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        try:
+            mirror.serve(Library.get(), bind=options.bind, port=options.port)
+        except KeyboardInterrupt:
+            return 0
+
+
+class Mirror(Command):
+
+    name = 'mirror'
+
+    subcommands = (
+        MirrorServe,
+    )
+
+
+class LibraryExport(Command):
+
+    name = 'export'
+
+    options = (
+        Option("bundle", metavar="BUNDLE", help="file to write, or - for stdout."),
+        Option("plugins", metavar="PLUGIN_NAME", nargs="*", completer=plugin_completer,
+               help="only export these plugins (default: the whole library)."),
+        Option("--append", "-a", action="store_true", default=False,
+               help="add to an existing bundle, only writing jars it doesn't have."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        lib = Library.get()
+        out = sys.stdout if options.bundle == '-' else options.bundle
+        try:
+            manifest = export_library(lib, out, names=options.plugins or None, append=options.append)
+        except BundleError as e:
+            print >>sys.stderr, e
+            return 1
+        if out is not sys.stdout:
+            size = sum(entry['size'] for entry in manifest['files'].values())
+            print "Exported %s plugins (%.1f MB) to %s" % (len(manifest['plugins']), size / 1048576.0, options.bundle)
+
+
+class LibraryImport(Command):
+
+    name = 'import'
+
+    options = (
+        Option("bundle", metavar="BUNDLE"),
+        Option("--force", "-f", action="store_true", default=False,
+               help="replace plugins the library already has when they differ."),
+        Option("--jobs", "-j", type=int, default=8, help="files to verify and place at once."),
+    )
+
+    @classmethod
+    def execute(cls, options):
+        lib = Library.get()
+        try:
+            result = import_bundle(lib, options.bundle, threads=options.jobs, force=options.force)
+        except BundleError as e:
+            print e
+            return 1
+        for name in result['imported']:
+            print "Imported plugin %s" % (lib.get_plugin(name),)
+        for name in result['sources']:
+            print "Registered plugin source %s" % (name,)
+        if result['skipped']:
+            print "Skipped %s plugins already in the library: %s" % (len(result['skipped']), ", ".join(result['skipped']))
+
+
+class PluginLibrary(Command):
+
+    name = 'library'
+
+    subcommands = (
+        LibraryExport,
+        LibraryImport,
+    )
+
+
 class Init(Command):
 
     name = 'init'
@@ -668,47 +1494,45 @@ class Init(Command):
     options = (
         Option('target_dir', metavar="DIRECTORY", nargs = '?'),
         Option("--import", "-i", dest="do_import", action="store_true", default=False),
-        Option("--plugins", "-p", action='store_true', default=False)
+        Option("--plugins", "-p", action='store_true', default=False),
+        Option("--jobs", "-j", type=int, default=8, help="--import: directories to scan at once."),
     )
 
     @classmethod
     def import_root(cls, options):
-        old_dir = os.getcwd()
         with chdir(options.target_dir):
             if not os.path.exists("plugin-library"):
                 os.mkdir("plugin-library")
 
-            for e in os.listdir("."):
-                if not os.path.isdir(e):
-                    continue
-                if e == 'plugin-library':
-                    continue
-                _serv = None
-                for f in os.listdir(e):
-                    if f.endswith(".jar"):
-                        try:
-                            _serv = servers.Server(e, os.path.join(e,f), validate=True)
-                            break
-                        except InvalidServerJar:
-                            continue
-                if _serv is None:
-                    print "No server jar found in %s" % (e,)
-                    continue
-                print "Imported server %s" % (_serv.name,)
-
-                data = get_servers_file(create=True)
-                data[e] = dict(path=_serv.jarpath)
-                save_servers_file(data)
-                if options.plugins:
-                    lib = Library.get()
-                    for plugin in _serv.find_plugins():
-                        existing = lib.get_plugin(plugin.name)
-                        if existing:
-                            continue
+            dirs = sorted(e for e in os.listdir(".") if os.path.isdir(e) and e != 'plugin-library')
 
-                        lib.register_new_plugin(plugin.name, jarpath=plugin.jarpath)
-                        print "Imported plugin %s" % (lib.get_plugin(plugin.name),)
+            def scan(e):
+                server = servers.find_server_jar(e, e)
+                plugins = server.find_plugins() if server is not None and options.plugins else []
+                return e, server, plugins
 
+            found = []
+            if dirs:
+                pool = ThreadPool(max(1, min(options.jobs, len(dirs))))
+                try:
+                    for e, server, plugins in pool.imap(scan, dirs):
+                        if server is None:
+                            print "No server jar found in %s" % (e,)
+                            continue
+                        print "Imported server %s" % (server.name,)
+                        found.append((server, plugins))
+                finally:
+                    pool.close()
+
+            if found:
+                with edit_servers_file(create=True) as data:
+                    for server, _ in found:
+                        data[server.name] = dict(path=server.jarpath)
+            if options.plugins:
+                lib = Library.get()
+                added = lib.register_plugin_jars([p for _, plugins in found for p in plugins], threads=options.jobs)
+                for plugin in added:
+                    print "Imported plugin %s" % (plugin,)
 
 
     @classmethod
@@ -733,6 +1557,8 @@ class Init(Command):
 
 
 parser = argparse.ArgumentParser(version=__version__)
+parser.add_argument("--json", action="store_true", default=False,
+                    help="print one JSON object per line instead of text, where supported.")
 subparsers = parser.add_subparsers()
 
 Server.register_command(subparsers)
@@ -742,6 +1568,12 @@ Plugins.register_command(subparsers)
 Servers.register_command(subparsers)
 Sources.register_command(subparsers)
 Init.register_command(subparsers)
+Supervisor.register_command(subparsers)
+Mirror.register_command(subparsers)
+PluginLibrary.register_command(subparsers)
+Lock.register_command(subparsers)
+Sync.register_command(subparsers)
+Shading.register_command(subparsers)
 
 def main():
     argcomplete.autocomplete(parser)
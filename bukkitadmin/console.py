@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+
+import os
+import socket
+import threading
+
+SOCKET_NAME = ".console.sock"
+
+
+class ConsoleNotAvailable(Exception):
+    pass
+
+
+def get_console_socket_path(server):
+    return os.path.join(server.get_root_dir(), SOCKET_NAME)
+
+
+def bind_socket(path):
+    """
+    Bind a listening unix socket at `path`, replacing a stale socket file
+    left behind by a process that didn't shut down cleanly.
+
+    """
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)
+        else:
+            raise IOError("%s is already in use" % (path,))
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(5)
+    return sock
+
+
+def request(path, line, timeout=30):
+    """
+    Send a single line to the socket at `path` and return the single line
+    reply (without the trailing newline).
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise ConsoleNotAvailable(path)
+    try:
+        sock.sendall(line.strip() + "\n")
+        reply = ""
+        while not reply.endswith("\n"):
+            data = sock.recv(4096)
+            if not data:
+                break
+            reply += data
+    finally:
+        sock.close()
+    return reply.strip()
+
+
+def send_command(server, command, timeout=30):
+    """
+    Send `command` to the console of a running server, whether it was started
+    by `server run` or by the supervisor.
+
+    """
+    reply = request(get_console_socket_path(server), command, timeout=timeout)
+    if not reply.startswith("ok"):
+        raise ConsoleNotAvailable(reply)
+    return reply
+
+
+class ConsoleListener(threading.Thread):
+    """
+    Accepts connections on a server's console socket and passes each line
+    received to `send`.  Used by run_server, whose main thread is busy
+    relaying the terminal to the JVM.
+
+    """
+
+    def __init__(self, path, send):
+        super(ConsoleListener, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.send = send
+        self.sock = bind_socket(path)
+        self.sock.settimeout(1)
+        self._stopped = False
+
+    def run(self):
+        while not self._stopped:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            try:
+                conn.settimeout(30)
+                line = conn.makefile().readline().strip()
+                if line:
+                    self.send(line)
+                conn.sendall("ok\n")
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+    def close(self):
+        self._stopped = True
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -6,7 +6,16 @@ import re
 from time import mktime
 import urllib
 
-from .util import download_file, get_page_soup, string_diff, get_request_session, feed_parse
+from .util import download_file, get_page_soup, get_result_cache, string_diff, get_request_session, feed_parse, tag_strainer
+
+
+# the build page is only read for the module links after the 'Module Builds'
+# heading, the module page only for its artifact list
+BUILD_STRAINER = tag_strainer(("h2", None), ("a", None))
+ARTIFACT_STRAINER = tag_strainer(("table", "fileList"))
+
+# lastSuccessfulBuild moves, so resolved artifacts are only reused for a while
+ARTIFACT_TTL = 60 * 60
 
 
 class PluginSource(object):
@@ -44,13 +53,17 @@ class PluginSource(object):
         return {'type': self.source_type, 'host': self.host}
 
     def _get_download_url(self, plugin_name):
+        return get_result_cache().cached("jenkins:%s.artifact" % (self.host,), plugin_name, ARTIFACT_TTL,
+                                         self._resolve_artifact, plugin_name)
+
+    def _resolve_artifact(self, plugin_name):
         url = "http://%s/job/%s/lastSuccessfulBuild/" % (self.host, plugin_name)
-        soup = get_page_soup(url)
+        soup = get_page_soup(url, parse_only=BUILD_STRAINER)
 
         h2 = soup.find('h2', text='Module Builds')
 
-        url += urllib.quote(h2.nextSibling.find('a', text=re.compile(r'^' + re.escape(plugin_name) + '.?$', re.IGNORECASE))['href'])
-        soup = get_page_soup(url)
+        url += urllib.quote(h2.find_next('a', text=re.compile(r'^' + re.escape(plugin_name) + '.?$', re.IGNORECASE))['href'])
+        soup = get_page_soup(url, parse_only=ARTIFACT_STRAINER)
         links = filter(lambda e: not (e.text.endswith("-sources.jar") or e.text.endswith("-javadoc.jar")), soup.find('table', {'class': 'fileList'}).findAll('a', text=re.compile(r'.*\.jar')))
         url += urllib.quote(links[0]['href'])
         return url
@@ -58,6 +71,12 @@ class PluginSource(object):
     def get_download_url(self, plugin):
         return self._get_download_url(plugin.name)
 
+    def invalidate(self, plugin):
+        get_result_cache().invalidate(key=plugin.name, namespace="jenkins:%s.artifact" % (self.host,))
+
+    def download(self, url):
+        return download_file(url)
+
     def download_plugin(self, plugin):
         url = self.get_download_url(plugin)
-        return download_file(url)
+        return self.download(url)
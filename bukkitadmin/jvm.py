@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+
+import os
+
+# servers.yml key holding the user defined profiles, it is never a server name.
+PROFILES_KEY = '.jvm-profiles'
+
+DEFAULT_PROFILE = 'default'
+
+BUILTIN_PROFILES = {
+    # plain 'java -jar', what bukkitadmin has always done
+    'default': {},
+    'auto': {'heap': 'auto', 'gc': 'g1', 'gc_pause': 100, 'pretouch': True},
+    'zgc': {'heap': 'auto', 'gc': 'zgc', 'pretouch': True},
+}
+
+GC_FLAGS = {
+    'g1': ['-XX:+UseG1GC'],
+    'zgc': ['-XX:+UseZGC'],
+    'parallel': ['-XX:+UseParallelGC'],
+}
+
+# heap given to the OS and everything else before splitting RAM between servers
+AUTO_HEAP_RESERVED = 1024
+AUTO_HEAP_MIN = 512
+# stay below the compressed oops limit
+AUTO_HEAP_MAX = 31 * 1024
+
+CGROUP_MEMORY_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+class UnknownProfile(Exception):
+    pass
+
+
+def get_host_memory():
+    """
+    Total memory available to us in MB, honouring a cgroup memory limit.
+    """
+    total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as limitfile:
+                limit = limitfile.read().strip()
+        except IOError:
+            continue
+        if limit.isdigit():
+            total = min(total, int(limit))
+    return total // (1024 * 1024)
+
+
+def auto_heap_size(server_count, host_memory=None):
+    """
+    Split the host's memory between `server_count` servers, in MB.
+    """
+    if host_memory is None:
+        host_memory = get_host_memory()
+    reserved = max(AUTO_HEAP_RESERVED, host_memory // 10)
+    heap = (host_memory - reserved) // max(1, server_count)
+    heap -= heap % 256
+    return max(AUTO_HEAP_MIN, min(AUTO_HEAP_MAX, heap))
+
+
+def resolve_profile(server_config, profiles=None):
+    """
+    Merge the profile named by the server's `jvm_profile` setting with the
+    server's own `jvm` overrides.  User profiles from servers.yml take
+    precedence over the builtin ones.
+    """
+    server_config = server_config or {}
+    available = dict(BUILTIN_PROFILES)
+    available.update(profiles or {})
+    name = server_config.get('jvm_profile', DEFAULT_PROFILE)
+    if name not in available:
+        raise UnknownProfile("Unknown JVM profile %s" % (name,))
+    profile = dict(available[name])
+    profile.update(server_config.get('jvm', None) or {})
+    return profile
+
+
+def build_command(jarname, profile, server_count=1, host_memory=None):
+    """
+    Build the java command line for running `jarname` with `profile`.
+
+    Recognised profile keys are java, heap (e.g. 4G, or 'auto' to split host
+    memory between all registered servers), min_heap, gc (g1, zgc or
+    parallel), gc_pause, pretouch, large_pages, flags (extra JVM flags) and
+    args (extra server arguments).
+    """
+    command = [profile.get('java', 'java')]
+
+    heap = profile.get('heap', None)
+    if heap == 'auto':
+        heap = "%sM" % (auto_heap_size(server_count, host_memory),)
+    if heap:
+        command.append("-Xmx%s" % (heap,))
+        min_heap = profile.get('min_heap', None)
+        if min_heap is None and profile.get('pretouch', False):
+            # pre-touching is only useful if the whole heap is committed upfront
+            min_heap = heap
+        if min_heap:
+            command.append("-Xms%s" % (min_heap,))
+
+    gc = profile.get('gc', None)
+    if gc:
+        if gc not in GC_FLAGS:
+            raise ValueError("Unknown garbage collector %s" % (gc,))
+        if gc == 'zgc':
+            command.append('-XX:+UnlockExperimentalVMOptions')
+        command.extend(GC_FLAGS[gc])
+        if profile.get('gc_pause', None):
+            command.append("-XX:MaxGCPauseMillis=%s" % (profile['gc_pause'],))
+
+    if profile.get('pretouch', False):
+        command.append('-XX:+AlwaysPreTouch')
+    if profile.get('large_pages', False):
+        command.append('-XX:+UseLargePages')
+    command.extend(profile.get('flags', None) or [])
+
+    command.extend(['-jar', jarname])
+    command.extend(profile.get('args', None) or [])
+    return [str(c) for c in command]
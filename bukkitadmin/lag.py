@@ -0,0 +1,236 @@
+"""
+TPS and lag history of a server, taken from its console output.
+
+A LagSampler watches the console for TPS reports (Spigot's `tps`,
+Essentials' `lag`/`gc`) and "Can't keep up!" warnings, and can ask for a
+report every so often.  Samples go to a fixed size ring buffer file in the
+server directory, so the history never grows past a few hundred KB.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import struct
+import threading
+import time
+
+from .locking import locked
+
+LAG_FILE = ".lag-history"
+DEFAULT_CAPACITY = 16384
+
+# sample kinds
+TPS = 1
+OVERLOADED = 2
+MEMORY = 3
+KIND_NAMES = {TPS: 'tps', OVERLOADED: 'overloaded', MEMORY: 'memory'}
+
+MAGIC = "LAG1"
+# magic, capacity, samples ever written
+HEADER = struct.Struct("<4sIQ")
+# timestamp, kind, value, extra: tps and nothing, ms behind and skipped
+# ticks, or used and allocated MB
+RECORD = struct.Struct("<dBff")
+
+COLOR_RE = re.compile(r'(?:\xc2\xa7|\xa7)[0-9a-fk-or]|\x1b\[[0-9;]*m')
+OVERLOADED_RE = re.compile(r"Can't keep up!(?:.*?Running (\d+)ms behind, skipping (\d+) tick)?")
+TPS_RE = re.compile(r"TPS from last 1m, 5m, 15m: \*?(\d+(?:\.\d+)?)|Current TPS = (\d+(?:\.\d+)?)")
+MEMORY_RE = re.compile(r"(Allocated|Free) memory: ([\d,]+) MB")
+
+DURATION_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhd]?)$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class LagLog(object):
+    """
+    A ring buffer of (timestamp, kind, value, extra) samples in a file: the
+    newest `capacity` samples are kept, each one is a 17 byte record.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+
+    def _read_header(self, f):
+        f.seek(0)
+        data = f.read(HEADER.size)
+        if len(data) == HEADER.size:
+            magic, capacity, written = HEADER.unpack(data)
+            if magic == MAGIC and capacity:
+                return capacity, written
+        return None
+
+    def append(self, kind, value, extra=0.0, timestamp=None):
+        timestamp = timestamp or time.time()
+        with locked(self.path):
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b') as f:
+                # a file we can't make sense of is started over
+                capacity, written = self._read_header(f) or (self.capacity, 0)
+                f.seek(HEADER.size + (written % capacity) * RECORD.size)
+                f.write(RECORD.pack(timestamp, kind, value, extra))
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, capacity, written + 1))
+
+    def samples(self, since=None):
+        """The samples in the order they were taken, optionally only those newer than `since`."""
+        with locked(self.path, exclusive=False):
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, 'rb') as f:
+                header = self._read_header(f)
+                if header is None:
+                    return []
+                capacity, written = header
+                data = f.read(capacity * RECORD.size)
+        count = min(written, capacity, len(data) // RECORD.size)
+        samples = []
+        for index in range(written - count, written):
+            sample = RECORD.unpack_from(data, (index % capacity) * RECORD.size)
+            if since is None or sample[0] >= since:
+                samples.append(sample)
+        return samples
+
+
+def get_lag_log(server):
+    return LagLog(os.path.join(os.path.abspath(server.get_root_dir()), LAG_FILE))
+
+
+def get_sampler_settings(server):
+    """
+    (commands, interval) of the server's `lag_sampler` setting in
+    servers.yml, e.g. {'command': 'tps', 'interval': 60}.  No interval means
+    no commands are sent, the console is only watched.
+    """
+    settings = (server.config or {}).get('lag_sampler', None) or {}
+    commands = settings.get('command', None) or ['tps']
+    if isinstance(commands, basestring):
+        commands = [commands]
+    return list(commands), float(settings.get('interval', None) or 0)
+
+
+class LagSampler(object):
+    """
+    Records TPS reports and "Can't keep up!" warnings seen in a server's
+    console output.  With an interval, poll() sends `commands` through
+    `send` whenever a new report is due.
+    """
+
+    def __init__(self, server, send=None, commands=('tps',), interval=0, clock=time.time, log=None):
+        self.log = log or get_lag_log(server)
+        self.send = send
+        self.commands = list(commands)
+        self.interval = interval
+        self.clock = clock
+        self._next_poll = None
+        self._allocated = None
+        self._partial = ""
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def feed(self, data):
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()[-1024:]
+        now = self.clock()
+        for line in lines:
+            self.parse_line(COLOR_RE.sub("", line), now)
+        return data
+
+    def parse_line(self, line, now):
+        match = OVERLOADED_RE.search(line)
+        if match:
+            behind, skipped = match.groups()
+            self.log.append(OVERLOADED, float(behind or 0), float(skipped or 0), timestamp=now)
+            return
+        match = TPS_RE.search(line)
+        if match:
+            self.log.append(TPS, float(match.group(1) or match.group(2)), timestamp=now)
+            return
+        match = MEMORY_RE.search(line)
+        if match:
+            megabytes = float(match.group(2).replace(",", ""))
+            if match.group(1) == 'Allocated':
+                self._allocated = megabytes
+            elif self._allocated is not None:
+                self.log.append(MEMORY, self._allocated - megabytes, self._allocated, timestamp=now)
+                self._allocated = None
+
+    def poll(self):
+        """Send the report commands if one is due."""
+        if not (self.interval and self.send and self.commands):
+            return
+        now = self.clock()
+        if self._next_poll is None:
+            # give the server the interval to start up first
+            self._next_poll = now + self.interval
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.interval
+        for command in self.commands:
+            self.send(command)
+
+    def start(self):
+        """Poll from a thread, for consoles we can't add a timer to."""
+        def run():
+            while not self._stopped.wait(1.0):
+                self.poll()
+        self._thread = threading.Thread(target=run, name="lag sampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def parse_duration(value):
+    """Seconds in '90', '90s', '30m', '12h' or '7d'."""
+    match = DURATION_RE.match(value.strip().lower())
+    if match is None:
+        raise ValueError("invalid duration %s" % (value,))
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def _tps_summary(tps):
+    values = [s[2] for s in tps]
+    lowest = min(tps, key=lambda s: s[2])
+    return {'samples': len(values), 'average': round(sum(values) / len(values), 2),
+            'min': round(lowest[2], 2), 'min_at': lowest[0], 'latest': round(values[-1], 2)}
+
+
+def summarize(samples):
+    """Sum up lag samples: TPS statistics, overload warnings and memory use."""
+    summary = {'samples': len(samples)}
+    if samples:
+        summary['first'], summary['last'] = samples[0][0], samples[-1][0]
+    tps = [s for s in samples if s[1] == TPS]
+    if tps:
+        summary['tps'] = _tps_summary(tps)
+    overloaded = [s for s in samples if s[1] == OVERLOADED]
+    summary['overloaded'] = {
+        'count': len(overloaded),
+        'behind_ms': int(sum(s[2] for s in overloaded)),
+        'skipped_ticks': int(sum(s[3] for s in overloaded)),
+        'last_at': overloaded[-1][0] if overloaded else None,
+    }
+    memory = [s for s in samples if s[1] == MEMORY]
+    if memory:
+        summary['memory'] = {'latest_mb': memory[-1][2], 'max_mb': max(s[2] for s in memory),
+                             'allocated_mb': memory[-1][3]}
+    return summary
+
+
+def timeline(samples, start, end, buckets):
+    """
+    Split [start, end) into `buckets` equal periods: [(period start, TPS
+    summary or None, overload warnings, ms behind)].
+    """
+    width = (end - start) / float(buckets)
+    rows = []
+    for i in range(buckets):
+        lo, hi = start + i * width, start + (i + 1) * width
+        period = [s for s in samples if lo <= s[0] < hi]
+        tps = [s for s in period if s[1] == TPS]
+        overloaded = [s for s in period if s[1] == OVERLOADED]
+        rows.append((lo, _tps_summary(tps) if tps else None, len(overloaded), int(sum(s[2] for s in overloaded))))
+    return rows
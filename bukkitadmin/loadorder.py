@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+
+import os
+import re
+
+PHASES = ('STARTUP', 'POSTWORLD')
+
+LOG_TIME_RE = re.compile(r'(\d\d):(\d\d):(\d\d)')
+LOG_ENABLING_RE = re.compile(r'\] Enabling (\S+) v')
+LOG_BOUNDARY_RE = re.compile(r'Preparing (level|start region)|Done \(')
+
+
+def build_graph(inventory):
+    """
+    The load graph of a server's plugins from its inventory, returns
+    ({name: set of plugins it must load after}, {name: missing hard
+    dependencies}).  Soft dependencies and loadbefore only add edges between
+    installed plugins.
+    """
+    names = dict((name.lower(), name) for name in inventory)
+    after = dict((name, set()) for name in inventory)
+    missing = {}
+    for name, entry in inventory.iteritems():
+        for dep in entry.get('depend', None) or []:
+            if dep.lower() in names:
+                after[name].add(names[dep.lower()])
+            else:
+                missing.setdefault(name, []).append(dep)
+        for dep in entry.get('softdepend', None) or []:
+            if dep.lower() in names:
+                after[name].add(names[dep.lower()])
+        for other in entry.get('loadbefore', None) or []:
+            if other.lower() in names:
+                after[names[other.lower()]].add(name)
+        after[name].discard(name)
+    return after, missing
+
+
+def _topological(names, after, hard):
+    """
+    Order `names` so every plugin comes after the ones in `after`, breaking
+    cycles by ignoring soft edges first.  Returns (order, plugins stuck in a
+    cycle of hard dependencies).
+    """
+    names = set(names)
+    edges = dict((n, set(after[n]) & names) for n in names)
+    order = []
+    while names:
+        ready = sorted(n for n in names if not edges[n] & names)
+        if not ready:
+            soft = [n for n in sorted(names) if (edges[n] & names) - hard.get(n, set())]
+            if not soft:
+                return order, sorted(names)
+            # drop the soft edges of one plugin in the cycle and carry on
+            edges[soft[0]] &= hard.get(soft[0], set())
+            continue
+        order.extend(ready)
+        names.difference_update(ready)
+    return order, []
+
+
+def load_order(inventory):
+    """
+    The order the server will enable its plugins in: STARTUP plugins before
+    the worlds are loaded, then POSTWORLD ones, each respecting their
+    dependencies.  Returns (order, {plugin: reason it won't be enabled}).
+    """
+    after, missing = build_graph(inventory)
+    names = dict((name.lower(), name) for name in inventory)
+    hard = dict((name, set(names[d.lower()] for d in inventory[name].get('depend', None) or [] if d.lower() in names))
+                for name in inventory)
+
+    failed = dict((name, "missing dependency %s" % (", ".join(deps),)) for name, deps in missing.iteritems())
+    # anything needing a plugin that won't load doesn't load either
+    changed = True
+    while changed:
+        changed = False
+        for name in inventory:
+            if name in failed:
+                continue
+            broken = sorted(dep for dep in hard[name] if dep in failed)
+            if broken:
+                failed[name] = "depends on %s which won't load" % (", ".join(broken),)
+                changed = True
+
+    order = []
+    for phase in PHASES:
+        phase_names = [n for n in inventory if n not in failed and inventory[n].get('load', 'POSTWORLD') == phase]
+        phase_order, cycle = _topological(phase_names, after, hard)
+        order.extend(phase_order)
+        for name in cycle:
+            failed[name] = "circular dependency"
+    return order, failed
+
+
+def critical_path(order, after, timings=None):
+    """
+    The longest chain of dependencies in `order`, weighted by the enable
+    timings when given or counting plugins otherwise.  Returns (weight,
+    chain from first to last plugin).
+    """
+    timings = timings or {}
+    best = {}
+    for name in order:
+        weight = timings.get(name, 0.0) if timings else 1
+        previous = sorted(p for p in after.get(name, ()) if p in best)
+        parent = max(previous, key=lambda p: best[p][0]) if previous else None
+        best[name] = ((best[parent][0] if parent else 0) + weight, parent)
+    if not best:
+        return 0, []
+    name = max(best, key=lambda n: best[n][0])
+    total = best[name][0]
+    chain = []
+    while name is not None:
+        chain.append(name)
+        name = best[name][1]
+    return total, list(reversed(chain))
+
+
+def parse_log_timings(lines):
+    """
+    Estimate plugin enable times from console log lines, to the second: each
+    plugin runs until the next plugin starts enabling or the worlds load.
+    """
+    timings = {}
+    current = None
+    for line in lines:
+        enabling = LOG_ENABLING_RE.search(line)
+        boundary = enabling is None and LOG_BOUNDARY_RE.search(line)
+        if not (enabling or boundary):
+            continue
+        stamp = LOG_TIME_RE.search(line)
+        if stamp is None:
+            continue
+        h, m, s = [int(x) for x in stamp.groups()]
+        now = h * 3600 + m * 60 + s
+        if current is not None:
+            name, started = current
+            timings[name] = float((now - started) % 86400)
+            current = None
+        if enabling:
+            current = (enabling.group(1), now)
+    return timings
+
+
+def get_enable_timings(server):
+    """
+    Plugin enable timings of the last startup: measured by the startup
+    watcher if we ran the server, otherwise estimated from logs/latest.log.
+    Returns ({name: seconds}, where they came from).
+    """
+    for entry in reversed(server.get_startup_history()):
+        if entry.get('plugin_timings'):
+            return entry['plugin_timings'], "startup history"
+    logpath = os.path.join(server.get_root_dir(), "logs", "latest.log")
+    if os.path.exists(logpath):
+        with open(logpath) as logfile:
+            timings = parse_log_timings(logfile)
+        if timings:
+            return timings, logpath
+    return {}, None
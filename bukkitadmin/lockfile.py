@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+
+import binascii
+import os
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+from .plugins import PluginFile, PluginNotFound
+from .util import hashfile
+
+
+class LockfileError(Exception):
+    pass
+
+
+def from_server(server):
+    """
+    Lock the plugins installed on `server`, {name: {'version', 'sha256'}}.
+    """
+    return dict((name, {'version': entry['version'], 'sha256': entry['sha256']})
+                for name, entry in server.get_inventory().iteritems())
+
+
+def from_library(library, names=None):
+    """
+    Lock the library's plugins, or only `names` and their dependencies.
+    """
+    if names is None:
+        plugins = library.plugins
+    else:
+        plugins = []
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            plugin = library.get_plugin(name)
+            if plugin is None:
+                raise PluginNotFound(name)
+            if plugin in plugins:
+                continue
+            plugins.append(plugin)
+            pending.extend(plugin.dependencies)
+    return dict((p.name, {'version': str(p.version), 'sha256': binascii.hexlify(p.shasum)}) for p in plugins)
+
+
+def load(path):
+    with open(path) as lockfile:
+        data = yaml.load(lockfile) or {}
+    if not isinstance(data.get('plugins', None), dict):
+        raise LockfileError("%s is not a plugin lockfile" % (path,))
+    return data['plugins']
+
+
+def dump(lock, stream):
+    yaml.safe_dump({'plugins': lock}, stream, default_flow_style=False)
+
+
+def save(lock, path):
+    with open(path, 'w') as lockfile:
+        dump(lock, lockfile)
+
+
+def diff(lock, inventory):
+    """
+    Compare a lock with a server inventory, returns (install, update, remove)
+    lists of plugin names.  Plugin names are compared case insensitively.
+    """
+    installed = dict((name.lower(), name) for name in inventory)
+    install, update = [], []
+    for name, locked in sorted(lock.iteritems()):
+        current = installed.pop(name.lower(), None)
+        if current is None:
+            install.append(name)
+        elif inventory[current]['sha256'] != locked['sha256']:
+            update.append(name)
+    return install, update, sorted(installed.values())
+
+
+def resolve(library, lock, names, digests=None):
+    """
+    Find the library jars for `names`, checking they are the jars the lock
+    was made from.  `digests` caches library digests between servers.
+    """
+    if digests is None:
+        digests = {}
+    plugins = []
+    for name in names:
+        plugin = library.get_plugin(name)
+        if plugin is None:
+            raise LockfileError("%s is not in the plugin library" % (name,))
+        if plugin.jarpath not in digests:
+            digests[plugin.jarpath] = binascii.hexlify(hashfile(path=plugin.jarpath))
+        if digests[plugin.jarpath] != lock[name]['sha256']:
+            raise LockfileError("library has %s-%s, the lockfile wants %s" % (plugin.name, plugin.version, lock[name]['version']))
+        plugins.append(plugin)
+    return plugins
+
+
+def sync_server(server, library, lock, dry_run=False, digests=None):
+    """
+    Make the plugins on `server` match `lock`, only touching the plugins that
+    differ.  Returns a list of messages describing the changes.
+    """
+    # one sync of a server at a time, the inventory is only valid while we hold it
+    with server.lock():
+        inventory = server.get_inventory()
+        installed = dict((name.lower(), entry) for name, entry in inventory.iteritems())
+        install, update, remove = diff(lock, inventory)
+        messages = []
+        for name in install:
+            messages.append("install %s-%s" % (name, lock[name]['version']))
+        for name in update:
+            messages.append("update %s %s -> %s" % (name, installed[name.lower()]['version'], lock[name]['version']))
+        for name in remove:
+            messages.append("remove %s-%s" % (name, inventory[name]['version']))
+        if dry_run or not messages:
+            return messages
+
+        running = server.is_running()
+        for plugin in resolve(library, lock, install + update, digests):
+            current = installed.get(plugin.name.lower(), None)
+            # the library jar is always <name>.jar, a differently named old jar
+            # would otherwise be left next to it.
+            if current and os.path.basename(current['path']) != os.path.basename(plugin.jarpath):
+                remove.append(current['name'])
+            server.update_plugin(plugin, force=True)
+
+        for name in remove:
+            path = inventory[name]['path']
+            if running:
+                server.mark_plugin_for_removal(PluginFile(path))
+            elif os.path.exists(path):
+                os.unlink(path)
+        return messages
+
+
+def sync_servers(servers, library, lock, dry_run=False, threads=8):
+    """
+    Sync several servers in parallel, yields (server, messages or exception).
+    """
+    if not servers:
+        return
+    digests = {}
+    if not dry_run:
+        # verify everything the servers could need up front, so a bad
+        # library aborts before any server is touched.
+        resolve(library, lock, sorted(lock), digests)
+
+    def sync(server):
+        try:
+            return server, sync_server(server, library, lock, dry_run=dry_run, digests=digests)
+        except (LockfileError, IOError, OSError) as e:
+            return server, e
+
+    pool = ThreadPool(min(threads, len(servers)))
+    try:
+        for result in pool.imap(sync, servers):
+            yield result
+    finally:
+        pool.close()
@@ -0,0 +1,95 @@
+"""
+Advisory fcntl locks for the files several bukkitadmin runs (cron jobs,
+deploy scripts, operators) read and write at the same time: servers.yml,
+a library's .sources.yml, plugin meta files and per server state.
+
+A file's lock lives beside it in .<name>.lock, so writers can still
+replace the file itself with a rename.  Locks are re-entrant within a
+thread, and only one thread of a process holds a given lock at a time.
+"""
+from __future__ import absolute_import
+
+import contextlib
+import errno
+import fcntl
+import os
+import threading
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def lock_path(path):
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), ".%s.lock" % (os.path.basename(path),))
+
+
+class FileLock(object):
+    """The lock of one file, shared by all the threads of the process."""
+
+    def __init__(self, path):
+        self.path = lock_path(path)
+        self._rlock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+        self._exclusive = False
+
+    def acquire(self, exclusive=True):
+        self._rlock.acquire()
+        try:
+            if self._depth == 0:
+                self._fd = self._open(exclusive)
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._exclusive = exclusive
+            elif exclusive and not self._exclusive:
+                # only happens when a read nests a write; take the lock
+                # outright from the start to avoid it.
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                self._exclusive = True
+        except:
+            if self._depth == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._rlock.release()
+            raise
+        self._depth += 1
+
+    def _open(self, exclusive):
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        except OSError as e:
+            # reading from a directory we can't write to, nobody else can
+            # write there either.
+            if not exclusive and e.errno in (errno.EACCES, errno.EROFS):
+                return None
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+
+def get_lock(path):
+    key = lock_path(path)
+    with _locks_guard:
+        lock = _locks.get(key, None)
+        if lock is None:
+            lock = _locks[key] = FileLock(path)
+        return lock
+
+
+@contextlib.contextmanager
+def locked(path, exclusive=True):
+    """Hold the lock of `path`: exclusive to write it, shared to read it."""
+    lock = get_lock(path)
+    lock.acquire(exclusive)
+    try:
+        yield
+    finally:
+        lock.release()
@@ -0,0 +1,286 @@
+from __future__ import absolute_import
+
+import binascii
+import json
+import os
+import re
+import threading
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from .util import download_file, get_http_session, hashfile, string_diff
+
+DEFAULT_PORT = 8123
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ChecksumMismatch(IOError):
+    pass
+
+
+class MirrorIndex(object):
+    """
+    Describes the plugins of a library for mirror clients.  Digests and
+    descriptions are cached by file size and mtime so they are only worked
+    out once per jar, and the index itself is only rebuilt when a file of
+    the library changed.
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self._details = {}
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._entries = None
+        self._signature = None
+
+    def signature(self):
+        """
+        What the index depends on: the stats of the library's jar and meta
+        files.  Not the directory's mtime, the lock files made beside them
+        change that.
+        """
+        files = []
+        for filename in sorted(os.listdir(self.library.path)):
+            if filename.startswith('.') or not (filename.endswith(".jar") or filename.endswith(".yml")):
+                continue
+            try:
+                st = os.stat(os.path.join(self.library.path, filename))
+            except OSError:
+                continue
+            files.append((filename, st.st_size, st.st_mtime, st.st_ino))
+        return tuple(files)
+
+    def details(self, plugin):
+        """(sha256 hex digest, description) of a plugin jar."""
+        path = plugin.jarpath
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime)
+        with self._lock:
+            cached = self._details.get(path, None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        details = (binascii.hexlify(hashfile(path=path)), plugin.plugin_yml.get('description', None))
+        with self._lock:
+            self._details[path] = (key, details)
+        return details
+
+    def entries(self):
+        signature = self.signature()
+        with self._lock:
+            if self._signature == signature:
+                return self._entries
+        with self._reload_lock:
+            # another client's request may have rebuilt it meanwhile
+            if self._signature != signature:
+                self.library.reload()
+                entries = self._build_entries(self.library.plugins)
+                with self._lock:
+                    self._entries, self._signature = entries, signature
+            return self._entries
+
+    def _build_entries(self, plugins):
+        entries = []
+        for plugin in plugins:
+            digest, description = self.details(plugin)
+            entries.append({
+                'name': plugin.name,
+                'version': str(plugin.version),
+                'authors': plugin.authors,
+                'description': description,
+                'file': os.path.basename(plugin.jarpath),
+                'size': os.path.getsize(plugin.jarpath),
+                'sha256': digest,
+                'meta': plugin.get_meta(),
+            })
+        return entries
+
+    def get_path(self, filename):
+        """
+        Map a requested file name to a jar or meta file in the library, or
+        None if it isn't one.
+        """
+        if filename != os.path.basename(filename) or filename.startswith('.'):
+            return None
+        if not (filename.endswith(".jar") or filename.endswith(".yml")):
+            return None
+        path = os.path.join(self.library.path, filename)
+        if not os.path.isfile(path):
+            return None
+        return path
+
+
+def parse_range(header, size):
+    """
+    Parse a single 'bytes=start-end' Range header into an inclusive
+    (start, end) tuple, None if it can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "bukkitadmin-mirror"
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        path = urllib.unquote(self.path.split('?', 1)[0])
+        if path == '/index.json':
+            body = json.dumps({'plugins': self.server.index.entries()}, default=str)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        filepath = None
+        if path.startswith('/plugins/'):
+            filepath = self.server.index.get_path(path[len('/plugins/'):])
+        if filepath is None:
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(filepath)
+        start, end = 0, size - 1
+        if self.headers.get('Range'):
+            requested = parse_range(self.headers['Range'], size)
+            if requested is None:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%s' % (size,))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = requested
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/java-archive' if filepath.endswith('.jar') else 'text/yaml')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(65536, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MirrorServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, library, verbose=False):
+        HTTPServer.__init__(self, address, MirrorRequestHandler)
+        self.index = MirrorIndex(library)
+        self.verbose = verbose
+
+
+def serve(library, bind='0.0.0.0', port=DEFAULT_PORT, verbose=True):
+    httpd = MirrorServer((bind, port), library, verbose=verbose)
+    print "Serving %s on http://%s:%s/" % (library.path, bind, httpd.server_address[1])
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+class PluginSource(object):
+    """Plugins served by another node's 'bukkit mirror serve'."""
+
+    source_type = "mirror"
+
+    def __init__(self, name, host):
+        self.name = name
+        self.host = host
+        self._index = None
+
+    def serialize(self):
+        return {'type': self.source_type, 'host': self.host}
+
+    def _get_index(self):
+        if self._index is None:
+            resp = get_http_session().get("http://%s/index.json" % (self.host,))
+            resp.raise_for_status()
+            self._index = dict((e['name'].lower(), e) for e in resp.json()['plugins'])
+        return self._index
+
+    def _entry_url(self, entry):
+        # the digest makes the url change whenever the mirrored jar does,
+        # which is what Library.update_plugin looks for.
+        return "http://%s/plugins/%s?sha256=%s" % (self.host, urllib.quote(entry['file']), entry['sha256'])
+
+    def search(self, searchstr):
+        results = []
+        for entry in self._get_index().values():
+            score = string_diff(entry['name'], searchstr)
+            if score > 0.5:
+                results.append((score, {
+                    'name': entry['name'],
+                    'authors': entry['authors'],
+                    'stage': entry['version'],
+                    'summary': entry['description'] or '',
+                }))
+        return [r for score, r in sorted(results, key=lambda r: -r[0])]
+
+    def search_result_url(self, result):
+        entry = self._get_index().get(result['name'].lower(), None)
+        if entry is None:
+            return None, {}
+        url = self._entry_url(entry)
+        return url, {'source': self.name, 'last_download_url': url}
+
+    def get_download_url(self, plugin):
+        entry = self._get_index().get(plugin.name.lower(), None)
+        if entry is None:
+            return None
+        return self._entry_url(entry)
+
+    def invalidate(self, plugin):
+        self._index = None
+
+    def download(self, url):
+        """
+        Download a jar of the mirror, checking it against the sha256 the index
+        advertised in its url.
+        """
+        filename = download_file(url)
+        expected = urlparse.parse_qs(urlparse.urlparse(url).query).get('sha256', [None])[0]
+        if expected and binascii.hexlify(hashfile(path=filename)) != expected:
+            os.unlink(filename)
+            raise ChecksumMismatch("%s does not match the sha256 %s advertises" % (url, self.host))
+        return filename
+
+    def download_plugin(self, plugin):
+        return self.download(self.get_download_url(plugin))
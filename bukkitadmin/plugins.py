@@ -1,22 +1,38 @@
 from __future__ import absolute_import
 
+import contextlib
+import errno
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
 
 import yaml
 
-from . import jenkins, bukkitdev
-import itertools
-from bukkitadmin.util import extract_plugin_info, hashfile, download_file, query_yes_no, prompt_choices, format_search_result
+from . import jenkins, bukkitdev, mirror
+from .locking import locked
+from .search import DEFAULT_TIMEOUT, federated_search, order_sources
+from bukkitadmin.util import InvalidPlugin, atomic_copy, atomic_write, extract_plugin_info, hashfile, query_yes_no, prompt_choices, format_search_result, LazyResults
 from bukkitadmin.versionparser import parse_version
 
 
-class InvalidPlugin(Exception):
-    pass
+def _names(value):
+    """A plugin.yml name list as a tuple of interned names."""
+    if not value:
+        return ()
+    if isinstance(value, basestring):
+        value = [value]
+    return tuple(intern(v) if type(v) is str else v for v in value)
 
 
 class PluginFile(object):
+    """
+    A plugin jar.  Only the plugin.yml fields we use all the time are kept,
+    libraries and servers hold thousands of these; the whole plugin.yml
+    (commands, permissions...) is parsed again on demand by `plugin_yml`.
+    """
+
+    __slots__ = ('jarpath', 'name', 'version', 'main', 'load', '_authors', '_depend', '_softdepend', '_loadbefore')
 
     @property
     def shasum(self):
@@ -24,63 +40,97 @@ class PluginFile(object):
 
     def __init__(self, jarpath):
         self.jarpath = jarpath
-        self._plugin_yml = extract_plugin_info(self.jarpath)
-        if self._plugin_yml is None:
-            raise InvalidPlugin("%s is not a valid plugin file." % (self.jarpath,));
+        self._load_fields(extract_plugin_info(self.jarpath))
+
+    def _load_fields(self, plugin_yml):
+        # bukkit won't load a plugin without a version either, and we need it to compare jars
+        if not isinstance(plugin_yml, dict) or 'name' not in plugin_yml or plugin_yml.get('version', None) is None:
+            raise InvalidPlugin("%s is not a valid plugin file." % (self.jarpath,))
+        self.name = plugin_yml['name']
+        self.version = plugin_yml['version']
+        self.main = plugin_yml.get('main', None)
+        # STARTUP or POSTWORLD, when the plugin wants to be enabled
+        self.load = intern(str(plugin_yml.get('load', None) or 'POSTWORLD').upper())
+        authors = []
+        for key in ('author', 'authors'):
+            for author in _names(plugin_yml.get(key, None)):
+                if author not in authors:
+                    authors.append(author)
+        self._authors = tuple(authors)
+        self._depend = _names(plugin_yml.get('depend', None))
+        self._softdepend = _names(plugin_yml.get('softdepend', None))
+        self._loadbefore = _names(plugin_yml.get('loadbefore', None))
 
     def __repr__(self):
         return "%s-%s" % (self.name, self.version)
 
     def reload(self):
-        self._plugin_yml = extract_plugin_info(self.jarpath)
+        self._load_fields(extract_plugin_info(self.jarpath))
 
     @classmethod
     def is_valid_plugin(cls, jarpath):
-        return extract_plugin_info(jarpath) is not None
+        try:
+            return extract_plugin_info(jarpath) is not None
+        except InvalidPlugin:
+            return False
 
     @property
-    def authors(self):
-        authors = set()
-        for key in ('author', 'authors'):
-            if key in self._plugin_yml:
-                if isinstance(self._plugin_yml[key], basestring):
-                    authors.add(self._plugin_yml[key])
-                else:
-                    for author in self._plugin_yml[key]:
-                        authors.add(author)
-        return list(authors)
+    def plugin_yml(self):
+        """The complete plugin.yml, read from the jar each time."""
+        try:
+            return extract_plugin_info(self.jarpath) or {}
+        except InvalidPlugin:
+            return {}
 
     @property
-    def name(self):
-        return self._plugin_yml['name']
+    def authors(self):
+        return list(self._authors)
 
     @property
-    def main(self):
-        return self._plugin_yml['main']
+    def dependencies(self):
+        return list(self._depend)
 
     @property
-    def version(self):
-        return self._plugin_yml['version']
+    def soft_dependencies(self):
+        return list(self._softdepend)
 
     @property
-    def dependencies(self):
-        if 'depend' not in self._plugin_yml:
-            return []
-        return self._plugin_yml['depend']
+    def load_before(self):
+        return list(self._loadbefore)
 
     def _get_meta_path(self):
         return os.path.splitext(self.jarpath)[0] + ".yml"
 
+    def lock(self, exclusive=True):
+        """Lock this plugin's jar and meta file against other runs."""
+        return locked(self._get_meta_path(), exclusive)
+
     def get_meta(self):
-        if not self.has_meta():
+        # no lock, set_meta replaces the file atomically and reading must not
+        # leave lock files in servers' plugins/ directories
+        try:
+            with open(self._get_meta_path()) as metafile:
+                return yaml.load(metafile)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
             return {}
-        with open(self._get_meta_path()) as metafile:
-            data = yaml.load(metafile)
-        return data
 
     def set_meta(self, meta):
-        with open(self._get_meta_path(), 'w') as metafile:
-            yaml.dump(meta, metafile)
+        with self.lock():
+            with atomic_write(self._get_meta_path()) as metafile:
+                yaml.dump(meta, metafile)
+
+    @contextlib.contextmanager
+    def edit_meta(self):
+        """
+        Read-modify-write the meta file: yields its data and saves it when
+        the block finishes, holding the plugin's lock meanwhile.
+        """
+        with self.lock():
+            meta = self.get_meta() or {}
+            yield meta
+            self.set_meta(meta)
 
     def has_meta(self):
         return os.path.exists(self._get_meta_path())
@@ -99,24 +149,34 @@ class PluginFile(object):
         return os.path.basename(os.path.dirname(self.jarpath)) == 'plugins'
 
     def rename_jar(self):
-        meta = None
-        if self.has_meta():
-            meta = self.get_meta()
-            if os.path.exists(self._get_meta_path()):
-                os.unlink(self._get_meta_path())
         newjarpath = os.path.join(os.path.dirname(self.jarpath), "%s.jar" % (self.name,))
-        if os.path.exists(newjarpath):
-            raise IOError("File %s already exists" % (newjarpath,))
-        shutil.move(self.jarpath, newjarpath)
-        self.jarpath = newjarpath
-        if meta is not None:
-            self.set_meta(meta)
+        with self.lock():
+            meta = None
+            if self.has_meta():
+                meta = self.get_meta()
+                if os.path.exists(self._get_meta_path()):
+                    os.unlink(self._get_meta_path())
+            if os.path.exists(newjarpath):
+                raise IOError("File %s already exists" % (newjarpath,))
+            shutil.move(self.jarpath, newjarpath)
+            self.jarpath = newjarpath
+            if meta is not None:
+                self.set_meta(meta)
 
 
 class PluginNotFound(Exception):
     pass
 
 
+class SearchFailed(Exception):
+    """No source could be searched; `errors` is {source name: reason}."""
+
+    def __init__(self, name, errors):
+        Exception.__init__(self, "could not search for %s: %s" % (
+            name, "; ".join("%s: %s" % item for item in sorted(errors.iteritems()))))
+        self.errors = errors
+
+
 class NoPluginSource(Exception):
     pass
 
@@ -126,7 +186,8 @@ class Library(object):
     """The bukkit plugin registry"""
 
     VALID_SOURCE_TYPES = {
-        "jenkins": jenkins.PluginSource
+        "jenkins": jenkins.PluginSource,
+        "mirror": mirror.PluginSource,
     }
 
     @classmethod
@@ -143,14 +204,21 @@ class Library(object):
         self.reload_sources()
         self.reload()
 
+    def _get_sources_path(self):
+        return os.path.join(self.path, ".sources.yml")
+
     def reload_sources(self):
-        sources_file = os.path.join(self.path, ".sources.yml")
+        sources_file = self._get_sources_path()
         if not os.path.exists(sources_file):
-            with open(sources_file, 'w') as sources:
-                yaml.dump({}, sources)
+            with locked(sources_file):
+                if not os.path.exists(sources_file):
+                    with atomic_write(sources_file) as sources:
+                        yaml.dump({}, sources)
         self.sources = {'bukkitdev': bukkitdev.PluginSource()}
 
-        sources = yaml.load(open(sources_file))
+        with locked(sources_file, exclusive=False):
+            with open(sources_file) as sourcesfile:
+                sources = yaml.load(sourcesfile) or {}
         for source_name, source_cfg in sources.iteritems():
             source_type = source_cfg.pop('type', None)
             if source_type is None or source_type not in self.VALID_SOURCE_TYPES:
@@ -176,7 +244,21 @@ class Library(object):
             if source.source_type == 'bukkitdev':
                 continue # don't save the bukkitdev one, its default
             cfg[source_name] = source.serialize()
-        yaml.dump(cfg, open(os.path.join(self.path, ".sources.yml"), 'w'))
+        with locked(self._get_sources_path()):
+            with atomic_write(self._get_sources_path()) as sourcesfile:
+                yaml.dump(cfg, sourcesfile)
+
+    @contextlib.contextmanager
+    def edit_sources(self):
+        """
+        Change the plugin sources: reloads them from .sources.yml and saves
+        them when the block finishes, holding the lock so no other run's
+        change is lost.
+        """
+        with locked(self._get_sources_path()):
+            self.reload_sources()
+            yield self.sources
+            self.save_sources()
 
     def reload(self):
         self._cached = []
@@ -192,29 +274,88 @@ class Library(object):
                 continue
             logging.debug("Found %s" % (_file,))
 
-    def update_plugin(self, plugin):
+    def update_plugin(self, plugin, force=False):
+        """
+        Download the newest version of `plugin` from its source.  `force`
+        drops the source's cached results and downloads even if the url
+        hasn't changed.  Returns True if the plugin was updated.
+        """
         if isinstance(plugin, basestring):
             plugin = self.get_plugin(plugin)
         source = self.get_plugin_source(plugin)
         if source is None:
             raise NoPluginSource()
+        if force:
+            source.invalidate(plugin)
         url = source.get_download_url(plugin)
-        meta = plugin.get_meta()
-        if meta.get('last_download_url', '') == url:
+        if plugin.get_meta().get('last_download_url', '') == url and not force:
             return False
-        filename = download_file(url)
-        pf = PluginFile(filename)
-        meta['last_download_url'] = url
-        plugin.set_meta(meta)
-        ret = False
-        if pf.newer_than(plugin):
-            ret = True
-            shutil.move(filename, plugin.jarpath)
-            plugin.reload()
-
-        return ret
-
-    def register_new_plugin(self, name, source=None, jarpath=None):
+        # the download isn't locked, a slow host mustn't hold up other runs
+        filename = source.download(url)
+        try:
+            pf = PluginFile(filename)
+            # two runs updating the same plugin would race replacing the jar
+            with plugin.lock():
+                if plugin.get_meta().get('last_download_url', '') == url and not force:
+                    # another run installed this download meanwhile
+                    return False
+                plugin.reload()
+                with plugin.edit_meta() as meta:
+                    meta['last_download_url'] = url
+                if not pf.newer_than(plugin):
+                    return False
+                atomic_copy(filename, plugin.jarpath)
+                plugin.reload()
+                return True
+        finally:
+            os.unlink(filename)
+
+    def register_plugin_jars(self, plugins, threads=8):
+        """
+        Copy plugin jars (PluginFiles) into the library in one batch,
+        skipping plugins it already has and keeping the newest of several
+        jars of one plugin.  Returns the library's new PluginFiles.
+        """
+        newest = {}
+        for plugin in plugins:
+            key = plugin.name.lower()
+            if self.get_plugin(plugin.name) is not None:
+                continue
+            if key not in newest or plugin.newer_than(newest[key]):
+                newest[key] = plugin
+        if not newest:
+            return []
+
+        def register(plugin):
+            dest = os.path.join(self.path, "%s.jar" % (plugin.name,))
+            atomic_copy(plugin.jarpath, dest)
+            pluginfile = PluginFile(dest)
+            pluginfile.set_meta({})
+            return pluginfile
+
+        pool = ThreadPool(min(threads, len(newest)))
+        try:
+            added = pool.map(register, sorted(newest.values(), key=lambda p: p.name.lower()))
+        finally:
+            pool.close()
+        self._cached.extend(added)
+        return added
+
+    def search(self, searchstr, prefer=None, timeout=DEFAULT_TIMEOUT, errors=None):
+        """
+        Search all the library's sources at once, see search.federated_search.
+        Results of `prefer` (a source or source name) win ties.
+        """
+        if isinstance(prefer, basestring):
+            prefer = self.sources[prefer]
+        return federated_search(order_sources(self.sources.values(), prefer), searchstr,
+                                timeout=timeout, errors=errors)
+
+    def register_new_plugin(self, name, source=None, jarpath=None, prefer=None, timeout=DEFAULT_TIMEOUT):
+        """
+        Add a plugin from `jarpath`, or found by `name` on `source`.  Without
+        a source every source is searched, preferring `prefer`.
+        """
         info = None
         dest = None
         meta = {}
@@ -225,42 +366,43 @@ class Library(object):
         if jarpath:
             info = extract_plugin_info(jarpath)
             dest = os.path.join(self.path, "%s.jar" %(info['name'],))
-            shutil.copy(jarpath, dest)
+            atomic_copy(jarpath, dest)
 
         else:
+            errors = {}
             if source is None:
-                source = self.sources['bukkitdev']
-            elif isinstance(source, basestring):
-                source = self.sources[source]
+                results = LazyResults(self.search(name, prefer=prefer, timeout=timeout, errors=errors))
+                where = "any source"
+            else:
+                if isinstance(source, basestring):
+                    source = self.sources[source]
+                results = LazyResults(source.search(name))
+                where = "source %s" % (source.name,)
 
-            peek, results = itertools.tee(source.search(name))
-            only = None
-            second = None
             try:
-                only = next(peek)
-                second = next(peek)
-            except StopIteration:
-                if only:
-                    choice = only
-                else:
-                    raise PluginNotFound(name)
-
-            _generator_cache = {'choices': results}
-            def get_choices():
-                _generator_cache['choices'],  choices = itertools.tee(_generator_cache['choices'])
-                return choices
-
-            if second:
-                choice = prompt_choices(get_choices, choice_formatter=format_search_result,
-                                        header="Found multiple matches for '%s' on source %s" % (name, source.name))
+                choice = results[0]
+            except IndexError:
+                # "host unreachable" is not "no such plugin"
+                if errors and len(errors) == len(self.sources):
+                    raise SearchFailed(name, errors)
+                for source_name, error in sorted(errors.iteritems()):
+                    logging.warn("Searching %s failed: %s" % (source_name, error))
+                raise PluginNotFound(name)
+
+            if len(results[:2]) > 1:
+                choice = prompt_choices(results, choice_formatter=format_search_result,
+                                        header="Found multiple matches for '%s' on %s" % (name, where))
             if not choice:
                 return 0
 
+            if source is None:
+                source = self.sources[choice['source']]
             download_url, meta = source.search_result_url(choice)
-            file = download_file(download_url)
+            file = source.download(download_url)
             info = extract_plugin_info(file)
             dest = os.path.join(self.path, "%s.jar" %(info['name'],))
-            shutil.move(file, dest)
+            atomic_copy(file, dest)
+            os.unlink(file)
 
         pluginfile = PluginFile(dest)
         pluginfile.set_meta(meta)
@@ -276,16 +418,8 @@ class Library(object):
             for dep in plugin.dependencies:
                 depjar = self.get_plugin(dep)
                 if depjar is None:
-                    source = self.get_plugin_source(plugin)
-                    print "  %s not registered, searching %s" % (dep, source.name)
-                    try:
-                        self.register_new_plugin(dep, source=self.get_plugin_source(plugin))
-                    except PluginNotFound:
-                        if not isinstance(source, bukkitdev.PluginSource):
-                            print "%s not found on %s, searching bukkitdev" % (dep, source.name)
-                            self.register_new_plugin(dep)
-                        else:
-                            raise
+                    print "  %s not registered, searching" % (dep,)
+                    self.register_new_plugin(dep, prefer=self.get_plugin_source(plugin))
                 else:
                     print "  %s - Dependency Satisfied." % (depjar.name,)
 
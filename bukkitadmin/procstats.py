@@ -0,0 +1,161 @@
+"""
+Live resource usage of the servers' JVMs, read from /proc.
+
+A server runs while the bukkitadmin process that started it holds the flock
+on its .PID file; /proc/locks lists every flock of the system, so one read
+tells which servers are up without touching their locks.  The JVM's pid is
+the one written in the file.  The device /proc/locks names is not always the
+one stat() reports (btrfs subvolumes, overlayfs), so a pid file with no
+matching lock only counts as stale once its process is gone too.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import time
+
+PROC = "/proc"
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# how long collect() waits between the two cpu time samples
+CPU_INTERVAL = 0.5
+
+
+def read_flock_holders(proc=PROC):
+    """
+    {(major, minor, inode): pid} of the files flock()ed on the system, None
+    when /proc/locks can't be read.
+    """
+    try:
+        with open(os.path.join(proc, "locks")) as locksfile:
+            lines = locksfile.read().splitlines()
+    except IOError:
+        return None
+    holders = {}
+    for line in lines:
+        fields = line.split()
+        # "1: FLOCK  ADVISORY  WRITE 1234 fe:00:5678 0 EOF", waiters have a "->"
+        if len(fields) < 6 or fields[1] != "FLOCK":
+            continue
+        try:
+            major, minor, inode = fields[5].split(":")
+            holders[(int(major, 16), int(minor, 16), int(inode))] = int(fields[4])
+        except ValueError:
+            continue
+    return holders
+
+
+def pid_file_state(path, holders=None, proc=PROC):
+    """
+    (running, pid) of a .PID file: whether the process that wrote it still
+    holds its lock, and the pid written in it.  When the lock can't be found
+    the server is taken to be running unless the pid written is not alive;
+    without /proc/locks the file existing is all we can go by.
+    """
+    try:
+        st = os.stat(path)
+        with open(path) as pidfile:
+            content = pidfile.read().strip()
+    except (IOError, OSError):
+        return False, None
+    try:
+        pid = int(content)
+    except ValueError:
+        pid = None
+    if holders is None:
+        holders = read_flock_holders(proc)
+    if holders is None:
+        return True, pid
+    if (os.major(st.st_dev), os.minor(st.st_dev), st.st_ino) in holders:
+        return True, pid
+    # better to leave a stopped server alone than to change a running one
+    return pid is None or os.path.exists(os.path.join(proc, str(pid))), pid
+
+
+def _system_uptime(proc=PROC):
+    with open(os.path.join(proc, "uptime")) as uptimefile:
+        return float(uptimefile.read().split()[0])
+
+
+def read_process(pid, proc=PROC):
+    """
+    {'cpu_time', 'rss', 'threads', 'started', 'open_files'} of a process from
+    /proc/<pid>, None if it is gone.  'started' is in seconds since boot and
+    open_files is None when we may not list the process' fds.
+    """
+    piddir = os.path.join(proc, str(pid))
+    try:
+        with open(os.path.join(piddir, "stat")) as statfile:
+            stat = statfile.read()
+    except IOError:
+        return None
+    # the command name may hold spaces and parentheses, fields follow the last ')'
+    fields = stat[stat.rindex(")") + 2:].split()
+    info = {
+        'cpu_time': (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS),
+        'threads': int(fields[17]),
+        'started': int(fields[19]) / float(CLOCK_TICKS),
+        'rss': int(fields[21]) * PAGE_SIZE,
+    }
+    try:
+        info['open_files'] = len(os.listdir(os.path.join(piddir, "fd")))
+    except OSError as e:
+        if e.errno not in (errno.EACCES, errno.EPERM, errno.ENOENT):
+            raise
+        info['open_files'] = None
+    return info
+
+
+def collect(servers, interval=CPU_INTERVAL, proc=PROC, sleep=time.sleep):
+    """
+    Sample every server in one pass: {server name: {'running', 'stale',
+    'pid', 'rss', 'cpu', 'threads', 'open_files', 'uptime'}}.
+
+    cpu is the percentage of one core used over `interval` seconds, all the
+    servers share the one wait; with interval=0 it is the average since the
+    JVM started.  Fields that can't be read are None.
+    """
+    holders = read_flock_holders(proc)
+    samples = {}
+    for server in servers:
+        running, pid = pid_file_state(server.get_pid_file_path(), holders, proc)
+        stats = {'running': running, 'stale': not running and pid is not None, 'pid': pid if running else None,
+                 'rss': None, 'cpu': None, 'threads': None, 'open_files': None, 'uptime': None}
+        samples[server.name] = stats
+        if running and pid is not None:
+            info = read_process(pid, proc)
+            if info is not None:
+                stats.update(rss=info['rss'], threads=info['threads'], open_files=info['open_files'])
+                stats['_info'] = info
+
+    sampled = [stats for stats in samples.values() if '_info' in stats]
+    if sampled:
+        uptime = _system_uptime(proc)
+        for stats in sampled:
+            stats['uptime'] = max(0.0, uptime - stats['_info']['started'])
+        if interval:
+            sleep(interval)
+            elapsed = (_system_uptime(proc) - uptime) or interval
+        for stats in sampled:
+            info = stats.pop('_info')
+            if interval:
+                again = read_process(stats['pid'], proc)
+                if again is not None:
+                    stats['cpu'] = 100.0 * (again['cpu_time'] - info['cpu_time']) / elapsed
+            elif stats['uptime']:
+                stats['cpu'] = 100.0 * info['cpu_time'] / stats['uptime']
+    return samples
+
+
+def format_uptime(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return "%dd%02dh" % (days, hours)
+    if hours:
+        return "%dh%02dm" % (hours, minutes)
+    return "%dm%02ds" % (minutes, seconds)
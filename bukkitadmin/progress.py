@@ -0,0 +1,183 @@
+"""
+Progress of file transfers.
+
+All transfers of the process share one display, so downloads running in
+several threads don't draw over each other: on a terminal it is a line per
+transfer plus a line with the overall rate and ETA, redrawn at most
+REFRESH_RATE times a second however small the chunks are.  When the output
+is not a terminal only a plain line per started and finished transfer is
+written.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import threading
+import time
+
+REFRESH_RATE = 4
+BAR_WIDTH = 20
+NAME_WIDTH = 24
+
+CURSOR_UP = "\x1b[%dA"
+CLEAR_DOWN = "\r\x1b[J"
+
+
+def format_size(count):
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return "%.0f %s" % (count, unit) if unit == "B" else "%.1f %s" % (count, unit)
+        count /= 1024.0
+    return "%.1f GB" % (count,)
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
+
+def _output_width(out):
+    try:
+        import fcntl, termios, struct
+        return struct.unpack('HHHH', fcntl.ioctl(out.fileno(), termios.TIOCGWINSZ, struct.pack('HHHH', 0, 0, 0, 0)))[1] or 80
+    except Exception:
+        return 80
+
+
+class Transfer(object):
+    """One transfer of a Progress; use as a context manager or call finish()."""
+
+    def __init__(self, progress, name, total, started):
+        self.progress = progress
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = started
+
+    def update(self, count):
+        """`count` more bytes were transferred."""
+        self.progress._update(self, count)
+
+    def finish(self):
+        self.progress._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+
+class Progress(object):
+
+    def __init__(self, out=None, tty=None, refresh_rate=REFRESH_RATE, clock=time.time):
+        self.out = out or sys.stdout
+        if tty is None:
+            tty = hasattr(self.out, 'isatty') and self.out.isatty() and os.environ.get('TERM', None) != 'dumb'
+        self.tty = tty
+        self.interval = 1.0 / refresh_rate
+        self.clock = clock
+        self.active = []
+        self._lock = threading.Lock()
+        self._drawn = 0
+        self._last_render = None
+        # totals of the transfers since the display was last idle, for the overall rate
+        self._batch_started = None
+        self._batch_done = 0
+
+    def start(self, name, total=None):
+        """A new transfer of `total` bytes (None if not known)."""
+        with self._lock:
+            now = self.clock()
+            transfer = Transfer(self, name, total, now)
+            if not self.active:
+                self._batch_started, self._batch_done = now, 0
+            self.active.append(transfer)
+            if self.tty:
+                self._render(now)
+            else:
+                self._write("%s: downloading%s\n" % (name, " %s" % (format_size(total),) if total else ""))
+        return transfer
+
+    def _update(self, transfer, count):
+        with self._lock:
+            transfer.done += count
+            self._batch_done += count
+            if self.tty:
+                now = self.clock()
+                if self._last_render is None or now - self._last_render >= self.interval:
+                    self._render(now)
+
+    def _finish(self, transfer):
+        with self._lock:
+            if transfer not in self.active:
+                return
+            self.active.remove(transfer)
+            now = self.clock()
+            elapsed = max(now - transfer.started, 0.001)
+            line = "%s: %s in %.1fs (%s/s)\n" % (transfer.name, format_size(transfer.done), elapsed,
+                                                 format_size(transfer.done / elapsed))
+            if self.tty:
+                # finished transfers are logged above the live lines
+                self._clear()
+                self._write(line)
+                self._render(now)
+            else:
+                self._write(line)
+
+    def lines(self, now):
+        """The live lines: one per active transfer and the overall rate and ETA."""
+        lines = []
+        for transfer in self.active:
+            name = transfer.name[:NAME_WIDTH].ljust(NAME_WIDTH)
+            rate = transfer.done / max(now - transfer.started, 0.001)
+            if transfer.total:
+                fraction = min(transfer.done / float(transfer.total), 1.0)
+                filled = int(fraction * BAR_WIDTH)
+                lines.append("%s %3d%% [%s%s] %s / %s  %s/s" % (
+                    name, fraction * 100, "#" * filled, " " * (BAR_WIDTH - filled),
+                    format_size(transfer.done), format_size(transfer.total), format_size(rate)))
+            else:
+                lines.append("%s %s  %s/s" % (name, format_size(transfer.done), format_size(rate)))
+        if self.active:
+            rate = self._batch_done / max(now - self._batch_started, 0.001)
+            line = "%s transfer%s  %s/s" % (len(self.active), "s" if len(self.active) > 1 else "", format_size(rate))
+            if rate and all(t.total for t in self.active):
+                left = sum(max(t.total - t.done, 0) for t in self.active)
+                line += "  ETA %s" % (format_eta(left / rate),)
+            lines.append(line)
+        return lines
+
+    def _render(self, now):
+        self._last_render = now
+        width = _output_width(self.out) - 1
+        self._clear()
+        lines = self.lines(now)
+        self._write("".join(line[:width] + "\n" for line in lines))
+        self._drawn = len(lines)
+
+    def _clear(self):
+        if self._drawn:
+            self._write(CURSOR_UP % (self._drawn,) + CLEAR_DOWN)
+            self._drawn = 0
+
+    def _write(self, data):
+        if data:
+            self.out.write(data)
+            self.out.flush()
+
+
+_progress = None
+_progress_lock = threading.Lock()
+
+
+def get_progress():
+    """The display shared by all transfers of the process."""
+    global _progress
+    with _progress_lock:
+        if _progress is None:
+            _progress = Progress()
+        return _progress
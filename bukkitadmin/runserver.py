@@ -1,13 +1,18 @@
 from __future__ import absolute_import
 
 import os
+import re
 import struct
 import sys
+import time
 import fcntl
 import termios
 import pexpect
 
-from .servers import get_server
+from . import jvm
+from .lag import LagSampler, get_sampler_settings
+from .console import ConsoleListener, get_console_socket_path
+from .servers import Server, get_server, get_servers_file
 
 PROC = None
 def sigwinch_passthrough (sig, data):
@@ -55,24 +60,127 @@ class PidFile(object):
 
 
 
-def run_server(server):
+class StartupWatcher(object):
+    """
+    Watches a server's console output for the 'Done (X.XXXs)!' line and
+    records the startup time in the server's startup history, along with
+    how long each plugin took to enable.
+
+    """
+
+    DONE_RE = re.compile(r'Done \((\d+(?:[.,]\d+)?)s\)!')
+    ENABLING_RE = re.compile(r'\] Enabling (\S+) v')
+    # world loading happens between STARTUP and POSTWORLD plugins
+    WORLD_RE = re.compile(r'Preparing (level|start region)')
+
+    def __init__(self, server, clock=time.time):
+        # the server may be run from inside its own directory, so hang on to
+        # an absolute path
+        self.server = Server(server.name, os.path.abspath(server.jarpath), validate=False)
+        self.done = False
+        self.clock = clock
+        self.plugin_timings = {}
+        self._enabling = None
+        self._partial = ""
+
+    def _enabled(self, now):
+        if self._enabling is not None:
+            name, started = self._enabling
+            self.plugin_timings[name] = round(now - started, 3)
+            self._enabling = None
+
+    def feed(self, data):
+        if self.done:
+            return data
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()[-1024:]
+        now = self.clock()
+        for line in lines:
+            match = self.ENABLING_RE.search(line)
+            if match:
+                self._enabled(now)
+                self._enabling = (match.group(1), now)
+                continue
+            if self.WORLD_RE.search(line):
+                self._enabled(now)
+                continue
+            match = self.DONE_RE.search(line)
+            if match:
+                self._enabled(now)
+                self.done = True
+                self._partial = ""
+                self.server.record_startup(float(match.group(1).replace(',', '.')),
+                                           plugin_timings=self.plugin_timings)
+                break
+        return data
+
+
+def get_server_command(server):
+    """
+    The command line used to launch `server`, relative to its root directory,
+    built from its JVM profile.
+
+    """
+    try:
+        cfg = get_servers_file()
+    except IOError:
+        cfg = {}
+    profile = jvm.resolve_profile(server.config, cfg.get(jvm.PROFILES_KEY, None))
+    server_count = len([k for k in cfg.keys() if not k.startswith('.')])
+    return jvm.build_command(os.path.basename(server.jarpath), profile, server_count=server_count)
+
+
+def run_server(server, lag_commands=None, lag_interval=None):
+    """
+    Run `server` attached to this terminal.  Its console is watched for
+    startup times and lag; with a `lag_interval` (default: the server's
+    lag_sampler setting) `lag_commands` are sent that often to sample TPS.
+
+    """
     old_dir = os.getcwd()
-    os.chdir(os.path.dirname(server.jarpath))
-    PROC = pexpect.spawn("java -jar %s" % (os.path.basename(server.jarpath)))
+    console_path = os.path.abspath(get_console_socket_path(server))
+    watcher = StartupWatcher(server)
+    commands, interval = get_sampler_settings(server)
+    sampler = LagSampler(server, commands=lag_commands or commands,
+                         interval=interval if lag_interval is None else lag_interval)
+    try:
+        # upgrade-jar holds the lock while it checks and swaps the jar, so the
+        # server is started and its pid file locked in one go
+        with server.lock():
+            os.chdir(os.path.dirname(server.jarpath))
+            command = get_server_command(server)
+            PROC = pexpect.spawn(command[0], command[1:])
+            pidfile = PidFile(".PID", PROC.pid)
+            try:
+                pidfile.__enter__()
+            except SystemExit:
+                # already running, don't leave the second JVM behind
+                PROC.terminate(force=True)
+                raise
+        sampler.send = PROC.sendline
 
-    with PidFile(".PID", PROC.pid) as pidfile:
         try:
-            PROC.interact(escape_character=chr(3))
-        except OSError:
-            pass
-        else:
-            PROC.sendline("%sstop" % (chr(21),))
-            PROC.expect(pexpect.EOF)
-            print PROC.before
-
-    # return to the parent directory
-    os.chdir(old_dir)
+            console = ConsoleListener(console_path, PROC.sendline)
+            console.start()
+            sampler.start()
+            try:
+                PROC.interact(escape_character=chr(3), output_filter=lambda data: sampler.feed(watcher.feed(data)))
+            except OSError:
+                pass
+            else:
+                PROC.sendline("%sstop" % (chr(21),))
+                PROC.expect(pexpect.EOF)
+                print PROC.before
+            finally:
+                sampler.stop()
+                console.close()
+        finally:
+            pidfile.__exit__()
+    finally:
+        # return to the parent directory
+        os.chdir(old_dir)
     # fetch the server again in case the files moved somehow
     server = get_server(server.name)
     server.remove_pending_plugins()
+    server.apply_pending_jar()
 
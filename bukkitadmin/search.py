@@ -0,0 +1,113 @@
+"""
+Search every plugin source at once.
+
+Each source is searched in its own thread and results are handed out as
+they arrive, so a fast mirror answers right away while bukkitdev is still
+paging, and a host that hangs is dropped once its time is up.
+"""
+from __future__ import absolute_import
+
+import Queue
+import threading
+import time
+
+from .util import normalize_string, string_diff
+
+# seconds a source gets to answer
+DEFAULT_TIMEOUT = 20
+# results taken from one source, bukkitdev pages on forever
+SOURCE_LIMIT = 40
+# how long to wait for more results after the first of a batch, so the
+# ones arriving together can be ranked
+SETTLE_TIME = 0.3
+# mirrors are on the LAN, jenkins builds are what a jenkins source was added for
+SOURCE_PRIORITY = {'mirror': 0, 'jenkins': 1, 'bukkitdev': 2}
+
+_DONE = object()
+
+
+def order_sources(sources, prefer=None):
+    """Sources in the order their results win ties: `prefer` first, then by type."""
+    return sorted(sources, key=lambda s: (s is not prefer, SOURCE_PRIORITY.get(s.source_type, 1), s.name))
+
+
+def rank(result, searchstr):
+    """Sort key of a result: exact name matches first, then the closest names."""
+    exact = normalize_string(result['name']) == normalize_string(searchstr)
+    return (not exact, -string_diff(result['name'], searchstr))
+
+
+def _search_source(source, searchstr, limit, results):
+    try:
+        for count, result in enumerate(source.search(searchstr)):
+            if count >= limit:
+                break
+            results.put((source, result))
+    except Exception as e:
+        results.put((source, e))
+    results.put((source, _DONE))
+
+
+def federated_search(sources, searchstr, timeout=DEFAULT_TIMEOUT, limit=SOURCE_LIMIT, settle=SETTLE_TIME,
+                     errors=None, clock=time.time):
+    """
+    Search all `sources` concurrently, yielding results as they come in.
+    Each result gets a 'source' key naming the source to get it from and a
+    'sources' list of every source that has it; a plugin found on several
+    sources is only yielded once.  Results arriving together are ranked,
+    ties go to the source listed first.
+
+    A source failing, or not done within `timeout` seconds, is left out;
+    `errors` (a dict) receives {source name: reason}.
+    """
+    errors = errors if errors is not None else {}
+    order = dict((source.name, i) for i, source in enumerate(sources))
+    results = Queue.Queue()
+    for source in sources:
+        thread = threading.Thread(target=_search_source, args=(source, searchstr, limit, results),
+                                  name="search %s" % (source.name,))
+        # a hung host can't be interrupted, it is just not waited for
+        thread.daemon = True
+        thread.start()
+
+    deadline = clock() + timeout
+    pending = set(order)
+    seen = {}
+    while pending:
+        batch = []
+        settle_until = None
+        while pending:
+            now = clock()
+            if now >= deadline:
+                for name in pending:
+                    errors[name] = "timed out after %ss" % (timeout,)
+                pending.clear()
+                break
+            if settle_until is not None and now >= settle_until:
+                break
+            wait = min(deadline, settle_until or deadline) - now
+            try:
+                source, item = results.get(timeout=wait)
+            except Queue.Empty:
+                continue
+            if source.name not in pending:
+                continue
+            if item is _DONE:
+                pending.discard(source.name)
+            elif isinstance(item, Exception):
+                errors[source.name] = str(item) or item.__class__.__name__
+            else:
+                batch.append((source, item))
+                if settle_until is None:
+                    settle_until = clock() + settle
+
+        batch.sort(key=lambda (source, result): rank(result, searchstr) + (order[source.name],))
+        for source, result in batch:
+            key = normalize_string(result['name'])
+            if key in seen:
+                if source.name not in seen[key]['sources']:
+                    seen[key]['sources'].append(source.name)
+                continue
+            result = dict(result, source=source.name, sources=[source.name])
+            seen[key] = result
+            yield result
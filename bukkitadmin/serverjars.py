@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+
+import binascii
+import contextlib
+import os
+import re
+import time
+import zipfile
+
+import yaml
+
+from .locking import locked
+from .servers import parse_manifest
+from .util import atomic_copy, atomic_write, download_file, hashfile, read_jar_entry
+
+CACHE_DIR = "server-jars"
+INDEX_FILE = "index.yml"
+
+# how long a download url is trusted to still point at the same jar.
+# craftbukkit urls name a build, but jenkins' lastSuccessfulBuild doesn't.
+URL_MAX_AGE = 60 * 60
+
+
+def jar_version(jarpath):
+    """
+    The key a server jar is cached under: its Implementation-Version, or a
+    digest of the jar if the manifest doesn't say.
+    """
+    try:
+        manifest = parse_manifest(read_jar_entry(jarpath, "META-INF/MANIFEST.MF"))
+    except (KeyError, zipfile.BadZipfile):
+        manifest = {}
+    version = manifest.get('Implementation-Version', None)
+    if not version:
+        version = "sha256-%s" % (binascii.hexlify(hashfile(path=jarpath))[:16],)
+    return version
+
+
+class ServerJarCache(object):
+    """Server jars shared by every server under a root, keyed by version."""
+
+    @classmethod
+    def get(cls, rootdir=None):
+        if rootdir is None:
+            rootdir = os.getcwd()
+        path = os.path.join(rootdir, CACHE_DIR)
+        if not os.path.exists(path):
+            os.mkdir(path)
+        return ServerJarCache(path)
+
+    def __init__(self, path):
+        self.path = path
+
+    def _index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def _load_index(self):
+        with locked(self._index_path(), exclusive=False):
+            if not os.path.exists(self._index_path()):
+                return {'urls': {}, 'jars': {}}
+            with open(self._index_path()) as indexfile:
+                index = yaml.load(indexfile) or {}
+        index.setdefault('urls', {})
+        index.setdefault('jars', {})
+        return index
+
+    @contextlib.contextmanager
+    def _edit_index(self):
+        """Read, change and write back the index without losing another run's change."""
+        with locked(self._index_path()):
+            index = self._load_index()
+            yield index
+            with atomic_write(self._index_path()) as indexfile:
+                yaml.dump(index, indexfile)
+
+    def versions(self):
+        index = self._load_index()
+        return dict((v, os.path.join(self.path, f)) for v, f in index['jars'].iteritems()
+                    if os.path.exists(os.path.join(self.path, f)))
+
+    def get_jar(self, version):
+        return self.versions().get(version, None)
+
+    def add(self, jarpath, move=False):
+        """
+        Add a server jar to the cache, returns the path of the cached copy.
+        """
+        version = jar_version(jarpath)
+        filename = "%s.jar" % (re.sub(r'[^\w.\-]+', '_', version),)
+        dest = os.path.join(self.path, filename)
+        with self._edit_index() as index:
+            if not os.path.exists(dest):
+                # downloads come from /tmp, a plain move could leave a half
+                # copied jar in the cache
+                atomic_copy(jarpath, dest)
+            if move:
+                os.unlink(jarpath)
+            index['jars'][version] = filename
+        return dest
+
+    def fetch(self, url, max_age=URL_MAX_AGE):
+        """
+        Return the cached jar for `url`, only downloading it if we haven't
+        done so in the last `max_age` seconds.
+        """
+        index = self._load_index()
+        known = index['urls'].get(url, None)
+        if known and time.time() - known['fetched'] < max_age:
+            cached = self.get_jar(known['version'])
+            if cached is not None:
+                return cached
+
+        cached = self.add(download_file(url), move=True)
+        with self._edit_index() as index:
+            index['urls'][url] = {'version': jar_version(cached), 'fetched': time.time()}
+        return cached
@@ -1,11 +1,18 @@
 from __future__ import absolute_import
 
+import binascii
+import contextlib
+import hashlib
 import os
+import time
 import yaml
 import shutil
 import zipfile
 
 from .plugins import PluginFile, InvalidPlugin, PluginNotFound
+from . import procstats
+from .locking import locked
+from .util import atomic_copy, atomic_write, hashfile, read_jar_entry
 
 
 class InvalidServerJar(Exception):
@@ -20,54 +27,211 @@ def get_servers_file_path():
 def get_servers_file(create=False):
     fp = get_servers_file_path()
     if create and not os.path.exists(fp):
-        yaml.dump({}, open(fp, 'w'))
-    elif not os.path.exists(fp):
-        raise IOError("servers.yml not found.")
-    data = yaml.load(open(fp))
+        with locked(fp):
+            if not os.path.exists(fp):
+                save_servers_file({})
+    with locked(fp, exclusive=False):
+        if not os.path.exists(fp):
+            raise IOError("servers.yml not found.")
+        with open(fp) as ymlfile:
+            data = yaml.load(ymlfile)
     return data or {}
 
 def get_server(name, validate=True):
     try:
         cfg = get_servers_file()
         servercfg = cfg.get(name)
-        if servercfg is None:
+        if servercfg is None or name.startswith('.'):
             raise ServerNotFound(name)
-        return Server(name, servercfg['path'], validate=validate)
+        return Server(name, servercfg['path'], validate=validate, config=servercfg)
     except IOError as e:
         raise ServerNotFound(name)
 
 def list_servers():
     yml = get_servers_file()
-    return list(yml.keys())
+    # keys starting with a dot hold settings shared by all servers
+    return [k for k in yml.keys() if not k.startswith('.')]
+
+# names of server jars, tried first when looking for one in a directory
+SERVER_JAR_HINTS = ('craftbukkit', 'spigot', 'paper', 'bukkit')
+
+def find_server_jar(name, directory):
+    """
+    A Server for the server jar in `directory`, None if it has none.  Jars
+    named like server jars are tried first, then the biggest ones; only
+    their manifests are read.
+    """
+    candidates = []
+    for f in os.listdir(directory):
+        path = os.path.join(directory, f)
+        if f.endswith(".jar") and os.path.isfile(path):
+            hinted = any(hint in f.lower() for hint in SERVER_JAR_HINTS)
+            candidates.append((not hinted, -os.path.getsize(path), f, path))
+    for _, _, _, path in sorted(candidates):
+        try:
+            return Server(name, path, validate=True)
+        except InvalidServerJar:
+            continue
+    return None
 
 def save_servers_file(data):
-    yaml.dump(data, open(get_servers_file_path(), 'w'))
+    fp = get_servers_file_path()
+    with locked(fp):
+        with atomic_write(fp) as ymlfile:
+            yaml.dump(data, ymlfile)
+
+@contextlib.contextmanager
+def edit_servers_file(create=False):
+    """
+    Read-modify-write servers.yml: yields its data and saves it when the
+    block finishes, holding the lock so no other run's change is lost.
+    """
+    with locked(get_servers_file_path()):
+        data = get_servers_file(create=create)
+        yield data
+        save_servers_file(data)
+
+
+MANIFEST_CACHE_FILE = ".manifest-cache.yml"
+
+_manifest_cache = {}
+
+def parse_manifest(manifest):
+    data = {}
+    key = None
+    for line in manifest.splitlines():
+        if line.startswith(" ") and key is not None:
+            # continuation of the previous header
+            data[key] += line[1:]
+            continue
+        line = line.strip()
+        if line and ": " in line:
+            key, value = line.split(": ", 1)
+            data[key] = value
+    return data
+
+def _stat_key(jarpath):
+    st = os.stat(jarpath)
+    return [st.st_size, int(st.st_mtime * 1000), st.st_ino]
+
+def _load_manifest_cache(path):
+    try:
+        with locked(path, exclusive=False):
+            with open(path) as cachefile:
+                return yaml.load(cachefile) or {}
+    except (IOError, OSError, yaml.YAMLError):
+        return {}
+
+def read_manifest(jarpath):
+    """
+    Return the parsed META-INF/MANIFEST.MF of jarpath, or None if it has none.
+
+    Manifests are cached in memory and in a .manifest-cache.yml beside the
+    jar, keyed by the jar's size, mtime and inode, so looking up an unchanged
+    jar costs a stat() instead of opening a 20MB zip.
+    """
+    jarpath = os.path.abspath(jarpath)
+    key = _stat_key(jarpath)
+    cached = _manifest_cache.get(jarpath)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    cache_path = os.path.join(os.path.dirname(jarpath), MANIFEST_CACHE_FILE)
+    disk_cache = _load_manifest_cache(cache_path)
+    entry = disk_cache.get(os.path.basename(jarpath))
+    if entry is not None and entry.get('stat') == key:
+        manifest = entry.get('manifest')
+    else:
+        try:
+            manifest = parse_manifest(read_jar_entry(jarpath, "META-INF/MANIFEST.MF"))
+        except KeyError:
+            manifest = None
+        try:
+            with locked(cache_path):
+                # other jars' entries may have changed since we read it
+                disk_cache = _load_manifest_cache(cache_path)
+                disk_cache[os.path.basename(jarpath)] = {'stat': key, 'manifest': manifest}
+                with atomic_write(cache_path) as cachefile:
+                    yaml.dump(disk_cache, cachefile)
+        except (IOError, OSError):
+            pass # read-only server directory, the in-memory cache will do
+
+    _manifest_cache[jarpath] = (key, manifest)
+    return manifest
+
+INVENTORY_FILE = ".inventory.yml"
+
+STARTUP_HISTORY_FILE = ".startup-history.yml"
+
+# number of startups kept per server
+STARTUP_HISTORY_SIZE = 200
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def find_startup_regressions(history, threshold=0.1, min_seconds=0.5):
+    """
+    Group consecutive startups that ran the same server version and plugin
+    set, and return the changes after which the median startup time grew by
+    more than `threshold` (a fraction) and `min_seconds`.
+
+    Each regression is a dict with the 'before' and 'after' medians, the
+    'entry' that introduced the change and the 'added', 'removed' and
+    'updated' plugins.
+    """
+    groups = []
+    for entry in history:
+        key = (entry.get('version'), entry.get('plugins_digest'))
+        if groups and groups[-1][0] == key:
+            groups[-1][1].append(entry)
+        else:
+            groups.append((key, [entry]))
+
+    regressions = []
+    for (_, prev), (_, cur) in zip(groups, groups[1:]):
+        before = _median([e['duration'] for e in prev])
+        after = _median([e['duration'] for e in cur])
+        if after - before < min_seconds or after < before * (1 + threshold):
+            continue
+        old_plugins = prev[-1].get('plugins') or {}
+        new_plugins = cur[0].get('plugins') or {}
+        regressions.append({
+            'before': before,
+            'after': after,
+            'entry': cur[0],
+            'previous': prev[-1],
+            'added': sorted(set(new_plugins) - set(old_plugins)),
+            'removed': sorted(set(old_plugins) - set(new_plugins)),
+            'updated': sorted((name, old_plugins[name], new_plugins[name]) for name in new_plugins
+                              if name in old_plugins and old_plugins[name] != new_plugins[name]),
+        })
+    return regressions
+
 
 class Server(object):
-    def __init__(self, name, jarpath, validate=True):
+    def __init__(self, name, jarpath, validate=True, config=None):
         self.name = name
         self.jarpath = jarpath
+        self.config = config or {}
         if validate:
             self.validate()
 
-    def read_manifest(self, zf):
-        manifest = zf.read("META-INF/MANIFEST.MF")
-        data = {}
-        for line in manifest.splitlines():
-            line = line.strip()
-            if line:
-                parts = line.split(": ", 1)
-                data[parts[0]] = parts[1]
-        return data
+    @property
+    def manifest(self):
+        return read_manifest(self.jarpath) or {}
 
     def validate(self):
         try:
-            zf = zipfile.ZipFile(open(self.jarpath, 'r'), mode='r')
-        except IOError:
+            manifest = read_manifest(self.jarpath)
+        except (IOError, OSError):
             raise InvalidServerJar("Jar file not found %s" % (self.jarpath,))
-        try:
-            self.manifest = manifest = self.read_manifest(zf)
-        except KeyError:
+        except zipfile.BadZipfile:
+            raise InvalidServerJar("%s is not a jar file." % (self.jarpath,))
+        if manifest is None:
             raise InvalidServerJar("No jar manifest.");
         if manifest.get('Specification-Title',"") != 'Bukkit':
             raise InvalidServerJar("Specification-Title %s != Bukkit" % (manifest.get("Specification-Title", "")))
@@ -81,9 +245,15 @@ class Server(object):
     def get_root_dir(self):
         return os.path.dirname(self.jarpath)
 
+    def lock(self, exclusive=True):
+        """Lock the server's plugins and state files against other runs."""
+        return locked(self.jarpath, exclusive)
+
     def find_plugins(self):
         plugins = []
         for f in os.listdir(self.get_plugin_dir()):
+            if not f.endswith(".jar"):
+                continue
             try:
                 plugins.append(PluginFile(os.path.join(self.get_plugin_update_dir(), f)))
             except InvalidPlugin:
@@ -93,6 +263,55 @@ class Server(object):
                     pass
         return plugins
 
+    def _get_inventory_path(self):
+        return os.path.join(self.get_plugin_dir(), INVENTORY_FILE)
+
+    def get_inventory(self):
+        """
+        Returns {plugin name: {'name', 'version', 'sha256', 'path', 'depend',
+        'softdepend', 'loadbefore', 'load'}} for the installed plugins (preferring jars pending in the update directory,
+        like find_plugins).
+
+        The result is cached in plugins/.inventory.yml keyed by each jar's
+        stat, so only new or changed jars are opened and hashed.
+        """
+        path = self._get_inventory_path()
+        cached = {}
+        with self.lock(exclusive=False):
+            if os.path.exists(path):
+                with open(path) as inventoryfile:
+                    cached = yaml.load(inventoryfile) or {}
+
+        fresh = {}
+        inventory = {}
+        for f in os.listdir(self.get_plugin_dir()):
+            for jarpath in (os.path.join(self.get_plugin_update_dir(), f), os.path.join(self.get_plugin_dir(), f)):
+                if not (f.endswith(".jar") and os.path.isfile(jarpath)):
+                    continue
+                relpath = os.path.relpath(jarpath, self.get_plugin_dir())
+                key = _stat_key(jarpath)
+                entry = cached.get(relpath, None)
+                if entry is None or entry['stat'] != key or 'load' not in entry:
+                    try:
+                        plugin = PluginFile(jarpath)
+                    except InvalidPlugin:
+                        continue
+                    entry = {'stat': key, 'name': plugin.name, 'version': str(plugin.version),
+                             'sha256': binascii.hexlify(hashfile(path=jarpath)),
+                             'depend': list(plugin.dependencies), 'softdepend': list(plugin.soft_dependencies),
+                             'loadbefore': list(plugin.load_before), 'load': plugin.load}
+                fresh[relpath] = entry
+                inventory[entry['name']] = dict(entry, path=jarpath)
+                break
+
+        if fresh != cached:
+            with self.lock():
+                with atomic_write(path) as inventoryfile:
+                    yaml.dump(fresh, inventoryfile)
+        for entry in inventory.values():
+            del entry['stat']
+        return inventory
+
     def find_plugin(self, plugin_name):
         plugin = PluginFile(os.path.join(self.get_plugin_dir(), "%s.jar" % (plugin_name,)))
         return plugin
@@ -104,24 +323,28 @@ class Server(object):
         return pdir
 
     def mark_plugin_for_removal(self, plugin):
-        plugin = self.find_plugin(plugin)
+        if isinstance(plugin, basestring):
+            plugin = self.find_plugin(plugin)
         if not plugin:
             raise PluginNotFound()
         remdir = os.path.join(self.get_plugin_dir(), ".remove")
-        if not os.path.exists(remdir):
-            os.mkdir(remdir)
-        try:
-            os.symlink(
-                os.path.relpath(plugin.jarpath, remdir),
-                os.path.join(remdir, os.path.basename(plugin.jarpath))
-            )
-        except OSError:
-            print "%s already marked for removal on %s" % (plugin.name, self.name,)
+        with self.lock():
+            if not os.path.exists(remdir):
+                os.mkdir(remdir)
+            try:
+                os.symlink(
+                    os.path.relpath(plugin.jarpath, remdir),
+                    os.path.join(remdir, os.path.basename(plugin.jarpath))
+                )
+            except OSError:
+                print "%s already marked for removal on %s" % (plugin.name, self.name,)
 
 
     def remove_pending_plugins(self):
         remdir = os.path.join(self.get_plugin_dir(), ".remove")
-        if os.path.exists(remdir):
+        with self.lock():
+            if not os.path.exists(remdir):
+                return
             for fn in os.listdir(remdir):
                 if os.path.islink(os.path.join(remdir, fn)):
                     print "Removing %s from %s" % (fn,self.name)
@@ -135,23 +358,109 @@ class Server(object):
             lib_plug = library.get_plugin(plugin.name)
             self.update_plugin(lib_plug)
 
-    def update_plugin(self, plugin):
+    def update_plugin(self, plugin, force=False):
+        with self.lock():
+            try:
+                orig = self.find_plugin(plugin.name)
+            except InvalidPlugin:
+                orig = None
+
+            if orig and self.is_running():
+                dest = self.get_plugin_update_dir()
+            else:
+                dest = self.get_plugin_dir()
+
+            if orig is None or force or plugin.newer_than(orig):
+                action = "Installing" if not orig else "Updating"
+                print "%s %s" % (action, plugin)
+                atomic_copy(plugin.jarpath, os.path.join(dest, os.path.basename(plugin.jarpath)))
+
+    def get_plugin_set(self):
+        """
+        Returns a ({name: version}, digest) tuple describing the installed plugins.
+        """
+        plugins = dict((p.name, str(p.version)) for p in self.find_plugins())
+        hasher = hashlib.sha1()
+        for name in sorted(plugins):
+            hasher.update("%s:%s\n" % (name, plugins[name]))
+        return plugins, hasher.hexdigest()
+
+    def _get_startup_history_path(self):
+        return os.path.join(self.get_root_dir(), STARTUP_HISTORY_FILE)
+
+    def get_startup_history(self):
+        path = self._get_startup_history_path()
+        with self.lock(exclusive=False):
+            if not os.path.exists(path):
+                return []
+            with open(path) as historyfile:
+                return yaml.load(historyfile) or []
+
+    def record_startup(self, duration, timestamp=None, plugin_timings=None):
+        plugins, digest = self.get_plugin_set()
         try:
-            orig = self.find_plugin(plugin.name)
-        except InvalidPlugin:
-            orig = None
+            version = self.manifest.get('Implementation-Version', None)
+        except (IOError, OSError, zipfile.BadZipfile):
+            version = None
+        entry = {
+            'duration': duration,
+            'timestamp': timestamp or time.time(),
+            'version': version,
+            'plugins_digest': digest,
+            'plugins': plugins,
+        }
+        if plugin_timings:
+            entry['plugin_timings'] = plugin_timings
+        with self.lock():
+            history = self.get_startup_history()
+            history.append(entry)
+            with atomic_write(self._get_startup_history_path()) as historyfile:
+                yaml.dump(history[-STARTUP_HISTORY_SIZE:], historyfile)
+        return entry
 
-        if orig and self.is_running():
-            dest = self.get_plugin_update_dir()
-        else:
-            dest = self.get_plugin_dir()
+    def get_type(self):
+        """
+        craftbukkit or spigot, from servers.yml or the jar's manifest.
+        """
+        if self.config.get('type', None):
+            return self.config['type']
+        title = self.manifest.get('Implementation-Title', '').lower()
+        return 'spigot' if 'spigot' in title else 'craftbukkit'
+
+    def _get_pending_jar_path(self):
+        return self.jarpath + ".pending"
+
+    def replace_jar(self, jarpath):
+        """
+        Swap in a new server jar with an atomic rename.
+        """
+        atomic_copy(jarpath, self.jarpath, link=True)
+
+    def stage_jar(self, jarpath):
+        """
+        Queue a new server jar to be swapped in when the server stops.
+        """
+        atomic_copy(jarpath, self._get_pending_jar_path(), link=True)
+
+    def has_pending_jar(self):
+        return os.path.exists(self._get_pending_jar_path())
+
+    def apply_pending_jar(self):
+        with self.lock():
+            if not self.has_pending_jar():
+                return False
+            print "Upgrading server jar of %s" % (self.name,)
+            os.rename(self._get_pending_jar_path(), self.jarpath)
+            return True
 
-        if orig is None or plugin.newer_than(orig):
-            action = "Installing" if not orig else "Updating"
-            print "%s %s" % (action, plugin)
-            shutil.copy(plugin.jarpath, dest)
+    def get_pid_file_path(self):
+        return os.path.join(self.get_root_dir(), ".PID")
 
     def is_running(self):
-        return os.path.exists(os.path.join(os.path.dirname(self.jarpath), ".PID"))
+        """
+        True while the process that started the server holds the lock on its
+        .PID file, one left behind by a crash doesn't count.
+        """
+        return procstats.pid_file_state(self.get_pid_file_path())[0]
 
 
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+import hashlib
+import multiprocessing
+import posixpath
+import zipfile
+from collections import defaultdict
+
+from .util import list_jar_entries
+
+# packages with fewer classes than this are too generic to fingerprint,
+# an 'util' package holding only Util.class would match everywhere.
+MIN_CLASSES = 3
+
+
+def package_index(jarpath):
+    """
+    Index the classes of a jar by package, returns (jarpath, {package:
+    (fingerprint, classes, bytes)}) or (jarpath, None) if it can't be read.
+
+    The fingerprint only covers the class names, so a library relocated
+    into another package by the shade plugin still matches its original.
+    """
+    try:
+        entries = list_jar_entries(jarpath)
+    except (IOError, zipfile.BadZipfile):
+        return jarpath, None
+    packages = defaultdict(lambda: [[], 0])
+    for name, size, _ in entries:
+        if not name.endswith(".class") or name.startswith("META-INF/"):
+            continue
+        package, classname = posixpath.split(name)
+        packages[package][0].append(classname)
+        packages[package][1] += size
+
+    index = {}
+    for package, (classes, size) in packages.iteritems():
+        if len(classes) < MIN_CLASSES:
+            continue
+        fingerprint = hashlib.sha1("\n".join(sorted(classes))).hexdigest()
+        index[package.replace("/", ".")] = (fingerprint, len(classes), size)
+    return jarpath, index
+
+
+def find_duplicates(jars, processes=None):
+    """
+    Find packages bundled by more than one of `jars`, a {label: jarpath}
+    dict.  Returns a list of dicts ranked by estimated waste, the bytes of
+    every copy but the largest.
+    """
+    if not jars:
+        return []
+    labels = dict((path, label) for label, path in jars.iteritems())
+    pool = multiprocessing.Pool(processes or min(len(jars), multiprocessing.cpu_count()))
+    try:
+        indexes = pool.map(package_index, sorted(labels), chunksize=4)
+    finally:
+        pool.close()
+        pool.join()
+
+    copies = defaultdict(dict)
+    for jarpath, index in indexes:
+        for package, (fingerprint, classes, size) in (index or {}).iteritems():
+            copies[fingerprint].setdefault(labels[jarpath], (package, classes, size))
+
+    duplicates = []
+    for fingerprint, found in copies.iteritems():
+        if len(found) < 2:
+            continue
+        sizes = [size for _, _, size in found.values()]
+        packages = sorted(set(package for package, _, _ in found.values()))
+        duplicates.append({
+            'package': min(packages, key=len),
+            'packages': packages,
+            'classes': max(classes for _, classes, _ in found.values()),
+            'plugins': sorted(found),
+            'bytes': sum(sizes),
+            'waste': sum(sizes) - max(sizes),
+        })
+    duplicates.sort(key=lambda d: (-d['waste'], d['package']))
+    return duplicates
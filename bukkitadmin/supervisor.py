@@ -0,0 +1,363 @@
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import os
+import select
+import socket
+import subprocess
+import sys
+import time
+
+from .console import SOCKET_NAME, bind_socket
+from .lag import LagSampler, get_sampler_settings
+from .runserver import PidFile, StartupWatcher, get_server_command
+from .servers import get_server, list_servers
+
+CONTROL_SOCKET_NAME = ".supervisor.sock"
+
+# console commands that may be sent through the control socket
+CONSOLE_COMMANDS = ('say', 'save-all', 'stop')
+
+# seconds to wait for a server to exit after 'stop' before killing it
+STOP_TIMEOUT = 120
+
+
+def get_control_socket_path(rootdir=None):
+    if rootdir is None:
+        rootdir = os.getcwd()
+    return os.path.join(rootdir, CONTROL_SOCKET_NAME)
+
+
+def _reason(e):
+    return e.args[0] if isinstance(e, KeyError) and e.args else e
+
+
+def _set_nonblocking(fileobj):
+    flags = fcntl.fcntl(fileobj, fcntl.F_GETFL)
+    fcntl.fcntl(fileobj, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class ManagedServer(object):
+    """
+    A server JVM owned by the supervisor, with its console output piped back
+    to us and its console socket served from the supervisor's select loop.
+
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.root = os.path.abspath(server.get_root_dir())
+        self.proc = None
+        self.pidfile = None
+        self.console = None
+        self.stop_requested = None
+        self.watcher = StartupWatcher(server)
+        commands, interval = get_sampler_settings(server)
+        self.sampler = LagSampler(server, send=self.send, commands=commands, interval=interval)
+        self._partial = ""
+
+    @property
+    def name(self):
+        return self.server.name
+
+    def start(self):
+        # upgrade-jar holds the lock while it checks and swaps the jar
+        with self.server.lock():
+            if self.server.is_running():
+                raise IOError("%s is already running" % (self.name,))
+            self.proc = subprocess.Popen(get_server_command(self.server), cwd=self.root,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT, close_fds=True)
+            _set_nonblocking(self.proc.stdout)
+            self.pidfile = PidFile(os.path.join(self.root, ".PID"), self.proc.pid)
+            try:
+                self.pidfile.__enter__()
+            except SystemExit as e:
+                self.pidfile = None
+                self.proc.kill()
+                self.proc.wait()
+                raise IOError(str(e))
+        try:
+            self.console = bind_socket(os.path.join(self.root, SOCKET_NAME))
+        except Exception:
+            self.proc.kill()
+            self.finish()
+            raise
+        self.console.setblocking(False)
+
+    def send(self, line):
+        self.proc.stdin.write(line.strip() + "\n")
+        self.proc.stdin.flush()
+
+    def stop(self):
+        if self.stop_requested is None:
+            self.stop_requested = time.time()
+            self.send("stop")
+
+    def read_output(self):
+        """
+        Return the complete lines of console output available right now, or
+        None once the JVM has closed its output.
+
+        """
+        try:
+            data = os.read(self.proc.stdout.fileno(), 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+        if not data:
+            return None
+        self.watcher.feed(data)
+        self.sampler.feed(data)
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        return [line.rstrip("\r") for line in lines]
+
+    def finish(self):
+        self.proc.wait()
+        if self.console is not None:
+            self.console.close()
+            socket_path = os.path.join(self.root, SOCKET_NAME)
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+        if self.pidfile is not None:
+            self.pidfile.__exit__()
+        # fetch the server again in case the files moved somehow
+        server = get_server(self.name, validate=False)
+        server.remove_pending_plugins()
+        server.apply_pending_jar()
+        return self.proc.returncode
+
+
+class Supervisor(object):
+    """
+    Runs many servers headless from one process.
+
+    Console output of every server is multiplexed onto `out`, prefixed with
+    the server name.  Commands are accepted on a control socket in the root
+    directory as 'TARGET COMMAND [ARGS]' lines, where TARGET is a server name
+    or '*' for every supervised server, and on each server's own console
+    socket.
+
+    """
+
+    def __init__(self, rootdir=None, out=None):
+        self.control_path = get_control_socket_path(rootdir)
+        self.out = out or sys.stdout
+        self.managed = {}
+        self.clients = {}
+        self.shutting_down = False
+
+    def log(self, name, line):
+        self.out.write("[%s] %s\n" % (name, line))
+        self.out.flush()
+
+    def start_server(self, name):
+        if name in self.managed:
+            raise KeyError("%s is already supervised" % (name,))
+        managed = ManagedServer(get_server(name))
+        managed.start()
+        self.managed[name] = managed
+        self.log(name, "started (pid %s)" % (managed.proc.pid,))
+
+    def targets(self, target):
+        if target == '*':
+            return list(self.managed.values())
+        if target not in self.managed:
+            raise KeyError("%s is not running under the supervisor" % (target,))
+        return [self.managed[target]]
+
+    def handle_control(self, line):
+        parts = line.split(None, 2)
+        if parts == ['list']:
+            return "ok %s" % (" ".join(sorted(self.managed.keys())),)
+        if parts == ['shutdown']:
+            self.shutdown()
+            return "ok"
+        if len(parts) < 2:
+            return "error expected TARGET COMMAND [ARGS]"
+        target, command = parts[0], parts[1]
+        try:
+            if command == 'start':
+                names = list_servers() if target == '*' else [target]
+                started = []
+                failed = []
+                for name in names:
+                    if name in self.managed:
+                        continue
+                    try:
+                        self.start_server(name)
+                    except Exception as e:
+                        self.log(name, "not started: %s" % (_reason(e),))
+                        failed.append("%s: %s" % (name, _reason(e)))
+                    else:
+                        started.append(name)
+                if failed:
+                    return "error %s" % ("; ".join(failed),)
+                return "ok started %s" % (" ".join(started),)
+            if command not in CONSOLE_COMMANDS:
+                return "error unknown command %s" % (command,)
+            managed = self.targets(target)
+            failed = []
+            for m in managed:
+                try:
+                    if command == 'stop':
+                        m.stop()
+                    else:
+                        m.send(" ".join(parts[1:]))
+                except Exception as e:
+                    failed.append("%s: %s" % (m.name, _reason(e)))
+            if failed:
+                return "error %s" % ("; ".join(failed),)
+            return "ok %s" % (" ".join(m.name for m in managed),)
+        except Exception as e:
+            return "error %s" % (_reason(e),)
+
+    def shutdown(self):
+        self.shutting_down = True
+        for m in self.managed.values():
+            m.stop()
+
+    def _accept(self, listener, handler):
+        try:
+            conn, _ = listener.accept()
+        except socket.error:
+            return
+        conn.setblocking(False)
+        self.clients[conn] = [handler, ""]
+
+    def _read_client(self, conn):
+        handler, buf = self.clients[conn]
+        try:
+            data = conn.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ""
+        buf += data
+        if "\n" in buf or not data:
+            del self.clients[conn]
+            reply = handler(buf.split("\n", 1)[0].strip()) if buf.strip() else "error empty command"
+            try:
+                conn.setblocking(True)
+                conn.sendall(reply + "\n")
+            except socket.error:
+                pass
+            conn.close()
+        else:
+            self.clients[conn][1] = buf
+
+    def _console_handler(self, managed):
+        def handler(line):
+            try:
+                managed.send(line)
+            except Exception as e:
+                return "error %s" % (_reason(e),)
+            return "ok"
+        return handler
+
+    def _accept_console(self, managed):
+        # the server may have been dropped earlier in this round
+        if self.managed.get(managed.name) is managed:
+            self._accept(managed.console, self._console_handler(managed))
+
+    def _read_server(self, managed):
+        if self.managed.get(managed.name) is not managed:
+            return
+        try:
+            lines = managed.read_output()
+        except Exception as e:
+            self._drop(managed, "console output failed: %s" % (_reason(e),))
+            return
+        if lines is None:
+            self._drop(managed)
+            return
+        for line in lines:
+            self.log(managed.name, line)
+
+    def _drop(self, managed, reason=None):
+        """Stop supervising `managed`, killing the JVM if something went wrong with it."""
+        self.managed.pop(managed.name, None)
+        if reason is not None:
+            self.log(managed.name, "%s, killing." % (reason,))
+            if managed.proc.poll() is None:
+                managed.proc.kill()
+        try:
+            code = managed.finish()
+        except Exception as e:
+            self.log(managed.name, "cleanup failed: %s" % (_reason(e),))
+            return
+        self.log(managed.name, "stopped (exit code %s)" % (code,))
+
+    def _stop_remaining(self):
+        """
+        Stop the servers still supervised the way 'stop' does, only killing
+        those not done within STOP_TIMEOUT.
+        """
+        for m in list(self.managed.values()):
+            if m.proc.poll() is None:
+                try:
+                    m.stop()
+                except Exception as e:
+                    self.log(m.name, "could not send stop: %s" % (_reason(e),))
+        deadline = time.time() + STOP_TIMEOUT
+        while time.time() < deadline and any(m.proc.poll() is None for m in self.managed.values()):
+            for m in list(self.managed.values()):
+                # keep reading, a JVM blocked writing to a full pipe never exits
+                try:
+                    for line in m.read_output() or ():
+                        self.log(m.name, line)
+                except Exception:
+                    pass
+            time.sleep(0.1)
+        for m in list(self.managed.values()):
+            if m.proc.poll() is None:
+                self._drop(m, "did not stop within %s seconds" % (STOP_TIMEOUT,))
+            else:
+                self._drop(m)
+
+    def run(self, names=()):
+        control = bind_socket(self.control_path)
+        control.setblocking(False)
+        try:
+            for name in names:
+                try:
+                    self.start_server(name)
+                except Exception as e:
+                    self.log(name, "not started: %s" % (_reason(e),))
+
+            while not (self.shutting_down and not self.managed):
+                readers = {control: lambda: self._accept(control, self.handle_control)}
+                for m in self.managed.values():
+                    readers[m.proc.stdout] = lambda m=m: self._read_server(m)
+                    readers[m.console] = lambda m=m: self._accept_console(m)
+                for conn in self.clients:
+                    readers[conn] = lambda conn=conn: self._read_client(conn)
+                try:
+                    readable, _, _ = select.select(list(readers.keys()), [], [], 1.0)
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for r in readable:
+                    readers[r]()
+
+                now = time.time()
+                for m in list(self.managed.values()):
+                    if m.stop_requested is None and m.proc.poll() is None:
+                        try:
+                            m.sampler.poll()
+                        except Exception as e:
+                            self.log(m.name, "lag sampler failed: %s" % (_reason(e),))
+                    if m.stop_requested is not None and now - m.stop_requested > STOP_TIMEOUT:
+                        self.log(m.name, "did not stop within %s seconds, killing." % (STOP_TIMEOUT,))
+                        m.proc.kill()
+                        m.stop_requested = now
+        finally:
+            control.close()
+            if os.path.exists(self.control_path):
+                os.unlink(self.control_path)
+            # normally nothing is left here, unless the loop itself failed
+            self._stop_remaining()
@@ -1,22 +1,37 @@
 import contextlib
+import cPickle as pickle
 import difflib
 import hashlib
+import json
 import os
 import shutil
+import sqlite3
+import struct
 import sys
 import tempfile
 from textwrap import TextWrapper
+import threading
+import time
+from urlparse import urlparse
 import zipfile
+import zlib
 
-from bs4 import BeautifulSoup
-import itertools
+from bs4 import BeautifulSoup, SoupStrainer
 import feedparser
 import pager
-from progressbar import ProgressBar, ETA, FileTransferSpeed, Percentage, Bar
 import requests
+from requests.adapters import HTTPAdapter
 import yaml
 from requests_cache import CachedSession
 
+from bukkitadmin.progress import get_progress
+
+try:
+    import lxml
+    SOUP_PARSER = "lxml"
+except ImportError:
+    SOUP_PARSER = "html.parser"
+
 
 @contextlib.contextmanager
 def chdir(dirname=None):
@@ -28,7 +43,60 @@ def chdir(dirname=None):
     finally:
         os.chdir(curdir)
 
-def prompt_choices(choices_function, choice_formatter=None,
+class LazyResults(object):
+    """
+    Random access, memoizing view of a lazily produced sequence of results
+    (e.g. a paginated search).  Items are pulled from the underlying
+    iterator only as far as they are needed and are never fetched twice, so
+    listing the results again or picking #180 doesn't re-run the search.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = []
+        self._exhausted = False
+
+    def _fill(self, count=None):
+        while not self._exhausted and (count is None or len(self._items) < count):
+            try:
+                self._items.append(next(self._iterator))
+            except StopIteration:
+                self._exhausted = True
+
+    @property
+    def fetched(self):
+        """Number of results fetched so far."""
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._fill(index.stop if index.stop is not None and index.stop >= 0 else None)
+        elif index < 0:
+            self._fill()
+        else:
+            self._fill(index + 1)
+        return self._items[index]
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index >= len(self._items):
+                self._fill(index + 1)
+                if index >= len(self._items):
+                    return
+            yield self._items[index]
+            index += 1
+
+    def __len__(self):
+        self._fill()
+        return len(self._items)
+
+    def __nonzero__(self):
+        self._fill(1)
+        return bool(self._items)
+
+
+def prompt_choices(choices, choice_formatter=None,
                    prompt="Your Choice [1-#/L=list] (or ctrl+c to quit): ",
                    header="Choices:"):
 
@@ -54,10 +122,12 @@ def prompt_choices(choices_function, choice_formatter=None,
             sys.exit(0)
         pager.echo('\r' + ' '*(len(prompt)-1) + '\r')
 
-    _counter = {'max': 0}
+    if not isinstance(choices, LazyResults):
+        choices = LazyResults(choices)
+
     def show_list():
         def gen():
-            for num, c in enumerate(choices_function()):
+            for num, c in enumerate(choices):
                 for line in choice_formatter(num+1, c):
                     yield line
         page(gen(), pagecallback=_prompt)
@@ -80,8 +150,8 @@ def prompt_choices(choices_function, choice_formatter=None,
             val = int(choice)
             if 1 <= val:
                 try:
-                    return next(itertools.islice(choices_function(), val-1, val))
-                except StopIteration:
+                    return choices[val-1]
+                except IndexError:
                     raise ValueError("Invalid Choice?")
         except ValueError:
             pass
@@ -135,6 +205,15 @@ def query_yes_no(question, default="yes"):
             sys.stdout.write("Please respond with 'yes' or 'no' " \
                              "(or 'y' or 'n').\n")
 
+def emit_json(obj, out=None):
+    """
+    Write `obj` as a single line of JSON and flush, so consumers can process
+    each item as soon as it is produced.
+    """
+    out = out or sys.stdout
+    out.write(json.dumps(obj, sort_keys=True, default=str) + "\n")
+    out.flush()
+
 def format_as_kwargs(kwargs, priority_keys=None):
     priority_keys = priority_keys or []
     keys = list(kwargs.keys())
@@ -145,49 +224,344 @@ def format_as_kwargs(kwargs, priority_keys=None):
             keys.insert(0, key)
     return ", ".join("%s=%s" % (k, repr(kwargs.get(k))) for k in keys)
 
+DOWNLOAD_CHUNK_SIZE = 65536
+
 def download_file(url, use_progressbar=True, destination=None):
 
-    r = requests.get(url, stream=True)
+    r = get_http_session().get(url, stream=True)
     outfile, fname = tempfile.mkstemp()
+    transfer = None
     if use_progressbar:
         name = os.path.splitext(url.split('/')[-1])[0]
-        widgets = widgets = ['%s: ' % (name,), Percentage(), ' ', Bar(),
-                             ' ', ETA(), ' ', FileTransferSpeed()]
-        size = int(r.headers['Content-Length'].strip())
-        pbar = ProgressBar(widgets=widgets, maxval=size).start()
-
-    with os.fdopen(outfile, 'wb') as f:
-        bytes = 0
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk: # filter out keep-alive new chunks
-                f.write(chunk)
-                f.flush()
-                bytes += len(chunk)
-                if use_progressbar:
-                    pbar.update(bytes)
-        if use_progressbar:
-            pbar.finish()
+        size = r.headers.get('Content-Length', None)
+        transfer = get_progress().start(name, int(size.strip()) if size else None)
+
+    try:
+        with os.fdopen(outfile, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk: # filter out keep-alive new chunks
+                    f.write(chunk)
+                    if transfer is not None:
+                        transfer.update(len(chunk))
+    finally:
+        if transfer is not None:
+            transfer.finish()
     if destination:
         shutil.move(fname, destination)
 
     return fname
 
 
+def atomic_copy(source, destination, link=False):
+    """
+    Put a copy of `source` at `destination` with a rename, so readers never
+    see a half written file.  With link=True the copy is a hard link when
+    both are on the same filesystem.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".%s." % (os.path.basename(destination),),
+                               dir=os.path.dirname(os.path.abspath(destination)))
+    os.close(fd)
+    try:
+        if link:
+            os.unlink(tmp)
+            try:
+                os.link(source, tmp)
+            except OSError:
+                shutil.copy2(source, tmp)
+        else:
+            shutil.copy2(source, tmp)
+        os.rename(tmp, destination)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Open a temporary file to write `path`'s new content into; it replaces
+    `path` with a rename once the block finishes without error.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".%s." % (os.path.basename(path),),
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yield f
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket allowing `rate` requests per second with
+    bursts of up to `burst` requests.
+
+    backoff() is called when a host tells us to slow down (429/503): the rate
+    is halved and nothing is let through until the server's Retry-After (or
+    one refill interval) has passed.  success() slowly restores the
+    configured rate.
+    """
+
+    MIN_RATE = 0.05
+
+    def __init__(self, rate, burst, clock=time.time, sleep=time.sleep):
+        self.max_rate = self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            self.sleep(wait)
+
+    def backoff(self, retry_after=None):
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            self.rate = max(self.MIN_RATE, self.rate / 2)
+            self.tokens = 0
+            delay = retry_after if retry_after is not None else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, now + delay)
+
+    def success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+# requests per second and burst size per host, '*' applies to any other host.
+# Override with BUKKITADMIN_RATE_LIMIT="dev.bukkit.org=1:2,*=4:8"
+RATE_LIMITS = {
+    'dev.bukkit.org': (2.0, 2),
+    '*': (4.0, 8),
+}
+
+# how often a request answered with 429/503 is retried
+RATE_LIMIT_RETRIES = 3
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _parse_rate_limits(spec):
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        host, limit = item.strip().split("=", 1)
+        rate, _, burst = limit.partition(":")
+        limits[host] = (float(rate), int(burst or 1))
+    return limits
+
+
+if 'BUKKITADMIN_RATE_LIMIT' in os.environ:
+    RATE_LIMITS.update(_parse_rate_limits(os.environ['BUKKITADMIN_RATE_LIMIT']))
+
+
+def configure_rate_limit(host, rate, burst):
+    with _rate_limiters_lock:
+        RATE_LIMITS[host] = (rate, burst)
+        _rate_limiters.pop(host, None)
+
+
+def get_rate_limiter(host):
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            rate, burst = RATE_LIMITS.get(host, RATE_LIMITS['*'])
+            _rate_limiters[host] = TokenBucket(rate, burst)
+        return _rate_limiters[host]
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport adapter that takes a token from the target host's bucket
+    before each request and backs off when the host answers 429 or 503.
+
+    The http cache answers hits before the adapter is reached, so cached
+    pages are never rate limited.
+    """
+
+    def send(self, request, **kwargs):
+        limiter = get_rate_limiter(urlparse(request.url).hostname)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            response = super(RateLimitedAdapter, self).send(request, **kwargs)
+            if response.status_code not in (429, 503):
+                limiter.success()
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            limiter.backoff(float(retry_after) if retry_after.isdigit() else None)
+            if attempt >= RATE_LIMIT_RETRIES:
+                return response
+            attempt += 1
+            response.close()
+
+
+def _mount_rate_limiter(session):
+    adapter = RateLimitedAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 _requests_session = None
+_http_session = None
 
 
 def get_request_session():
+    """
+    The cached session used for scraping pages and feeds.
+    """
     global _requests_session
     if _requests_session is None:
-        _requests_session = CachedSession('.bukkadmin', backend='sqlite',expire_after=60*60, extension='cache')
+        _requests_session = _mount_rate_limiter(
+            CachedSession('.bukkadmin', backend='sqlite',expire_after=60*60, extension='cache'))
     return _requests_session
 
 
-def get_page_soup(url):
+def get_http_session():
+    """
+    Uncached session for downloads and conditional requests.
+    """
+    global _http_session
+    if _http_session is None:
+        _http_session = _mount_rate_limiter(requests.Session())
+    return _http_session
+
+
+class ResultCache(object):
+    """
+    Parsed results of scraping (search results, slugs, resolved download
+    urls) so a cache hit costs neither a request nor a parse.  Entries are
+    pickled into sqlite under a namespace (e.g. 'bukkitdev.slug') and a case
+    insensitive key (e.g. the plugin name), and expire after their ttl.
+    """
+
+    MISSING = object()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("CREATE TABLE IF NOT EXISTS results (namespace TEXT, key TEXT, value BLOB, "
+                         "expires REAL, PRIMARY KEY (namespace, key))")
+        return conn
+
+    def get(self, namespace, key, default=MISSING):
+        row = self._connection().execute(
+            "SELECT value, expires FROM results WHERE namespace = ? AND key = ?",
+            (namespace, key.lower())).fetchone()
+        if row is None or row[1] < time.time():
+            return default
+        return pickle.loads(str(row[0]))
+
+    def set(self, namespace, key, value, ttl):
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                         (namespace, key.lower(), buffer(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+                          time.time() + ttl))
+
+    def invalidate(self, key=None, namespace=None):
+        """Drop the entries for `key` and/or `namespace`, everything by default."""
+        clauses, args = [], []
+        if key is not None:
+            clauses.append("key = ?")
+            args.append(key.lower())
+        if namespace is not None:
+            clauses.append("namespace = ?")
+            args.append(namespace)
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM results" + (" WHERE " + " AND ".join(clauses) if clauses else ""), args)
+
+    def cached(self, namespace, key, ttl, func, *args, **kwargs):
+        """
+        Return the cached result for `key`, calling `func` to fill it in.
+        A None result (nothing found, or a site having a bad day) is only
+        kept for `negative_ttl` seconds, by default not at all.
+        """
+        negative_ttl = kwargs.pop('negative_ttl', 0)
+        value = self.get(namespace, key)
+        if value is self.MISSING:
+            value = func(*args, **kwargs)
+            if value is not None:
+                self.set(namespace, key, value, ttl)
+            elif negative_ttl:
+                self.set(namespace, key, value, negative_ttl)
+        return value
+
 
+_result_cache = None
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(os.path.abspath('.bukkadmin-results.cache'))
+    return _result_cache
+
+
+def tag_strainer(*tags):
+    """
+    A SoupStrainer keeping only the given tags (and everything inside them).
+    Each tag is a (name, css class) tuple, the class may be None to keep
+    every tag with that name.
+    """
+    wanted = [(name, cls) for name, cls in tags]
+
+    def match(name, attrs):
+        classes = attrs.get('class', None) or ''
+        if not isinstance(classes, basestring):
+            classes = " ".join(classes)
+        classes = classes.split()
+        return any(name == n and (cls is None or cls in classes) for n, cls in wanted)
+    return SoupStrainer(match)
+
+
+def parse_soup(markup, parse_only=None):
+    return BeautifulSoup(markup, SOUP_PARSER, parse_only=parse_only)
+
+
+def get_page_soup(url, parse_only=None):
+    """
+    Fetch and parse a page.  Pass a SoupStrainer as `parse_only` to build
+    only the part of the tree the caller looks at.
+    """
     resp = get_request_session().get(url)
-    soup = BeautifulSoup(resp.text)
-    return soup
+    return parse_soup(resp.text, parse_only=parse_only)
+
+
+class InvalidPlugin(Exception):
+    pass
 
 
 def extract_plugin_info(jarpath):
@@ -197,6 +571,83 @@ def extract_plugin_info(jarpath):
         return yaml.load(pyml)
     except (KeyError, IOError):
         return None
+    except (zipfile.BadZipfile, yaml.YAMLError) as e:
+        raise InvalidPlugin("%s is not a valid plugin file: %s" % (jarpath, e))
+
+
+_ZIP_EOCD = struct.Struct("<4s4H2LH")
+_ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def read_jar_entry(jarpath, name):
+    """
+    Read a single entry out of a jar without loading its central directory
+    into ZipInfo objects.  Server jars hold thousands of entries, and we
+    usually only want META-INF/MANIFEST.MF out of them, so this seeks to the
+    end-of-central-directory record, scans the raw directory bytes for `name`
+    and inflates just that member.  Anything unusual (zip64, encryption,
+    exotic compression) falls back to zipfile.
+
+    Raises KeyError if the entry does not exist, IOError if the file can't
+    be read and zipfile.BadZipfile if it isn't a zip at all.
+    """
+    with open(jarpath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        filesize = f.tell()
+        tail = min(filesize, 65536 + _ZIP_EOCD.size)
+        f.seek(filesize - tail)
+        data = f.read(tail)
+        pos = data.rfind("PK\x05\x06")
+        if pos < 0 or pos + _ZIP_EOCD.size > len(data):
+            raise zipfile.BadZipfile("%s is not a zip file" % (jarpath,))
+        eocd = _ZIP_EOCD.unpack(data[pos:pos + _ZIP_EOCD.size])
+        cd_size, cd_offset = eocd[5], eocd[6]
+        if cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF:
+            return _read_jar_entry_fallback(jarpath, name)
+        f.seek(cd_offset)
+        directory = f.read(cd_size)
+
+        pos = 0
+        while pos + _ZIP_CENTRAL_HEADER.size <= len(directory):
+            header = _ZIP_CENTRAL_HEADER.unpack(directory[pos:pos + _ZIP_CENTRAL_HEADER.size])
+            if header[0] != "PK\x01\x02":
+                return _read_jar_entry_fallback(jarpath, name)
+            flags, method = header[3], header[4]
+            csize, fnlen, extralen, commentlen = header[8], header[10], header[11], header[12]
+            offset = header[16]
+            start = pos + _ZIP_CENTRAL_HEADER.size
+            if directory[start:start + fnlen] == name:
+                if flags & 0x1 or method not in (0, 8) or 0xFFFFFFFF in (csize, offset):
+                    return _read_jar_entry_fallback(jarpath, name)
+                f.seek(offset)
+                local = _ZIP_LOCAL_HEADER.unpack(f.read(_ZIP_LOCAL_HEADER.size))
+                if local[0] != "PK\x03\x04":
+                    raise zipfile.BadZipfile("Bad local header for %s in %s" % (name, jarpath))
+                f.seek(local[9] + local[10], os.SEEK_CUR)
+                raw = f.read(csize)
+                if method == 8:
+                    return zlib.decompress(raw, -15)
+                return raw
+            pos = start + fnlen + extralen + commentlen
+    raise KeyError(name)
+
+
+def _read_jar_entry_fallback(jarpath, name):
+    with open(jarpath, 'rb') as f:
+        return zipfile.ZipFile(f).read(name)
+
+
+def list_jar_entries(jarpath):
+    """
+    List the entries of a jar as (name, size, compressed size) tuples.  Only
+    the central directory is read.
+
+    Raises IOError if the file can't be read and zipfile.BadZipfile if it
+    isn't a zip at all.
+    """
+    with open(jarpath, 'rb') as f:
+        return [(i.filename, i.file_size, i.compress_size) for i in zipfile.ZipFile(f).infolist()]
 
 
 def hashfile(fileobj=None, path=None):
@@ -259,6 +710,9 @@ def format_search_result(number, result):
 
     if 'stage' in result:
         right += " [%s]" % (result['stage'],)
+
+    if 'sources' in result:
+        right += " on %s" % (", ".join(result['sources']),)
     heading += right.rjust(term_width - len(heading))
 
     lines = [heading, '']
@@ -272,6 +726,22 @@ def format_search_result(number, result):
 def feed_parse(url):
     return feedparser.parse(get_request_session().get(url).text)
 
+def conditional_feed_parse(url, etag=None):
+    """
+    Fetch and parse a feed, bypassing the http cache and sending
+    If-None-Match when an etag is given.
+
+    Returns a (feed, etag) tuple, feed is None if the server answered
+    304 Not Modified.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    resp = get_http_session().get(url, headers=headers)
+    if resp.status_code == 304:
+        return None, etag
+    return feedparser.parse(resp.text), resp.headers.get('ETag')
+
 def page(content, pagecallback=None):
     """
     Output `content`, call `pagecallback` after every page with page
@@ -0,0 +1,201 @@
+from __future__ import absolute_import
+
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+import zlib
+
+from .backup import find_worlds
+
+SECTOR_SIZE = 4096
+HEADER_SECTORS = 2
+CHUNKS_PER_REGION = 1024
+
+# region directories sharing chunk coordinates with the terrain in region/
+SIBLING_DIRS = ("entities", "poi")
+
+# the named TAG_Long header of InhabitedTime in a chunk's NBT
+INHABITED_TAG = "\x04\x00\x0dInhabitedTime"
+
+TICKS_PER_SECOND = 20
+
+
+def find_region_files(rootdir):
+    """
+    Terrain region files of every world of a server, as a list of
+    (dimension, path) tuples.  The dimension is the directory holding the
+    region directory, relative to the server root.
+    """
+    regions = []
+    for world in find_worlds(rootdir):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(rootdir, world)):
+            dirnames.sort()
+            if os.path.basename(dirpath) != "region":
+                continue
+            dimension = os.path.relpath(os.path.dirname(dirpath), rootdir)
+            for filename in sorted(filenames):
+                if filename.endswith(".mca"):
+                    regions.append((dimension, os.path.join(dirpath, filename)))
+    return regions
+
+
+def read_header(buf):
+    """
+    Parse the location table of a region file, returns {index: (offset, sectors)}
+    for every chunk present.  Offsets and sizes are in sectors.
+    """
+    chunks = {}
+    for index in xrange(CHUNKS_PER_REGION):
+        location, = struct.unpack_from(">I", buf, index * 4)
+        if location:
+            chunks[index] = (location >> 8, location & 0xFF)
+    return chunks
+
+
+def inhabited_time(payload, compression):
+    """
+    Find InhabitedTime in a chunk's compressed NBT, decompressing only as far
+    as it's needed.  Returns None if it can't be found.
+    """
+    if compression == 1:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 2:
+        decompressor = zlib.decompressobj()
+    elif compression == 3:
+        decompressor = None
+    else:
+        # external (.mcc) or unknown compression
+        return None
+
+    needed = len(INHABITED_TAG) + 8
+    buf = ""
+    while True:
+        if decompressor is None:
+            out, payload = payload, ""
+        else:
+            try:
+                out = decompressor.decompress(payload, 16384)
+            except zlib.error:
+                return None
+            payload = decompressor.unconsumed_tail
+        buf += out
+        index = buf.find(INHABITED_TAG)
+        if index >= 0 and len(buf) >= index + needed:
+            return struct.unpack(">q", buf[index + len(INHABITED_TAG):index + needed])[0]
+        if not out and not payload:
+            return None
+        # keep enough to match a tag split between two pieces
+        buf = buf[index:] if index >= 0 else buf[-needed:]
+
+
+def analyze_region(path):
+    """
+    Read the header of a region file and the InhabitedTime of each chunk.
+    Returns a dict with the file's size and {index: inhabited ticks or None}.
+    """
+    info = {'path': path, 'size': os.path.getsize(path), 'chunks': {}}
+    if info['size'] < HEADER_SECTORS * SECTOR_SIZE:
+        return info
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for index, (offset, sectors) in read_header(buf).iteritems():
+                start = offset * SECTOR_SIZE
+                if offset < HEADER_SECTORS or start + 5 > len(buf):
+                    info['chunks'][index] = None
+                    continue
+                length, compression = struct.unpack_from(">IB", buf, start)
+                payload = buf[start + 5:min(start + 4 + length, len(buf))]
+                info['chunks'][index] = inhabited_time(payload, compression)
+        finally:
+            buf.close()
+    return info
+
+
+def analyze_regions(paths, processes=None):
+    """
+    Analyze many region files on a process pool, yields analyze_region's
+    results in no particular order.
+    """
+    if not paths:
+        return
+    pool = multiprocessing.Pool(processes or min(len(paths), multiprocessing.cpu_count()))
+    try:
+        for info in pool.imap_unordered(analyze_region, paths, chunksize=4):
+            yield info
+    finally:
+        pool.close()
+        pool.join()
+
+
+def prunable_chunks(info, threshold):
+    """Chunks of an analyzed region inhabited for fewer than `threshold` ticks."""
+    return sorted(index for index, ticks in info['chunks'].iteritems()
+                  if ticks is not None and ticks < threshold)
+
+
+def remove_chunks(path, indexes):
+    """
+    Rewrite a region file without the chunks at `indexes`, packing the
+    remaining chunks together.  The file is deleted if no chunks remain.
+    Returns the number of bytes freed.
+    """
+    indexes = set(indexes)
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    chunks = read_header(data)
+    keep = sorted(i for i in chunks if i not in indexes)
+    if not keep:
+        os.unlink(path)
+        return size
+
+    locations = [0] * CHUNKS_PER_REGION
+    timestamps = [0] * CHUNKS_PER_REGION
+    body = []
+    next_sector = HEADER_SECTORS
+    for index in keep:
+        offset, sectors = chunks[index]
+        body.append(data[offset * SECTOR_SIZE:(offset + sectors) * SECTOR_SIZE].ljust(sectors * SECTOR_SIZE, "\0"))
+        locations[index] = (next_sector << 8) | sectors
+        timestamps[index], = struct.unpack_from(">I", data, SECTOR_SIZE + index * 4)
+        next_sector += sectors
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".prune-")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(struct.pack(">%sI" % (CHUNKS_PER_REGION,), *locations))
+        f.write(struct.pack(">%sI" % (CHUNKS_PER_REGION,), *timestamps))
+        for chunk in body:
+            f.write(chunk)
+    os.rename(tmp, path)
+    return size - os.path.getsize(path)
+
+
+def prune_region(args):
+    """
+    Remove chunks from a terrain region file and the entity and poi region
+    files at the same coordinates.  Takes a (path, indexes) tuple so it can
+    be mapped over a pool; returns the bytes freed.
+    """
+    path, indexes = args
+    freed = remove_chunks(path, indexes)
+    dimension = os.path.dirname(os.path.dirname(path))
+    for sibling in SIBLING_DIRS:
+        other = os.path.join(dimension, sibling, os.path.basename(path))
+        if os.path.exists(other):
+            freed += remove_chunks(other, indexes)
+    return freed
+
+
+def prune_regions(pruning, processes=None):
+    """Apply prune_region to {path: indexes} on a process pool, returns bytes freed."""
+    if not pruning:
+        return 0
+    pool = multiprocessing.Pool(processes or min(len(pruning), multiprocessing.cpu_count()))
+    try:
+        return sum(pool.imap_unordered(prune_region, pruning.items()))
+    finally:
+        pool.close()
+        pool.join()
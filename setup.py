@@ -14,7 +14,6 @@ requires = [
     'requests_cache>=0.4.4',
     'pager>=3.3',
     'argcomplete>=0.8.0',
-    'progressbar>=2.3',
     'beautifulsoup4>=4.3.2',
     'feedparser>=5.1.3',
     'requests>=1.2.3',
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from StringIO import StringIO
+from bukkitadmin import backup
+from bukkitadmin.backup import BackupError, BackupStore
+from bukkitadmin.runserver import PidFile
+from bukkitadmin.servers import Server
+
+
+class BackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.root = os.path.join(self.tmpdir, "s1")
+        os.makedirs(os.path.join(self.root, "world", "region"))
+        zf = zipfile.ZipFile(os.path.join(self.root, "craftbukkit.jar"), mode='w')
+        zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n")
+        zf.close()
+        self.server = Server("s1", os.path.join(self.root, "craftbukkit.jar"))
+        self.write("world/level.dat", self.random_bytes(1000))
+        self.write("world/region/r.0.0.mca", self.random_bytes(backup.SECTOR_SIZE * 200))
+        self.store = BackupStore.get(self.server, rootdir=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def random_bytes(self, size):
+        return os.urandom(size)
+
+    def write(self, relpath, data):
+        with open(os.path.join(self.root, relpath), 'wb') as f:
+            f.write(data)
+
+    def read(self, relpath):
+        with open(os.path.join(self.root, relpath), 'rb') as f:
+            return f.read()
+
+    def test_iter_chunks(self):
+        data = self.random_bytes(backup.SECTOR_SIZE * 300 + 17)
+        chunks = list(backup.iter_chunks(StringIO(data)))
+        self.assertEqual("".join(chunks), data)
+        self.assertTrue(len(chunks) > 300 / backup.MAX_SECTORS)
+        for chunk in chunks[:-1]:
+            self.assertEqual(len(chunk) % backup.SECTOR_SIZE, 0)
+            self.assertTrue(backup.MIN_SECTORS * backup.SECTOR_SIZE <= len(chunk) <= backup.MAX_SECTORS * backup.SECTOR_SIZE)
+
+    def test_incremental_backup(self):
+        name, stats = self.store.backup(self.server, threads=2)
+        self.assertEqual(stats['files'], 2)
+        self.assertEqual(stats['unchanged'], 0)
+
+        _, stats = self.store.backup(self.server, threads=2)
+        self.assertEqual(stats['unchanged'], 2)
+        self.assertEqual(stats['read'], 0)
+
+        # rewrite one sector in the middle of the region file
+        region = self.read("world/region/r.0.0.mca")
+        offset = backup.SECTOR_SIZE * 100
+        self.write("world/region/r.0.0.mca", region[:offset] + self.random_bytes(backup.SECTOR_SIZE) + region[offset + backup.SECTOR_SIZE:])
+        os.utime(os.path.join(self.root, "world/region/r.0.0.mca"), (1, 1))
+        _, stats = self.store.backup(self.server, threads=2)
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertTrue(0 < stats['new'] <= 2)
+        self.assertEqual(len(self.store.snapshots()), 3)
+
+    def test_restore(self):
+        level, region = self.read("world/level.dat"), self.read("world/region/r.0.0.mca")
+        name, _ = self.store.backup(self.server)
+        self.write("world/level.dat", "corrupted")
+        self.write("world/region/r.-1.0.mca", "new region")
+        os.unlink(os.path.join(self.root, "world/region/r.0.0.mca"))
+
+        stats = self.store.restore(self.server, name)
+        self.assertEqual(stats, {'files': 2, 'restored': 2, 'removed': 1})
+        self.assertEqual(self.read("world/level.dat"), level)
+        self.assertEqual(self.read("world/region/r.0.0.mca"), region)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "world/region/r.-1.0.mca")))
+        self.assertEqual(self.store.restore(self.server)['restored'], 0)
+
+    def test_restore_replaced_file(self):
+        level = self.read("world/level.dat")
+        name, _ = self.store.backup(self.server)
+        path = os.path.join(self.root, "world/level.dat")
+        st = os.stat(path)
+        # same size and mtime, but not the file that was backed up
+        with open(path + ".new", 'wb') as f:
+            f.write(self.random_bytes(len(level)))
+        os.utime(path + ".new", (st.st_atime, st.st_mtime))
+        os.rename(path + ".new", path)
+        self.assertEqual(self.store.restore(self.server, name)['restored'], 1)
+        self.assertEqual(self.read("world/level.dat"), level)
+
+    def test_backup_read_errors(self):
+        walk_files = backup._walk_files
+
+        def vanishing(rootdir, worlds):
+            yield "world/gone.mca", os.path.join(self.root, "world/gone.mca")
+            for item in walk_files(rootdir, worlds):
+                yield item
+        backup._walk_files = vanishing
+        try:
+            name, stats = self.store.backup(self.server)
+            self.assertEqual(stats['files'], 2)
+            self.assertNotIn("world/gone.mca", self.store.load_snapshot(name)['files'])
+            backup._walk_files = lambda rootdir, worlds: [("world/region", os.path.join(self.root, "world/region"))]
+            self.assertRaises(BackupError, self.store.backup, self.server)
+        finally:
+            backup._walk_files = walk_files
+
+    def test_restore_refused_while_running(self):
+        self.store.backup(self.server)
+        with PidFile(os.path.join(self.root, ".PID"), 1):
+            self.assertRaises(BackupError, self.store.restore, self.server)
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from bukkitadmin import bukkitdev, util
+from bukkitadmin.plugins import PluginFile
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>files</title>
+<item><title>TestPlugin 1.1</title><link>http://localhost:%(port)s/files/2/</link>
+<guid>http://localhost:%(port)s/files/2/</guid><pubDate>Mon, 06 Jan 2014 12:00:00 +0000</pubDate></item>
+</channel></rss>"""
+
+FILE_PAGE = """<html><head><title>TestPlugin 1.1</title></head>
+<body><a href="http://localhost:%(port)s/TestPlugin.jar">Download</a></body></html>"""
+
+
+class FakeBukkitDevHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        port = self.server.server_address[1]
+        if self.path.endswith("files.rss"):
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = FEED % {'port': port}
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+        else:
+            body = FILE_PAGE % {'port': port}
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ChangeDetectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.olddir = os.getcwd()
+        os.chdir(self.tmpdir)
+        util._requests_session = None
+        util._result_cache = None
+        self.httpd = HTTPServer(('localhost', 0), FakeBukkitDevHandler)
+        self.httpd.requests = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.source = bukkitdev.PluginSource()
+        self.source.FILES_FEED_URL = "http://localhost:%s/%%s/files.rss" % (self.httpd.server_address[1],)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        util._requests_session = None
+        util._result_cache = None
+        os.chdir(self.olddir)
+        shutil.rmtree(self.tmpdir)
+
+    def test_unchanged_feed_skips_scrape(self):
+        meta = {}
+        url = self.source._get_download_url("testplugin", meta)
+        self.assertTrue(url.endswith("/TestPlugin.jar"))
+        self.assertEqual(meta['feed_etag'], '"v1"')
+        self.assertEqual(len(self.httpd.requests), 2)
+
+        # once the parsed result expires only the feed is checked
+        util.get_result_cache().invalidate(namespace="bukkitdev.download")
+        self.assertEqual(self.source._get_download_url("testplugin", meta), url)
+        self.assertEqual(len(self.httpd.requests), 3)
+        self.assertTrue(self.httpd.requests[-1].endswith("files.rss"))
+
+    def test_cached_result_skips_requests(self):
+        url = self.source._get_download_url("testplugin", {})
+        meta = {}
+        self.assertEqual(self.source._get_download_url("testplugin", meta), url)
+        self.assertEqual(len(self.httpd.requests), 2)
+        self.assertEqual(meta['feed_download_url'], url)
+
+    def test_unchanged_meta_not_rewritten(self):
+        jarpath = os.path.join(self.tmpdir, "TestPlugin.jar")
+        zf = zipfile.ZipFile(jarpath, mode='w')
+        zf.writestr("plugin.yml", "name: TestPlugin\nversion: '1.0'\n")
+        zf.close()
+        plugin = PluginFile(jarpath)
+        plugin.set_meta({'slug': 'testplugin', 'last_download_url': 'http://example.com/old.jar'})
+        url = self.source.get_download_url(plugin)
+        self.assertEqual(plugin.get_meta()['feed_download_url'], url)
+        self.assertEqual(plugin.get_meta()['last_download_url'], 'http://example.com/old.jar')
+
+        writes = []
+        set_meta = PluginFile.set_meta
+        PluginFile.set_meta = lambda self, meta: writes.append(meta)
+        try:
+            self.assertEqual(self.source.get_download_url(plugin), url)
+            util.get_result_cache().invalidate(namespace="bukkitdev.download")
+            self.assertEqual(self.source.get_download_url(plugin), url)
+        finally:
+            PluginFile.set_meta = set_meta
+        self.assertEqual(writes, [])
+
+    def test_no_etag_without_known_url(self):
+        meta = {'feed_etag': '"v1"'}
+        url = self.source._get_download_url("testplugin", meta)
+        self.assertIsNotNone(url)
+        self.assertEqual(meta['feed_download_url'], url)
+
+
+SEARCH_PAGE = """<html><head><title>Search</title><script>var x = 1;</script></head><body>
+<div id="header"><ul><li><a href="/">Home</a></li></ul></div>
+<div class="listing-pagination listing-pagination-top"><ul><li class="listing-pagination-pages-next"><a href="?page=2">Next</a></li></ul></div>
+<table class="listing listing-project"><tbody>
+<tr class="row-joined-to-next"><td class="col-project"><h2><a href="/bukkit-plugins/testplugin/">TestPlugin</a></h2></td>
+<td class="col-category"><a class="category">Admin Tools</a></td>
+<td class="col-date"><span class="standard-date" data-epoch="1389000000">Jan 6</span></td>
+<td class="col-status">Release</td><td class="col-user"><a>metalhedd</a></td></tr>
+<tr><td>A plugin for testing.</td></tr>
+</tbody></table>
+<div id="footer"><a href="/about">About</a></div></body></html>"""
+
+
+class StrainerTest(unittest.TestCase):
+
+    def test_search_strainer_keeps_listing(self):
+        soup = util.parse_soup(SEARCH_PAGE, parse_only=bukkitdev.SEARCH_STRAINER)
+        self.assertIsNone(soup.find("div", id="header"))
+        self.assertIsNotNone(soup.find("div", "listing-pagination-top").find("li", "listing-pagination-pages-next"))
+        row = soup.find("table", {'class': "listing"}).find("tbody").find('tr', {'class': 'row-joined-to-next'})
+        self.assertEqual(row.find('h2').contents[0].text, "TestPlugin")
+        self.assertEqual(row.find('td', 'col-date').find('span', 'standard-date')['data-epoch'], "1389000000")
+
+    def test_link_strainer(self):
+        soup = util.parse_soup(FILE_PAGE % {'port': 80}, parse_only=bukkitdev.LINK_STRAINER)
+        self.assertEqual(soup.find('a', text="Download")['href'], "http://localhost:80/TestPlugin.jar")
+        self.assertIsNone(soup.find("title"))
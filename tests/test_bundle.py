@@ -0,0 +1,88 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import yaml
+import zipfile
+from StringIO import StringIO
+from bukkitadmin import bundle
+from bukkitadmin.bundle import BundleError
+from bukkitadmin.plugins import Library, PluginFile
+
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.source = os.path.join(self.tmpdir, "source")
+        self.target = os.path.join(self.tmpdir, "target")
+        os.mkdir(self.source)
+        os.mkdir(self.target)
+        self.create_jar(self.source, "Foo", "1.0")
+        self.create_jar(self.source, "Bar", "2.0").set_meta({'source': 'lan'})
+        with open(os.path.join(self.source, ".sources.yml"), 'w') as f:
+            yaml.dump({'lan': {'type': 'mirror', 'host': 'node1:8123'}}, f)
+        self.path = os.path.join(self.tmpdir, "library.bundle")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_jar(self, directory, name, version):
+        path = os.path.join(directory, "%s.jar" % (name,))
+        zf = zipfile.ZipFile(path, mode='w')
+        zf.writestr("plugin.yml", yaml.dump({'name': name, 'version': version}))
+        zf.writestr("data.bin", os.urandom(1000))
+        zf.close()
+        return PluginFile(path)
+
+    def test_round_trip(self):
+        manifest = bundle.export_library(Library(self.source), self.path)
+        self.assertEqual(sorted(manifest['plugins']), ["Bar", "Foo"])
+        self.assertEqual(sorted(tarfile.open(self.path).getnames()),
+                         sorted(["plugins/Bar.jar", "plugins/Bar.yml", "plugins/Foo.jar", "sources.yml", bundle.MANIFEST_NAME]))
+
+        target = Library(self.target)
+        result = bundle.import_bundle(target, self.path, threads=2)
+        self.assertEqual(result, {'imported': ["Bar", "Foo"], 'skipped': [], 'sources': ["lan"]})
+        for name in ("Foo.jar", "Bar.jar", "Bar.yml"):
+            with open(os.path.join(self.source, name), 'rb') as a, open(os.path.join(self.target, name), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(target.get_plugin("Bar").get_meta(), {'source': 'lan'})
+        self.assertEqual(Library(self.target).sources['lan'].host, 'node1:8123')
+        self.assertFalse([f for f in os.listdir(self.target) if f.startswith(".") and ".jar." in f])
+
+        result = bundle.import_bundle(target, self.path)
+        self.assertEqual(result['imported'], [])
+        self.assertEqual(result['skipped'], ["Bar", "Foo"])
+
+    def test_append_and_stream(self):
+        library = Library(self.source)
+        bundle.export_library(library, self.path, names=["foo"])
+        self.assertEqual(sorted(bundle.read_manifest(self.path)['plugins']), ["Foo"])
+        self.create_jar(self.source, "Foo", "1.1")
+        library.reload()
+        bundle.export_library(library, self.path, append=True)
+        manifest = bundle.read_manifest(self.path)
+        self.assertEqual(sorted(manifest['plugins']), ["Bar", "Foo"])
+        self.assertEqual(manifest['plugins']['Foo']['version'], "1.1")
+        bundle.import_bundle(Library(self.target), self.path)
+        self.assertEqual(Library(self.target).get_plugin("Foo").version, "1.1")
+
+        out = StringIO()
+        bundle.export_library(library, out)
+        self.assertEqual(len(tarfile.open(fileobj=StringIO(out.getvalue())).getnames()), 5)
+
+    def test_corrupt_bundle(self):
+        bundle.export_library(Library(self.source), self.path, names=["Foo"])
+        with tarfile.open(self.path) as tar:
+            offset = tar.getmember("plugins/Foo.jar").offset_data
+        with open(self.path, 'r+b') as f:
+            f.seek(offset + 100)
+            f.write("corrupted")
+        self.assertRaises(BundleError, bundle.import_bundle, Library(self.target), self.path)
+        self.assertEqual([f for f in os.listdir(self.target) if f.endswith(".jar") or ".jar." in f], [])
+
+        with open(self.path, 'wb') as f:
+            f.write("not a bundle")
+        self.assertRaises(BundleError, bundle.read_manifest, self.path)
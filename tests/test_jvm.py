@@ -0,0 +1,40 @@
+import unittest
+
+from bukkitadmin import jvm
+
+
+class JvmProfileTest(unittest.TestCase):
+
+    def test_default_profile(self):
+        profile = jvm.resolve_profile({'path': 'test/craftbukkit.jar'})
+        self.assertEqual(jvm.build_command("craftbukkit.jar", profile), ["java", "-jar", "craftbukkit.jar"])
+
+    def test_user_profile_with_override(self):
+        profiles = {'big': {'heap': '8G', 'gc': 'g1', 'flags': ['-Dfoo=bar'], 'args': ['nogui']}}
+        profile = jvm.resolve_profile({'jvm_profile': 'big', 'jvm': {'heap': '4G', 'large_pages': True}}, profiles)
+        self.assertEqual(jvm.build_command("spigot.jar", profile),
+                         ["java", "-Xmx4G", "-XX:+UseG1GC", "-XX:+UseLargePages", "-Dfoo=bar",
+                          "-jar", "spigot.jar", "nogui"])
+
+    def test_pretouch_commits_heap(self):
+        profile = {'heap': '2G', 'pretouch': True}
+        command = jvm.build_command("craftbukkit.jar", profile)
+        self.assertIn("-Xms2G", command)
+        self.assertIn("-XX:+AlwaysPreTouch", command)
+
+    def test_unknown_profile(self):
+        self.assertRaises(jvm.UnknownProfile, jvm.resolve_profile, {'jvm_profile': 'nope'})
+
+    def test_unknown_gc(self):
+        self.assertRaises(ValueError, jvm.build_command, "craftbukkit.jar", {'gc': 'cms2'})
+
+    def test_auto_heap(self):
+        self.assertEqual(jvm.auto_heap_size(1, host_memory=16384), 14592)
+        self.assertEqual(jvm.auto_heap_size(4, host_memory=16384), 3584)
+        self.assertEqual(jvm.auto_heap_size(100, host_memory=16384), jvm.AUTO_HEAP_MIN)
+        self.assertEqual(jvm.auto_heap_size(1, host_memory=256 * 1024), jvm.AUTO_HEAP_MAX)
+
+    def test_auto_profile(self):
+        profile = jvm.resolve_profile({'jvm_profile': 'auto'})
+        command = jvm.build_command("craftbukkit.jar", profile, server_count=4, host_memory=16384)
+        self.assertEqual(command[:3], ["java", "-Xmx3584M", "-Xms3584M"])
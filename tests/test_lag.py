@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from bukkitadmin import lag
+
+
+class LagLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.log = lag.LagLog(os.path.join(self.tmpdir, lag.LAG_FILE), capacity=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ring_buffer(self):
+        self.assertEqual(self.log.samples(), [])
+        for i in range(6):
+            self.log.append(lag.TPS, 20.0 - i, timestamp=1000.0 + i)
+        self.assertEqual([s[0] for s in self.log.samples()], [1002.0, 1003.0, 1004.0, 1005.0])
+        self.assertEqual([s[2] for s in self.log.samples(since=1004.0)], [16.0, 15.0])
+        self.assertEqual(os.path.getsize(self.log.path), lag.HEADER.size + 4 * lag.RECORD.size)
+        # the capacity is the file's, not the reader's
+        self.assertEqual(len(lag.LagLog(self.log.path, capacity=100).samples()), 4)
+
+    def test_sampler(self):
+        clock = iter([100.0, 110.0, 120.0, 130.0]).next
+        sent = []
+        self.log.capacity = 100
+        sampler = lag.LagSampler(None, send=sent.append, commands=['tps'], interval=60, log=self.log)
+        sampler.clock = lambda: 0.0
+        sampler.poll()
+        sampler.clock = lambda: 59.0
+        sampler.poll()
+        self.assertEqual(sent, [])
+        sampler.clock = lambda: 61.0
+        sampler.poll()
+        self.assertEqual(sent, ['tps'])
+
+        sampler.clock = clock
+        sampler.feed("[12:00:00 INFO]: \xc2\xa76TPS from last 1m, 5m, 15m: \xc2\xa7a*20.0, \xc2\xa7a19.9, \xc2\xa7a19.8\n")
+        sampler.feed("[12:00:10 WARN]: Can't keep up! Is the server overloaded? Running 2034ms behind, skipping 40 tick(s)\n"
+                     "[12:00:10 WARN]: Can't keep up! Did the system time change, or is the server overloaded?\n")
+        sampler.feed("[12:00:20 INFO]: Allocated memory: 2,048 MB.\n[12:00:20 INFO]: Free memory: 512 MB.\n")
+        sampler.feed("[12:00:30 INFO]: Current TPS = 14.5\n[12:00:3")
+        self.assertEqual(self.log.samples(), [
+            (100.0, lag.TPS, 20.0, 0.0),
+            (110.0, lag.OVERLOADED, 2034.0, 40.0),
+            (110.0, lag.OVERLOADED, 0.0, 0.0),
+            (120.0, lag.MEMORY, 1536.0, 2048.0),
+            (130.0, lag.TPS, 14.5, 0.0),
+        ])
+
+    def test_summarize(self):
+        samples = [(100.0, lag.TPS, 20.0, 0.0), (110.0, lag.OVERLOADED, 2000.0, 40.0),
+                   (160.0, lag.TPS, 14.0, 0.0), (170.0, lag.MEMORY, 1500.0, 2048.0)]
+        summary = lag.summarize(samples)
+        self.assertEqual(summary['tps'], {'samples': 2, 'average': 17.0, 'min': 14.0, 'min_at': 160.0, 'latest': 14.0})
+        self.assertEqual(summary['overloaded'], {'count': 1, 'behind_ms': 2000, 'skipped_ticks': 40, 'last_at': 110.0})
+        self.assertEqual(summary['memory'], {'latest_mb': 1500.0, 'max_mb': 1500.0, 'allocated_mb': 2048.0})
+        rows = lag.timeline(samples, 100.0, 220.0, 2)
+        self.assertEqual([(start, tps['min'] if tps else None, count) for start, tps, count, behind in rows],
+                         [(100.0, 20.0, 1), (160.0, 14.0, 0)])
+        self.assertEqual(lag.summarize([])['overloaded']['count'], 0)
+
+    def test_parse_duration(self):
+        self.assertEqual(lag.parse_duration("90"), 90)
+        self.assertEqual(lag.parse_duration("30m"), 1800)
+        self.assertEqual(lag.parse_duration("7d"), 7 * 86400)
+        self.assertRaises(ValueError, lag.parse_duration, "soon")
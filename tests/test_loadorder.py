@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from bukkitadmin import loadorder
+from bukkitadmin.runserver import StartupWatcher
+from bukkitadmin.servers import Server
+
+
+def plugin(depend=(), softdepend=(), loadbefore=(), load='POSTWORLD'):
+    return {'depend': list(depend), 'softdepend': list(softdepend), 'loadbefore': list(loadbefore), 'load': load}
+
+
+class LoadOrderTest(unittest.TestCase):
+
+    inventory = {
+        'Vault': plugin(),
+        'Essentials': plugin(depend=['Vault'], softdepend=['PermissionsEx']),
+        'EssentialsChat': plugin(depend=['essentials']),
+        'PermissionsEx': plugin(),
+        'WorldEdit': plugin(load='STARTUP'),
+        'Multiverse': plugin(loadbefore=['WorldEdit'], load='STARTUP'),
+        'Broken': plugin(depend=['Missing']),
+        'NeedsBroken': plugin(softdepend=['Vault'], depend=['Broken']),
+    }
+
+    def test_load_order(self):
+        order, failed = loadorder.load_order(self.inventory)
+        self.assertEqual(order, ['Multiverse', 'WorldEdit', 'PermissionsEx', 'Vault', 'Essentials', 'EssentialsChat'])
+        self.assertEqual(sorted(failed), ['Broken', 'NeedsBroken'])
+
+    def test_soft_cycle_is_broken(self):
+        order, failed = loadorder.load_order({'A': plugin(softdepend=['B']), 'B': plugin(depend=['A'])})
+        self.assertEqual(order, ['A', 'B'])
+        order, failed = loadorder.load_order({'A': plugin(depend=['B']), 'B': plugin(depend=['A'])})
+        self.assertEqual(failed, {'A': 'circular dependency', 'B': 'circular dependency'})
+
+    def test_critical_path(self):
+        order, _ = loadorder.load_order(self.inventory)
+        after, _ = loadorder.build_graph(self.inventory)
+        self.assertEqual(loadorder.critical_path(order, after), (3, ['PermissionsEx', 'Essentials', 'EssentialsChat']))
+        timings = {'Vault': 5.0, 'Essentials': 1.0, 'EssentialsChat': 0.5, 'PermissionsEx': 0.1, 'WorldEdit': 2.0}
+        self.assertEqual(loadorder.critical_path(order, after, timings), (6.5, ['Vault', 'Essentials', 'EssentialsChat']))
+
+    def test_parse_log_timings(self):
+        log = [
+            "[12:00:00] [Server thread/INFO]: [WorldEdit] Enabling WorldEdit v6.0",
+            "[12:00:02] [Server thread/INFO]: Preparing level \"world\"",
+            "[12:00:09] [Server thread/INFO]: [Vault] Enabling Vault v1.4",
+            "[12:00:10] [Server thread/INFO]: [Vault] hooked economy",
+            "[12:00:12] [Server thread/INFO]: [Essentials] Enabling Essentials v2.13",
+            "[12:00:13] [Server thread/INFO]: Done (13.002s)! For help, type \"help\"",
+        ]
+        self.assertEqual(loadorder.parse_log_timings(log), {'WorldEdit': 2.0, 'Vault': 3.0, 'Essentials': 1.0})
+
+
+class StartupWatcherTimingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        zf = zipfile.ZipFile(os.path.join(self.tmpdir, "craftbukkit.jar"), mode='w')
+        zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n")
+        zf.close()
+        self.server = Server("test", os.path.join(self.tmpdir, "craftbukkit.jar"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plugin_timings_recorded(self):
+        clock = iter([10.0, 10.5, 12.0, 12.25]).next
+        watcher = StartupWatcher(self.server, clock=clock)
+        watcher.feed("[INFO] [Vault] Enabling Vault v1.4\n")
+        watcher.feed("[INFO] [Essentials] Enabling Essentials v2.13\n[INFO] [Essentials] loaded\n")
+        watcher.feed("[INFO] Done (3.5")
+        watcher.feed("s)! For help, type \"help\"\n")
+        entry = self.server.get_startup_history()[-1]
+        self.assertEqual(entry['duration'], 3.5)
+        self.assertEqual(entry['plugin_timings'], {'Vault': 0.5, 'Essentials': 1.75})
+        self.assertEqual(loadorder.get_enable_timings(self.server), (entry['plugin_timings'], "startup history"))
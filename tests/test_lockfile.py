@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+import zipfile
+from bukkitadmin import lockfile
+from bukkitadmin.plugins import Library
+from bukkitadmin.servers import Server
+
+
+class LockfileTest(unittest.TestCase):
+
+    def create_dummy_jar(self, path, **kwargs):
+        zf = zipfile.ZipFile(path, mode='w')
+        defaults = dict(version="1.0", author='metalhedd', main='me.metalhedd.TestPlugin')
+        defaults.update(kwargs)
+        zf.writestr("plugin.yml", yaml.dump(defaults))
+        zf.close()
+        return path
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.libdir = os.path.join(self.tmpdir, "plugin-library")
+        os.mkdir(self.libdir)
+        self.create_dummy_jar(os.path.join(self.libdir, "Plugin1.jar"), name="Plugin1", version="2.0", depend=["Plugin2"])
+        self.create_dummy_jar(os.path.join(self.libdir, "Plugin2.jar"), name="Plugin2")
+        self.create_dummy_jar(os.path.join(self.libdir, "Plugin3.jar"), name="Plugin3")
+        self.library = Library(self.libdir)
+
+        os.mkdir(os.path.join(self.tmpdir, "s1"))
+        zf = zipfile.ZipFile(os.path.join(self.tmpdir, "s1", "craftbukkit.jar"), mode='w')
+        zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n")
+        zf.close()
+        self.server = Server("s1", os.path.join(self.tmpdir, "s1", "craftbukkit.jar"))
+        self.plugindir = self.server.get_plugin_dir()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_from_library_includes_dependencies(self):
+        lock = lockfile.from_library(self.library, ["plugin1"])
+        self.assertEqual(sorted(lock), ["Plugin1", "Plugin2"])
+        self.assertEqual(lock["Plugin1"]["version"], "2.0")
+
+    def test_save_and_load(self):
+        lock = lockfile.from_library(self.library)
+        path = os.path.join(self.tmpdir, "plugins.lock")
+        lockfile.save(lock, path)
+        self.assertEqual(lockfile.load(path), lock)
+
+    def test_inventory_is_cached(self):
+        self.create_dummy_jar(os.path.join(self.plugindir, "Plugin2.jar"), name="Plugin2")
+        inventory = self.server.get_inventory()
+        self.assertEqual(inventory["Plugin2"]["version"], "1.0")
+        self.assertTrue(os.path.exists(os.path.join(self.plugindir, ".inventory.yml")))
+        # a stale cache entry is trusted while the jar's stat is unchanged
+        with open(os.path.join(self.plugindir, ".inventory.yml")) as f:
+            cached = yaml.load(f)
+        cached["Plugin2.jar"]["version"] = "cached"
+        with open(os.path.join(self.plugindir, ".inventory.yml"), 'w') as f:
+            yaml.dump(cached, f)
+        self.assertEqual(self.server.get_inventory()["Plugin2"]["version"], "cached")
+
+    def test_sync_applies_minimal_diff(self):
+        shutil.copy(os.path.join(self.libdir, "Plugin2.jar"), self.plugindir)
+        self.create_dummy_jar(os.path.join(self.plugindir, "Plugin1-1.0.jar"), name="Plugin1", version="1.0")
+        self.create_dummy_jar(os.path.join(self.plugindir, "Extra.jar"), name="Extra")
+        lock = lockfile.from_library(self.library, ["Plugin1", "Plugin3"])
+
+        self.assertEqual(lockfile.diff(lock, self.server.get_inventory()), (["Plugin3"], ["Plugin1"], ["Extra"]))
+        self.assertEqual(len(lockfile.sync_server(self.server, self.library, lock, dry_run=True)), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.plugindir, "Extra.jar")))
+
+        lockfile.sync_server(self.server, self.library, lock)
+        self.assertEqual(sorted(f for f in os.listdir(self.plugindir) if f.endswith(".jar")),
+                         ["Plugin1.jar", "Plugin2.jar", "Plugin3.jar"])
+        self.assertEqual(lockfile.sync_server(self.server, self.library, lock), [])
+
+    def test_sync_rejects_changed_library(self):
+        lock = lockfile.from_library(self.library, ["Plugin3"])
+        self.create_dummy_jar(os.path.join(self.libdir, "Plugin3.jar"), name="Plugin3", version="1.1")
+        self.assertRaises(lockfile.LockfileError, lockfile.sync_server, self.server, self.library, lock)
+        self.assertEqual(self.server.get_inventory(), {})
+
+    def test_sync_servers(self):
+        lock = lockfile.from_library(self.library, ["Plugin3"])
+        results = list(lockfile.sync_servers([self.server], self.library, lock))
+        self.assertEqual(results, [(self.server, ["install Plugin3-1.0"])])
@@ -0,0 +1,142 @@
+import errno
+import fcntl
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import yaml
+import zipfile
+from bukkitadmin import locking, servers
+from bukkitadmin.serverjars import ServerJarCache
+from bukkitadmin.plugins import Library, PluginFile
+from bukkitadmin.util import chdir
+
+PROCESSES = 12
+ROUNDS = 15
+# jars are slower to make and index, fewer of them still collide plenty
+JAR_ROUNDS = 4
+
+
+def add_servers(rootdir, worker):
+    with chdir(rootdir):
+        for i in range(ROUNDS):
+            with servers.edit_servers_file(create=True) as data:
+                data["s%s-%s" % (worker, i)] = {'path': "s/craftbukkit.jar"}
+
+
+def read_servers(rootdir, worker):
+    with chdir(rootdir):
+        for i in range(ROUNDS * 4):
+            assert isinstance(servers.get_servers_file(create=True), dict)
+
+
+def count_meta(jarpath, worker):
+    plugin = PluginFile(jarpath)
+    for i in range(ROUNDS):
+        with plugin.edit_meta() as meta:
+            meta['count'] = meta.get('count', 0) + 1
+
+
+def add_source(libdir, worker):
+    lib = Library(libdir)
+    with lib.edit_sources():
+        lib.add_source("mirror%s" % (worker,), type='mirror', host="mirror%s:8123" % (worker,))
+
+
+def create_server_jar(path, version):
+    zf = zipfile.ZipFile(path, mode='w')
+    zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\nImplementation-Version: %s\n" % (version,))
+    zf.close()
+    return path
+
+
+def add_server_jars(rootdir, worker):
+    cache = ServerJarCache.get(rootdir)
+    for i in range(JAR_ROUNDS):
+        path = os.path.join(rootdir, "upload-%s-%s.jar" % (worker, i))
+        cache.add(create_server_jar(path, "%s.%s" % (worker, i)), move=True)
+
+
+def read_manifests(jardir, worker):
+    for i in range(JAR_ROUNDS):
+        path = create_server_jar(os.path.join(jardir, "%s-%s.jar" % (worker, i)), "1.%s" % (i,))
+        assert servers.read_manifest(path)['Implementation-Version'] == "1.%s" % (i,)
+
+
+def run_processes(*jobs):
+    processes = [multiprocessing.Process(target=func, args=(arg, worker))
+                 for func, arg in jobs for worker in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+class LockingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lock_is_reentrant(self):
+        path = os.path.join(self.tmpdir, "servers.yml")
+        with locking.locked(path):
+            with locking.locked(path, exclusive=False):
+                pass
+            fd = os.open(locking.lock_path(path), os.O_RDWR)
+            try:
+                # another open file (as in another process) can't have it
+                with self.assertRaises(IOError) as cm:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                self.assertEqual(cm.exception.errno, errno.EAGAIN)
+            finally:
+                os.close(fd)
+        self.assertEqual(locking.get_lock(path)._depth, 0)
+
+    def test_threads_take_turns(self):
+        path = os.path.join(self.tmpdir, "counter")
+        counter = []
+
+        def work():
+            for i in range(200):
+                with locking.locked(path):
+                    value = len(counter)
+                    counter.append(value)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter, range(800))
+
+    def test_parallel_processes(self):
+        libdir = os.path.join(self.tmpdir, "plugin-library")
+        os.mkdir(libdir)
+        jarpath = os.path.join(libdir, "Counter.jar")
+        zf = zipfile.ZipFile(jarpath, mode='w')
+        zf.writestr("plugin.yml", yaml.dump({'name': "Counter", 'version': "1.0"}))
+        zf.close()
+
+        jardir = os.path.join(self.tmpdir, "jars")
+        os.mkdir(jardir)
+        ServerJarCache.get(self.tmpdir)
+
+        exitcodes = run_processes((add_servers, self.tmpdir), (read_servers, self.tmpdir),
+                                  (count_meta, jarpath), (add_source, libdir),
+                                  (add_server_jars, self.tmpdir), (read_manifests, jardir))
+        self.assertEqual(exitcodes, [0] * len(exitcodes))
+
+        with chdir(self.tmpdir):
+            self.assertEqual(len(servers.list_servers()), PROCESSES * ROUNDS)
+        self.assertEqual(PluginFile(jarpath).get_meta(), {'count': PROCESSES * ROUNDS})
+        self.assertEqual(sorted(Library(libdir).sources),
+                         sorted(["bukkitdev"] + ["mirror%s" % (i,) for i in range(PROCESSES)]))
+        self.assertEqual(len(ServerJarCache.get(self.tmpdir).versions()), PROCESSES * JAR_ROUNDS)
+        with open(os.path.join(jardir, servers.MANIFEST_CACHE_FILE)) as f:
+            self.assertEqual(len(yaml.load(f)), PROCESSES * JAR_ROUNDS)
@@ -0,0 +1,105 @@
+import binascii
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+
+import yaml
+
+from bukkitadmin import mirror
+from bukkitadmin.plugins import Library, PluginFile
+from bukkitadmin.util import download_file, get_http_session, hashfile
+
+
+class MirrorTest(unittest.TestCase):
+
+    def create_dummy_jar(self, filename, **kwargs):
+        zf = zipfile.ZipFile(os.path.join(self.libdir, filename), mode='w')
+        defaults = dict(name="TestPlugin", version="1.0-SNAPSHOT", author='metalhedd', main='me.metalhedd.TestPlugin')
+        defaults.update(kwargs)
+        zf.writestr("plugin.yml", yaml.dump(defaults))
+        zf.close()
+        return os.path.join(self.libdir, filename)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.libdir = os.path.join(self.tmpdir, "plugin-library")
+        os.mkdir(self.libdir)
+        self.jar = self.create_dummy_jar("ProtocolLib.jar", name="ProtocolLib", description="packets")
+        PluginFile(self.jar).set_meta({'slug': 'protocollib'})
+        self.create_dummy_jar("Scribe.jar", name="Scribe")
+
+        self.httpd = mirror.MirrorServer(('127.0.0.1', 0), Library(self.libdir))
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = "127.0.0.1:%s" % (self.httpd.server_address[1],)
+        self.source = mirror.PluginSource("lan", host=self.host)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_search(self):
+        results = self.source.search("protocollib")
+        self.assertEqual([r['name'] for r in results], ["ProtocolLib"])
+        self.assertEqual(results[0]['summary'], "packets")
+        url, meta = self.source.search_result_url(results[0])
+        self.assertEqual(meta, {'source': 'lan', 'last_download_url': url})
+
+    def test_download(self):
+        plugin = PluginFile(self.jar)
+        url = self.source.get_download_url(plugin)
+        self.assertIn(binascii.hexlify(hashfile(path=self.jar)), url)
+        fname = download_file(url, use_progressbar=False)
+        try:
+            self.assertEqual(PluginFile(fname).name, "ProtocolLib")
+        finally:
+            os.unlink(fname)
+
+    def test_range(self):
+        url = "http://%s/plugins/ProtocolLib.jar" % (self.host,)
+        with open(self.jar, 'rb') as f:
+            data = f.read()
+        resp = get_http_session().get(url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, data[10:20])
+        resp = get_http_session().get(url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(resp.content, data[-5:])
+        resp = get_http_session().get(url, headers={'Range': 'bytes=%s-' % (len(data) + 10,)})
+        self.assertEqual(resp.status_code, 416)
+
+    def test_hidden_files_not_served(self):
+        resp = get_http_session().get("http://%s/plugins/.sources.yml" % (self.host,))
+        self.assertEqual(resp.status_code, 404)
+        resp = get_http_session().get("http://%s/plugins/ProtocolLib.yml" % (self.host,))
+        self.assertEqual(yaml.load(resp.content), {'slug': 'protocollib'})
+
+    def test_parse_range(self):
+        self.assertEqual(mirror.parse_range("bytes=0-", 100), (0, 99))
+        self.assertEqual(mirror.parse_range("bytes=90-200", 100), (90, 99))
+        self.assertIsNone(mirror.parse_range("bytes=-", 100))
+        self.assertIsNone(mirror.parse_range("bytes=0-1,5-6", 100))
+
+    def test_download_checks_digest(self):
+        url = self.source.get_download_url(PluginFile(self.jar))
+        fname = self.source.download(url)
+        os.unlink(fname)
+        # the jar changed after the index was read
+        self.create_dummy_jar("ProtocolLib.jar", name="ProtocolLib", version="2.0")
+        self.assertRaises(mirror.ChecksumMismatch, self.source.download, url)
+
+    def test_index_cached(self):
+        index = self.httpd.index
+        self.assertEqual(len(index.entries()), 2)
+        reloads = []
+        reload = index.library.reload
+        index.library.reload = lambda: reloads.append(1) or reload()
+        index.entries()
+        self.assertEqual(reloads, [])
+        self.create_dummy_jar("Vault.jar", name="Vault")
+        self.assertEqual(sorted(e['name'] for e in index.entries()), ["ProtocolLib", "Scribe", "Vault"])
+        self.assertEqual(reloads, [1])
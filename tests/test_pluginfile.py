@@ -5,7 +5,7 @@ import unittest
 import yaml
 import zipfile
 
-from bukkitadmin.plugins import PluginFile
+from bukkitadmin.plugins import InvalidPlugin, PluginFile
 
 class PluginFileTest(unittest.TestCase):
 
@@ -36,6 +36,36 @@ class PluginFileTest(unittest.TestCase):
         self.assertEqual(jar.authors, ["metalhedd"])
         self.assertEqual(jar.version, "1.0-SNAPSHOT")
 
+    def test_compact_fields(self):
+        jar = PluginFile(self.create_dummy_jar(authors=['metalhedd', 'someone'], depend='Vault', softdepend=['Essentials'],
+                                               load='startup', commands={'test': {'description': 'a command'}}))
+        self.assertFalse(hasattr(jar, '__dict__'))
+        self.assertEqual(jar.authors, ['metalhedd', 'someone'])
+        self.assertEqual(jar.dependencies, ['Vault'])
+        self.assertEqual(jar.soft_dependencies, ['Essentials'])
+        self.assertEqual(jar.load_before, [])
+        self.assertEqual(jar.load, 'STARTUP')
+        self.assertEqual(jar.plugin_yml['commands'], {'test': {'description': 'a command'}})
+
+    def test_missing_name(self):
+        zf = zipfile.ZipFile(os.path.join(self.tmpdir, "Bad.jar"), mode='w')
+        zf.writestr("plugin.yml", "main: me.Bad\n")
+        zf.close()
+        self.assertRaises(InvalidPlugin, PluginFile, os.path.join(self.tmpdir, "Bad.jar"))
+
+    def test_missing_version(self):
+        zf = zipfile.ZipFile(os.path.join(self.tmpdir, "Bad.jar"), mode='w')
+        zf.writestr("plugin.yml", "name: Bad\nmain: me.Bad\n")
+        zf.close()
+        self.assertRaises(InvalidPlugin, PluginFile, os.path.join(self.tmpdir, "Bad.jar"))
+
+    def test_corrupt_jar(self):
+        path = os.path.join(self.tmpdir, "Corrupt.jar")
+        with open(path, 'wb') as f:
+            f.write("not a zip file")
+        self.assertRaises(InvalidPlugin, PluginFile, path)
+        self.assertFalse(PluginFile.is_valid_plugin(path))
+
     def test_hash_equal(self):
         jar1 = PluginFile(self.create_dummy_jar("TestPlugin1.jar"))
         jar2 = PluginFile(self.create_dummy_jar("TestPlugin2.jar"))
@@ -56,6 +86,14 @@ class PluginFileTest(unittest.TestCase):
         self.assertTrue(jar.has_meta())
         self.assertEqual(jar.get_meta()['source'], 'bukkitdev')
 
+    def test_get_meta_leaves_no_lock_file(self):
+        jar = PluginFile(self.create_dummy_jar())
+        self.assertEqual(jar.get_meta(), {})
+        with open(jar._get_meta_path(), 'w') as f:
+            f.write("source: lan\n")
+        self.assertEqual(jar.get_meta(), {'source': 'lan'})
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["TestPlugin.jar", "TestPlugin.yml"])
+
     def test_has_correct_name(self):
         jar = PluginFile(self.create_dummy_jar())
         self.assertTrue(jar.has_correct_name())
@@ -7,7 +7,40 @@ import unittest
 import yaml
 import zipfile
 from bukkitadmin import bukkitdev, jenkins
-from bukkitadmin.plugins import Library, PluginFile, PluginNotFound
+from bukkitadmin.locking import get_lock
+from bukkitadmin.plugins import Library, PluginFile, PluginNotFound, SearchFailed
+
+
+class UnreachableSource(object):
+
+    source_type = 'mirror'
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+
+    def search(self, searchstr):
+        if self.error:
+            raise IOError(self.error)
+        return []
+
+
+class FakeSource(object):
+
+    source_type = 'mirror'
+
+    def __init__(self, name, download):
+        self.name = name
+        self._download = download
+
+    def invalidate(self, plugin):
+        pass
+
+    def get_download_url(self, plugin):
+        return "http://example.com/%s-2.0.jar" % (plugin.name,)
+
+    def download(self, url):
+        return self._download(url)
 
 
 class PluginLibraryTest(unittest.TestCase):
@@ -51,6 +84,23 @@ class PluginLibraryTest(unittest.TestCase):
         p = lib.get_plugin("Plugin4")
         self.assertIsNone(p)
 
+    def test_register_plugin_jars(self):
+        lib = Library(self.tmpdir)
+        elsewhere = tempfile.mkdtemp("bukkitadmin-tests", dir=self.tmpdir)
+        jars = []
+        for filename, name, version in [("a.jar", "Plugin1", "9.0"), ("b.jar", "Plugin5", "1.0"),
+                                        ("c.jar", "plugin5", "2.0"), ("d.jar", "Plugin6", "1.0")]:
+            zf = zipfile.ZipFile(os.path.join(elsewhere, filename), mode='w')
+            zf.writestr("plugin.yml", yaml.dump(dict(name=name, version=version)))
+            zf.close()
+            jars.append(PluginFile(os.path.join(elsewhere, filename)))
+        added = lib.register_plugin_jars(jars, threads=2)
+        self.assertEqual([(p.name, p.version) for p in added], [("plugin5", "2.0"), ("Plugin6", "1.0")])
+        self.assertEqual(lib.get_plugin("Plugin1").version, "1.0-SNAPSHOT")
+        self.assertEqual(len(lib.plugins), 5)
+        self.assertEqual(len(Library(self.tmpdir).plugins), 5)
+        self.assertEqual(lib.register_plugin_jars(jars), [])
+
     def test_load_sources(self):
         sources_yml = os.path.join(self.tmpdir, ".sources.yml")
         with open(sources_yml, 'w') as sourcesf:
@@ -108,6 +158,39 @@ class PluginLibraryTest(unittest.TestCase):
         self.assertEqual(plugin.name, "Scribe")
         self.assertEqual(meta['source'], 'minevsmine')
 
+    def test_update_plugin_downloads_unlocked(self):
+        plugin = PluginFile(self.create_dummy_jar("Instances.jar", name="Instances"))
+        plugin.set_meta({'source': 'lan'})
+        lib = Library(self.tmpdir)
+        newjar = self.create_dummy_jar("download.tmp", name="Instances", version="2.0")
+        held = []
+
+        def download(url):
+            held.append(get_lock(plugin._get_meta_path())._depth)
+            return newjar
+        lib.sources['lan'] = FakeSource('lan', download)
+        plugin = lib.get_plugin("Instances")
+        self.assertTrue(lib.update_plugin(plugin))
+        self.assertEqual(held, [0])
+        self.assertEqual(PluginFile(plugin.jarpath).version, "2.0")
+        self.assertEqual(plugin.get_meta()['last_download_url'], "http://example.com/Instances-2.0.jar")
+        self.assertFalse(os.path.exists(newjar))
+        self.assertFalse(lib.update_plugin(plugin))
+        self.assertEqual(len(held), 1)
+
+    def test_search_failed(self):
+        lib = Library(self.tmpdir)
+        lib.sources = {'a': UnreachableSource('a', "connection refused"), 'b': UnreachableSource('b', "timed out")}
+        try:
+            lib.register_new_plugin("Foo")
+        except SearchFailed as e:
+            self.assertEqual(e.errors, {'a': "connection refused", 'b': "timed out"})
+        else:
+            self.fail("SearchFailed not raised")
+        # one source answered that it doesn't have it
+        lib.sources['b'] = UnreachableSource('b')
+        self.assertRaises(PluginNotFound, lib.register_new_plugin, "Foo")
+
     @unittest.skipIf(os.environ.get('SKIP_SLOW', None), "test_search_bukkitdev_none - Skipped (SLOW)")
     def test_search_bukkitdev_none(self):
         lib = Library(self.tmpdir)
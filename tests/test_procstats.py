@@ -0,0 +1,101 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from bukkitadmin import procstats
+from bukkitadmin.runserver import PidFile
+from bukkitadmin.servers import Server
+
+
+def dead_pid():
+    child = subprocess.Popen(["true"])
+    child.wait()
+    return child.pid
+
+
+class ProcStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.servers = []
+        for name in ("alpha", "beta"):
+            os.mkdir(os.path.join(self.tmpdir, name))
+            jarpath = os.path.join(self.tmpdir, name, "craftbukkit.jar")
+            zf = zipfile.ZipFile(jarpath, mode='w')
+            zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n")
+            zf.close()
+            self.servers.append(Server(name, jarpath))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stale_pid_file(self):
+        alpha = self.servers[0]
+        with open(alpha.get_pid_file_path(), 'w') as f:
+            f.write(str(dead_pid()))
+        self.assertFalse(alpha.is_running())
+        with PidFile(alpha.get_pid_file_path(), os.getpid()):
+            self.assertTrue(alpha.is_running())
+        self.assertFalse(alpha.is_running())
+
+    def test_lock_on_other_device(self):
+        # /proc/locks naming another device than stat(), as on btrfs subvolumes
+        proc = os.path.join(self.tmpdir, "proc")
+        os.makedirs(os.path.join(proc, "4242"))
+        with open(os.path.join(proc, "locks"), 'w') as f:
+            f.write("1: FLOCK  ADVISORY  WRITE 999 00:2f:1234 0 EOF\n")
+        path = self.servers[0].get_pid_file_path()
+        with open(path, 'w') as f:
+            f.write("4242")
+        self.assertEqual(procstats.pid_file_state(path, proc=proc), (True, 4242))
+        with open(path, 'w') as f:
+            f.write("4243")
+        self.assertEqual(procstats.pid_file_state(path, proc=proc), (False, 4243))
+
+    def test_collect_live(self):
+        alpha, beta = self.servers
+        with open(beta.get_pid_file_path(), 'w') as f:
+            f.write(str(dead_pid()))
+        with PidFile(alpha.get_pid_file_path(), os.getpid()):
+            stats = procstats.collect(self.servers, interval=0)
+        self.assertTrue(stats['alpha']['running'])
+        self.assertEqual(stats['alpha']['pid'], os.getpid())
+        self.assertTrue(stats['alpha']['rss'] > 0)
+        self.assertTrue(stats['alpha']['threads'] >= 1)
+        self.assertTrue(stats['alpha']['open_files'] > 0)
+        self.assertEqual(stats['beta'], {'running': False, 'stale': True, 'pid': None, 'rss': None,
+                                         'cpu': None, 'threads': None, 'open_files': None, 'uptime': None})
+
+    def test_collect_fake_proc(self):
+        proc = os.path.join(self.tmpdir, "proc")
+        os.makedirs(os.path.join(proc, "4242", "fd"))
+        for fd in range(5):
+            open(os.path.join(proc, "4242", "fd", str(fd)), 'w').close()
+        alpha = self.servers[0]
+        with open(alpha.get_pid_file_path(), 'w') as f:
+            f.write("4242")
+        st = os.stat(alpha.get_pid_file_path())
+        with open(os.path.join(proc, "locks"), 'w') as f:
+            f.write("1: FLOCK  ADVISORY  WRITE 999 %02x:%02x:%d 0 EOF\n" % (os.major(st.st_dev), os.minor(st.st_dev), st.st_ino))
+            f.write("1: -> FLOCK  ADVISORY  WRITE 998 00:00:1 0 EOF\n")
+
+        def write_sample(uptime, ticks):
+            with open(os.path.join(proc, "uptime"), 'w') as f:
+                f.write("%s 0.0\n" % (uptime,))
+            with open(os.path.join(proc, "4242", "stat"), 'w') as f:
+                fields = ["S"] + ["0"] * 10 + [str(ticks), "0"] + ["0"] * 4 + ["37", "0", str(100 * procstats.CLOCK_TICKS), "0", "1000"]
+                f.write("4242 (java (server)) %s\n" % (" ".join(fields),))
+
+        write_sample(3700.0, 0)
+        stats = procstats.collect(self.servers, proc=proc, sleep=lambda s: write_sample(3702.0, procstats.CLOCK_TICKS))
+        alpha_stats = stats['alpha']
+        self.assertEqual(alpha_stats['pid'], 4242)
+        self.assertEqual(alpha_stats['threads'], 37)
+        self.assertEqual(alpha_stats['open_files'], 5)
+        self.assertEqual(alpha_stats['rss'], 1000 * procstats.PAGE_SIZE)
+        self.assertEqual(alpha_stats['uptime'], 3600.0)
+        self.assertEqual(alpha_stats['cpu'], 50.0)
+        self.assertFalse(stats['beta']['running'])
+        self.assertEqual(procstats.format_uptime(alpha_stats['uptime']), "1h00m")
@@ -0,0 +1,70 @@
+import unittest
+from StringIO import StringIO
+from bukkitadmin import progress
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class ProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.clock = FakeClock()
+
+    def test_plain_lines(self):
+        display = progress.Progress(out=self.out, tty=False, clock=self.clock)
+        with display.start("Foo", 2048) as transfer:
+            for i in range(64):
+                transfer.update(32)
+            self.clock.now += 2
+        self.assertEqual(self.out.getvalue().splitlines(),
+                         ["Foo: downloading 2.0 KB", "Foo: 2.0 KB in 2.0s (1.0 KB/s)"])
+        self.assertEqual(display.active, [])
+
+    def test_refresh_rate(self):
+        display = progress.Progress(out=self.out, tty=True, refresh_rate=4, clock=self.clock)
+        foo = display.start("Foo", 4096)
+        drawn = self.out.getvalue().count("\n")
+        for i in range(100):
+            foo.update(1)
+        self.assertEqual(self.out.getvalue().count("\n"), drawn)
+        self.clock.now += 0.25
+        foo.update(1)
+        self.assertGreater(self.out.getvalue().count("\n"), drawn)
+
+    def test_lines(self):
+        display = progress.Progress(out=self.out, tty=True, clock=self.clock)
+        foo = display.start("Foo", 4096)
+        bar = display.start("Bar", 4096)
+        self.clock.now += 2
+        foo.update(2048)
+        bar.update(2048)
+        lines = display.lines(self.clock.now)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Foo "))
+        self.assertIn(" 50% [##########          ] 2.0 KB / 4.0 KB  1.0 KB/s", lines[0])
+        self.assertEqual(lines[2], "2 transfers  2.0 KB/s  ETA 0:02")
+
+        bar.finish()
+        self.assertIn("Bar: 2.0 KB in 2.0s (1.0 KB/s)\n", self.out.getvalue())
+        self.assertEqual(len(display.lines(self.clock.now)), 2)
+        unknown = display.start("Baz")
+        self.assertNotIn("ETA", display.lines(self.clock.now)[-1])
+        unknown.finish()
+        foo.finish()
+        self.assertEqual(display.lines(self.clock.now), [])
+        # the live lines are erased once everything is done
+        self.assertTrue(self.out.getvalue().endswith(progress.CLEAR_DOWN + "Foo: 2.0 KB in 2.0s (1.0 KB/s)\n"))
+
+    def test_format(self):
+        self.assertEqual(progress.format_size(512), "512 B")
+        self.assertEqual(progress.format_size(1536 * 1024), "1.5 MB")
+        self.assertEqual(progress.format_eta(3725), "1:02:05")
+        self.assertEqual(progress.format_eta(65), "1:05")
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from bukkitadmin import search
+
+
+class FakeSource(object):
+
+    def __init__(self, name, results, source_type='mirror', delay=0, error=None, hang=None):
+        self.name = name
+        self.source_type = source_type
+        self.results = results
+        self.delay = delay
+        self.error = error
+        self.hang = hang
+
+    def search(self, searchstr):
+        time.sleep(self.delay)
+        for name in self.results:
+            yield {'name': name}
+        if self.error:
+            raise self.error
+        if self.hang:
+            self.hang.wait()
+
+
+class FederatedSearchTest(unittest.TestCase):
+
+    def test_merge_and_rank(self):
+        sources = [
+            FakeSource('lan', ["WorldEditor", "WorldEdit"]),
+            FakeSource('ci', ["WorldEdit", "WorldGuard"], source_type='jenkins'),
+        ]
+        results = list(search.federated_search(sources, "worldedit", settle=0.2))
+        self.assertEqual([r['name'] for r in results], ["WorldEdit", "WorldEditor", "WorldGuard"])
+        self.assertEqual(results[0]['source'], 'lan')
+        self.assertEqual(results[0]['sources'], ['lan', 'ci'])
+        self.assertEqual(results[2]['sources'], ['ci'])
+
+    def test_streams_fast_sources_first(self):
+        sources = [FakeSource('slow', ["Essentials"], delay=0.5), FakeSource('fast', ["EssentialsChat"])]
+        start = time.time()
+        results = search.federated_search(sources, "essentials", settle=0.05)
+        first = next(results)
+        self.assertEqual(first['name'], "EssentialsChat")
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual([r['name'] for r in results], ["Essentials"])
+
+    def test_timeout_and_errors(self):
+        hang = threading.Event()
+        sources = [
+            FakeSource('hung', ["Vault"], hang=hang),
+            FakeSource('broken', [], error=IOError("connection refused")),
+            FakeSource('lan', ["Votifier"]),
+        ]
+        errors = {}
+        start = time.time()
+        try:
+            results = list(search.federated_search(sources, "vault", timeout=0.5, settle=0.05, errors=errors))
+        finally:
+            hang.set()
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(sorted(r['name'] for r in results), ["Vault", "Votifier"])
+        self.assertEqual(sorted(errors), ['broken', 'hung'])
+        self.assertEqual(errors['broken'], "connection refused")
+
+    def test_limit(self):
+        sources = [FakeSource('lan', ["Plugin%d" % (i,) for i in range(100)])]
+        self.assertEqual(len(list(search.federated_search(sources, "plugin", limit=10, settle=0.01))), 10)
+
+    def test_order_sources(self):
+        bukkitdev = FakeSource('bukkitdev', [], source_type='bukkitdev')
+        ci = FakeSource('ci', [], source_type='jenkins')
+        lan = FakeSource('lan', [])
+        self.assertEqual(search.order_sources([bukkitdev, ci, lan]), [lan, ci, bukkitdev])
+        self.assertEqual(search.order_sources([bukkitdev, ci, lan], prefer=bukkitdev), [bukkitdev, lan, ci])
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+from bukkitadmin.serverjars import ServerJarCache, jar_version
+from bukkitadmin.servers import Server
+
+
+class ServerJarCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.cache = ServerJarCache.get(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_jar(self, name, version):
+        path = os.path.join(self.tmpdir, name)
+        zf = zipfile.ZipFile(path, mode='w')
+        zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\nImplementation-Version: %s\n" % (version,))
+        zf.close()
+        return path
+
+    def test_add_keyed_by_version(self):
+        cached = self.cache.add(self.create_jar("a.jar", "git-Bukkit-1.7.2-R0.3"))
+        self.assertEqual(os.path.basename(cached), "git-Bukkit-1.7.2-R0.3.jar")
+        self.assertEqual(self.cache.add(self.create_jar("b.jar", "git-Bukkit-1.7.2-R0.3")), cached)
+        self.assertEqual(self.cache.versions(), {"git-Bukkit-1.7.2-R0.3": cached})
+
+    def test_add_move(self):
+        jar = self.create_jar("a.jar", "1.7.2")
+        self.cache.add(jar, move=True)
+        self.assertFalse(os.path.exists(jar))
+        self.assertIsNotNone(self.cache.get_jar("1.7.2"))
+
+    def test_fetch_uses_cached_url(self):
+        cached = self.cache.add(self.create_jar("a.jar", "1.7.2"))
+        with self.cache._edit_index() as index:
+            index['urls']['http://example.com/craftbukkit.jar'] = {'version': '1.7.2', 'fetched': time.time()}
+        # a download would fail, example.com doesn't serve a jar
+        self.assertEqual(self.cache.fetch('http://example.com/craftbukkit.jar'), cached)
+
+    def test_replace_and_stage_jar(self):
+        os.mkdir(os.path.join(self.tmpdir, "server"))
+        jarpath = os.path.join(self.tmpdir, "server", "craftbukkit.jar")
+        shutil.copy(self.create_jar("old.jar", "1.7.2"), jarpath)
+        server = Server("test", jarpath)
+
+        server.replace_jar(self.cache.add(self.create_jar("new.jar", "1.7.9")))
+        self.assertEqual(jar_version(jarpath), "1.7.9")
+
+        server.stage_jar(self.cache.add(self.create_jar("newer.jar", "1.7.10")))
+        self.assertTrue(server.has_pending_jar())
+        self.assertEqual(jar_version(jarpath), "1.7.9")
+        self.assertTrue(server.apply_pending_jar())
+        self.assertEqual(jar_version(jarpath), "1.7.10")
+        self.assertFalse(server.has_pending_jar())
@@ -1,8 +1,14 @@
+from argparse import Namespace
 import os
 import shutil
 import tempfile
 import unittest
 import zipfile
+import yaml
+from bukkitadmin import servers
+from bukkitadmin.commands import Init, Servers
+from bukkitadmin.plugins import Library
+from bukkitadmin.serverjars import jar_version
 from bukkitadmin.servers import Server, InvalidServerJar
 
 
@@ -25,6 +31,7 @@ class ServerTest(unittest.TestCase):
         zf = zipfile.ZipFile(f, mode='w')
         zf.writestr("META-INF/MANIFEST.MF", "\n".join([": ".join(pair) for pair in manifest.iteritems()]))
         zf.close()
+        return f
 
     def test_validate_missing(self):
         self.assertRaises(InvalidServerJar, Server, 'test', os.path.join(self.tmpdir, "craftbukkit.jar"), validate=True)
@@ -38,5 +45,118 @@ class ServerTest(unittest.TestCase):
         server = Server('test', os.path.join(self.tmpdir, "craftbukkit.jar"), validate=True)
         self.assertIsNotNone(server)
 
+    def test_validate_not_a_jar(self):
+        with open(os.path.join(self.tmpdir, "craftbukkit.jar"), 'w') as f:
+            f.write("not a zip file")
+        self.assertRaises(InvalidServerJar, Server, 'test', os.path.join(self.tmpdir, "craftbukkit.jar"), validate=True)
+
+    def test_manifest(self):
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit", "Implementation-Version": "1.7.2"})
+        server = Server('test', jar, validate=True)
+        self.assertEqual(server.manifest['Implementation-Version'], '1.7.2')
+
+    def test_manifest_cache_invalidated_on_change(self):
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit", "Implementation-Version": "1.7.2"})
+        self.assertEqual(servers.read_manifest(jar)['Implementation-Version'], '1.7.2')
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, servers.MANIFEST_CACHE_FILE)))
+        os.unlink(jar)
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit", "Implementation-Version": "1.7.10"})
+        self.assertEqual(servers.read_manifest(jar)['Implementation-Version'], '1.7.10')
+
+    def test_manifest_disk_cache(self):
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit"})
+        servers.read_manifest(jar)
+        servers._manifest_cache.clear()
+        self.assertEqual(servers.read_manifest(jar), {"Specification-Title": "Bukkit"})
+
+    def test_parse_manifest_continuation(self):
+        manifest = servers.parse_manifest("Manifest-Version: 1.0\r\nClass-Path: a.jar b\r\n .jar\r\n\r\n")
+        self.assertEqual(manifest, {"Manifest-Version": "1.0", "Class-Path": "a.jar b.jar"})
+
+    def test_record_startup(self):
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit", "Implementation-Version": "1.7.2"})
+        server = Server('test', jar, validate=True)
+        self.assertEqual(server.get_startup_history(), [])
+        entry = server.record_startup(3.5, timestamp=1000)
+        self.assertEqual(entry['version'], '1.7.2')
+        self.assertEqual(entry['plugins'], {})
+        self.assertEqual(server.get_startup_history(), [entry])
+
+    def test_find_plugins_skips_other_files(self):
+        jar = self.create_fake_craftbukkit(manifest={"Specification-Title": "Bukkit"})
+        server = Server('test', jar, validate=True)
+        zf = zipfile.ZipFile(os.path.join(server.get_plugin_dir(), "Foo.jar"), mode='w')
+        zf.writestr("plugin.yml", "name: Foo\nversion: 1.0\n")
+        zf.close()
+        self.assertEqual(sorted(server.get_inventory()), ['Foo'])
+        self.assertEqual([p.name for p in server.find_plugins()], ['Foo'])
+
+    def test_find_server_jar(self):
+        os.mkdir(os.path.join(self.tmpdir, "s1"))
+        with open(os.path.join(self.tmpdir, "s1", "notes.jar"), 'w') as f:
+            f.write("not a zip")
+        self.assertIsNone(servers.find_server_jar("s1", os.path.join(self.tmpdir, "s1")))
+        jar = self.create_fake_craftbukkit(name="s1/spigot-1.7.jar", manifest={"Specification-Title": "Bukkit"})
+        server = servers.find_server_jar("s1", os.path.join(self.tmpdir, "s1"))
+        self.assertEqual((server.name, server.jarpath), ("s1", jar))
+
+    def test_import_root(self):
+        for name in ("s1", "s2", "s3"):
+            os.mkdir(os.path.join(self.tmpdir, name))
+            if name != "s3":
+                self.create_fake_craftbukkit(name="%s/craftbukkit.jar" % (name,), manifest={"Specification-Title": "Bukkit"})
+                os.mkdir(os.path.join(self.tmpdir, name, "plugins"))
+                zf = zipfile.ZipFile(os.path.join(self.tmpdir, name, "plugins", "Foo.jar"), mode='w')
+                zf.writestr("plugin.yml", "name: Foo\nversion: '%s'\n" % (name[1],))
+                zf.close()
+        Init.import_root(Namespace(target_dir=self.tmpdir, plugins=True, jobs=4))
+        with open(os.path.join(self.tmpdir, "servers.yml")) as f:
+            self.assertEqual(sorted(yaml.load(f)), ["s1", "s2"])
+        libdir = os.path.join(self.tmpdir, "plugin-library")
+        self.assertEqual(sorted(f for f in os.listdir(libdir) if not f.startswith(".")), ["Foo.jar", "Foo.yml"])
+        self.assertEqual(Library.get(self.tmpdir).get_plugin("Foo").version, '2')
+
+    def test_upgrade_jar_matches_jar_type(self):
+        config = {}
+        for name, title in (("s1", "CraftBukkit"), ("s2", "Spigot")):
+            os.mkdir(os.path.join(self.tmpdir, name))
+            self.create_fake_craftbukkit(name="%s/server.jar" % (name,), manifest={
+                "Specification-Title": "Bukkit", "Implementation-Title": title, "Implementation-Version": "1"})
+            config[name] = {'path': "%s/server.jar" % (name,)}
+        with open(os.path.join(self.tmpdir, "servers.yml"), 'w') as f:
+            yaml.dump(config, f)
+        newjar = self.create_fake_craftbukkit(name="new-spigot.jar", manifest={
+            "Specification-Title": "Bukkit", "Implementation-Title": "Spigot", "Implementation-Version": "2"})
 
+        olddir = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            options = Namespace(jar=newjar, type='craftbukkit', names=None, version='recommended')
+            self.assertEqual(Servers.upgrade_jar(options), 1)
+            options.type = None
+            # named servers are held to the jar's type too
+            options.names = ["s1"]
+            self.assertEqual(Servers.upgrade_jar(options), 1)
+            options.names = None
+            Servers.upgrade_jar(options)
+        finally:
+            os.chdir(olddir)
+        self.assertEqual(jar_version(os.path.join(self.tmpdir, "s1", "server.jar")), "1")
+        self.assertEqual(jar_version(os.path.join(self.tmpdir, "s2", "server.jar")), "2")
 
+    def test_find_startup_regressions(self):
+        def entry(duration, digest, plugins):
+            return {'duration': duration, 'timestamp': 0, 'version': '1.7.2',
+                    'plugins_digest': digest, 'plugins': plugins}
+        history = [
+            entry(3.0, 'a', {'Foo': '1.0'}),
+            entry(3.2, 'a', {'Foo': '1.0'}),
+            entry(3.1, 'b', {'Foo': '1.1'}),
+            entry(6.0, 'c', {'Foo': '1.1', 'Bar': '2.0'}),
+            entry(6.2, 'c', {'Foo': '1.1', 'Bar': '2.0'}),
+        ]
+        regressions = servers.find_startup_regressions(history)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]['added'], ['Bar'])
+        self.assertEqual(regressions[0]['before'], 3.1)
+        self.assertEqual(regressions[0]['after'], 6.1)
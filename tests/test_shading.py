@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from bukkitadmin import shading
+from bukkitadmin.util import list_jar_entries
+
+
+class ShadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_jar(self, name, packages):
+        path = os.path.join(self.tmpdir, name)
+        zf = zipfile.ZipFile(path, mode='w')
+        zf.writestr("plugin.yml", "name: %s\n" % (name,))
+        for package, classes in packages.iteritems():
+            for classname, size in classes:
+                zf.writestr("%s/%s.class" % (package, classname), "\0" * size)
+        zf.close()
+        return path
+
+    def test_list_jar_entries(self):
+        path = self.create_jar("A.jar", {"com/a": [("A", 10)]})
+        self.assertEqual(sorted(list_jar_entries(path))[0][:2], ("com/a/A.class", 10))
+
+    def test_find_duplicates(self):
+        gson = [("Gson", 3000), ("JsonParser", 2000), ("JsonElement", 1000)]
+        jars = {
+            "A": self.create_jar("A.jar", {"com/google/gson": gson, "me/a": [("A", 1), ("B", 1), ("C", 1)]}),
+            "B": self.create_jar("B.jar", {"me/b/libs/com/google/gson": gson[:2] + [("JsonElement", 1500)]}),
+            "C": self.create_jar("C.jar", {"com/google/gson": gson}),
+            "D": os.path.join(self.tmpdir, "missing.jar"),
+        }
+        duplicates = shading.find_duplicates(jars, processes=2)
+        self.assertEqual(len(duplicates), 1)
+        dup = duplicates[0]
+        self.assertEqual(dup['package'], "com.google.gson")
+        self.assertEqual(dup['packages'], ["com.google.gson", "me.b.libs.com.google.gson"])
+        self.assertEqual(dup['plugins'], ["A", "B", "C"])
+        self.assertEqual(dup['bytes'], 6000 + 6500 + 6000)
+        self.assertEqual(dup['waste'], 12000)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from StringIO import StringIO
+
+import yaml
+
+from bukkitadmin import console, runserver, supervisor
+from bukkitadmin.servers import get_server
+
+FAKE_JAVA = """#!/bin/sh
+echo "Done (0.123s)! For help, type \\"help\\" or \\"?\\""
+while read line; do
+    echo "console: $line"
+    if [ "$line" = "stop" ]; then
+        exit 0
+    fi
+done
+"""
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.olddir = os.getcwd()
+        self.oldpath = os.environ['PATH']
+        os.chdir(self.tmpdir)
+
+        bindir = os.path.join(self.tmpdir, "bin")
+        os.mkdir(bindir)
+        java = os.path.join(bindir, "java")
+        with open(java, 'w') as f:
+            f.write(FAKE_JAVA)
+        os.chmod(java, stat.S_IRWXU)
+        os.environ['PATH'] = bindir + os.pathsep + self.oldpath
+
+        servers = {}
+        for name in ('alpha', 'beta'):
+            os.mkdir(name)
+            jarpath = os.path.join(name, "craftbukkit.jar")
+            zf = zipfile.ZipFile(jarpath, mode='w')
+            zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n")
+            zf.close()
+            servers[name] = {'path': jarpath}
+        with open("servers.yml", 'w') as f:
+            yaml.dump(servers, f)
+
+        self.out = StringIO()
+        self.supervisor = supervisor.Supervisor(out=self.out)
+        self.thread = threading.Thread(target=self.supervisor.run, args=(['alpha', 'beta'],))
+        self.thread.daemon = True
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldpath
+        os.chdir(self.olddir)
+        shutil.rmtree(self.tmpdir)
+
+    def wait_for(self, predicate, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def control(self, line):
+        return console.request(supervisor.get_control_socket_path(), line)
+
+    def test_broadcast_and_stop(self):
+        self.thread.start()
+        try:
+            self.assertTrue(self.wait_for(lambda: len(self.supervisor.managed) == 2))
+            self.assertTrue(get_server('alpha').is_running())
+            self.assertTrue(self.wait_for(lambda: get_server('alpha').get_startup_history()))
+            self.assertEqual(get_server('alpha').get_startup_history()[0]['duration'], 0.123)
+
+            self.assertEqual(self.control("* say hello"), "ok alpha beta")
+            self.assertEqual(console.send_command(get_server('beta'), "save-all"), "ok")
+            self.assertTrue(self.wait_for(lambda: "[alpha] console: say hello" in self.out.getvalue()))
+            self.assertTrue(self.wait_for(lambda: "[beta] console: save-all" in self.out.getvalue()))
+
+            self.assertTrue(self.control("alpha reload").startswith("error"))
+            self.assertTrue(self.control("gamma stop").startswith("error"))
+
+            self.control("alpha stop")
+            self.assertTrue(self.wait_for(lambda: 'alpha' not in self.supervisor.managed))
+            self.assertFalse(get_server('alpha').is_running())
+
+            self.control("shutdown")
+            self.thread.join(10)
+            self.assertFalse(self.thread.is_alive())
+            self.assertFalse(get_server('beta').is_running())
+            self.assertFalse(os.path.exists(supervisor.get_control_socket_path()))
+        finally:
+            self.supervisor.shutdown()
+            self.thread.join(10)
+
+    def test_failed_start_keeps_servers_running(self):
+        self.thread.start()
+        try:
+            self.assertTrue(self.wait_for(lambda: len(self.supervisor.managed) == 2))
+            self.assertTrue(self.control("gamma start").startswith("error"))
+            self.assertTrue(self.control("* start").startswith("ok"))
+            self.assertTrue(self.thread.is_alive())
+            self.assertEqual(self.control("list"), "ok alpha beta")
+            self.assertTrue(get_server('alpha').is_running())
+            self.assertTrue(get_server('beta').is_running())
+
+            # beta's JVM goes away under us: sending to it fails, alpha carries on
+            beta = self.supervisor.managed['beta']
+            beta.proc.kill()
+            beta.proc.wait()
+            self.assertTrue(self.control("beta say hello").startswith("error"))
+            self.assertTrue(self.wait_for(lambda: 'beta' not in self.supervisor.managed))
+            self.assertTrue(self.thread.is_alive())
+            self.assertEqual(self.control("alpha say still here"), "ok alpha")
+            self.assertTrue(self.wait_for(lambda: "[alpha] console: say still here" in self.out.getvalue()))
+        finally:
+            self.supervisor.shutdown()
+            self.thread.join(10)
+
+    def test_run_server_already_running(self):
+        spawned = []
+        spawn = runserver.pexpect.spawn
+
+        def recording_spawn(*args, **kwargs):
+            spawned.append(spawn(*args, **kwargs))
+            return spawned[-1]
+        runserver.pexpect.spawn = recording_spawn
+        try:
+            with runserver.PidFile(os.path.join(self.tmpdir, "alpha", ".PID"), os.getpid()):
+                self.assertRaises(SystemExit, runserver.run_server, get_server('alpha'))
+        finally:
+            runserver.pexpect.spawn = spawn
+        self.assertEqual(os.getcwd(), os.path.realpath(self.tmpdir))
+        self.assertEqual(len(spawned), 1)
+        self.assertFalse(spawned[0].isalive())
@@ -1,9 +1,238 @@
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import zipfile
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
 
-from bukkitadmin.util import format_as_kwargs
+from bukkitadmin import util
+from bukkitadmin.util import format_as_kwargs, read_jar_entry, TokenBucket, LazyResults, emit_json
 
 
 class UtilTestCase(unittest.TestCase):
     def test_format_kwargs(self):
         self.assertEqual("k1='one', k2=2",
-                         format_as_kwargs(dict(k1='one', k2=2), priority_keys=('k1',)))
\ No newline at end of file
+                         format_as_kwargs(dict(k1='one', k2=2), priority_keys=('k1',)))
+
+    def test_emit_json(self):
+        out = StringIO()
+        emit_json({'name': 'Foo', 'depend': ['Bar']}, out=out)
+        emit_json({'name': 'Bar'}, out=out)
+        self.assertEqual(out.getvalue(), '{"depend": ["Bar"], "name": "Foo"}\n{"name": "Bar"}\n')
+
+
+class ReadJarEntryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.jar = os.path.join(self.tmpdir, "test.jar")
+        zf = zipfile.ZipFile(self.jar, mode='w')
+        for i in range(50):
+            zf.writestr("org/bukkit/Class%s.class" % (i,), "x" * i)
+        zf.writestr("META-INF/MANIFEST.MF", "Specification-Title: Bukkit\n", zipfile.ZIP_DEFLATED)
+        zf.writestr("stored.txt", "stored", zipfile.ZIP_STORED)
+        zf.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_deflated(self):
+        self.assertEqual(read_jar_entry(self.jar, "META-INF/MANIFEST.MF"), "Specification-Title: Bukkit\n")
+
+    def test_read_stored(self):
+        self.assertEqual(read_jar_entry(self.jar, "stored.txt"), "stored")
+
+    def test_missing_entry(self):
+        self.assertRaises(KeyError, read_jar_entry, self.jar, "plugin.yml")
+
+    def test_not_a_zip(self):
+        path = os.path.join(self.tmpdir, "bad.jar")
+        with open(path, 'w') as f:
+            f.write("hello")
+        self.assertRaises(zipfile.BadZipfile, read_jar_entry, path, "META-INF/MANIFEST.MF")
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(2.0, 3, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_rate(self):
+        for i in range(3):
+            self.bucket.acquire()
+        self.assertEqual(self.clock.slept, [])
+        self.bucket.acquire()
+        self.assertEqual(self.clock.slept, [0.5])
+
+    def test_refill_is_capped_at_burst(self):
+        self.clock.now += 3600
+        for i in range(4):
+            self.bucket.acquire()
+        self.assertEqual(self.clock.slept, [0.5])
+
+    def test_backoff_honours_retry_after(self):
+        self.bucket.backoff(retry_after=10)
+        self.assertEqual(self.bucket.rate, 1.0)
+        self.bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 10)
+
+    def test_success_restores_rate(self):
+        self.bucket.backoff()
+        for i in range(20):
+            self.bucket.success()
+        self.assertEqual(self.bucket.rate, 2.0)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.hits += 1
+        if self.server.hits == 1:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class RateLimitedAdapterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.httpd = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.httpd.hits = 0
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_retries_after_503(self):
+        util.configure_rate_limit('127.0.0.1', 100.0, 5)
+        resp = util.get_http_session().get("http://127.0.0.1:%s/" % (self.httpd.server_address[1],))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.httpd.hits, 2)
+        self.assertLess(util.get_rate_limiter('127.0.0.1').rate, 100.0)
+
+
+class LazyResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.produced = []
+        def pages():
+            for page in range(3):
+                for i in range(10):
+                    self.produced.append(page * 10 + i)
+                    yield page * 10 + i
+        self.results = LazyResults(pages())
+
+    def test_fetches_only_what_is_needed(self):
+        self.assertEqual(self.results[4], 4)
+        self.assertEqual(self.results.fetched, 5)
+        self.assertEqual(self.results[:2], [0, 1])
+        self.assertEqual(self.results.fetched, 5)
+
+    def test_memoized(self):
+        self.assertEqual(list(self.results), range(30))
+        self.assertEqual(list(self.results), range(30))
+        self.assertEqual(self.results[17], 17)
+        self.assertEqual(len(self.produced), 30)
+
+    def test_out_of_range(self):
+        self.assertRaises(IndexError, self.results.__getitem__, 30)
+        self.assertEqual(len(self.results), 30)
+
+    def test_truth(self):
+        self.assertTrue(self.results)
+        self.assertEqual(self.results.fetched, 1)
+        self.assertFalse(LazyResults([]))
+
+
+class SoupTest(unittest.TestCase):
+
+    def test_tag_strainer(self):
+        html = '<h2>Module Builds</h2><table><tr><td><a href="a/">ModA</a></td></tr></table>' \
+               '<table class="fileList big"><tr><td><a href="x.jar">x.jar</a></td></tr></table>'
+        soup = util.parse_soup(html, parse_only=util.tag_strainer(("h2", None), ("a", None)))
+        self.assertEqual(soup.find('h2', text='Module Builds').find_next('a')['href'], "a/")
+        soup = util.parse_soup(html, parse_only=util.tag_strainer(("table", "fileList")))
+        self.assertEqual([a.text for a in soup.find_all('a')], ["x.jar"])
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        self.cache = util.ResultCache(os.path.join(self.tmpdir, "results.cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cached(self):
+        calls = []
+
+        def resolve(name):
+            calls.append(name)
+            return {'url': "http://example.com/%s.jar" % (name,)}
+        self.assertEqual(self.cache.cached("test.url", "Foo", 60, resolve, "Foo"), {'url': "http://example.com/Foo.jar"})
+        self.assertEqual(self.cache.cached("test.url", "foo", 60, resolve, "foo"), {'url': "http://example.com/Foo.jar"})
+        self.assertEqual(calls, ["Foo"])
+
+    def test_cached_misses_expire(self):
+        calls = []
+
+        def resolve(name):
+            calls.append(name)
+            return None
+        self.assertIsNone(self.cache.cached("test.slug", "Foo", 60, resolve, "Foo"))
+        self.assertIsNone(self.cache.cached("test.slug", "Foo", 60, resolve, "Foo"))
+        self.assertEqual(calls, ["Foo", "Foo"])
+        self.cache.cached("test.slug", "Bar", 60, resolve, "Bar", negative_ttl=60)
+        self.cache.cached("test.slug", "Bar", 60, resolve, "Bar", negative_ttl=60)
+        self.assertEqual(calls, ["Foo", "Foo", "Bar"])
+        self.cache.cached("test.slug", "Baz", 60, resolve, "Baz", negative_ttl=-1)
+        self.cache.cached("test.slug", "Baz", 60, resolve, "Baz", negative_ttl=-1)
+        self.assertEqual(calls, ["Foo", "Foo", "Bar", "Baz", "Baz"])
+
+    def test_none_is_cached(self):
+        self.cache.set("test.slug", "Foo", None, 60)
+        self.assertIsNone(self.cache.get("test.slug", "Foo"))
+        self.assertIs(self.cache.get("test.slug", "Bar"), util.ResultCache.MISSING)
+
+    def test_expiry_and_invalidation(self):
+        self.cache.set("test.a", "Foo", 1, -1)
+        self.assertIs(self.cache.get("test.a", "Foo"), util.ResultCache.MISSING)
+        self.cache.set("test.a", "Foo", 1, 60)
+        self.cache.set("test.b", "Foo", 2, 60)
+        self.cache.set("test.b", "Bar", 3, 60)
+        self.cache.invalidate(key="FOO")
+        self.assertIs(self.cache.get("test.a", "Foo"), util.ResultCache.MISSING)
+        self.assertIs(self.cache.get("test.b", "Foo"), util.ResultCache.MISSING)
+        self.assertEqual(self.cache.get("test.b", "Bar"), 3)
+        self.cache.invalidate()
+        self.assertIs(self.cache.get("test.b", "Bar"), util.ResultCache.MISSING)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from bukkitadmin import worlds
+
+
+def chunk_nbt(inhabited, filler=0):
+    body = ""
+    if filler:
+        body += "\x07\x00\x06Blocks" + struct.pack(">i", filler) + os.urandom(filler)
+    body += worlds.INHABITED_TAG + struct.pack(">q", inhabited)
+    return "\x0a\x00\x00\x0a\x00\x05Level" + body + "\x00\x00"
+
+
+def write_region(path, chunks):
+    """Write a region file from {index: nbt}, zlib compressed."""
+    locations = [0] * worlds.CHUNKS_PER_REGION
+    timestamps = [0] * worlds.CHUNKS_PER_REGION
+    body = ""
+    sector = worlds.HEADER_SECTORS
+    for index, nbt in sorted(chunks.items()):
+        data = zlib.compress(nbt)
+        data = struct.pack(">IB", len(data) + 1, 2) + data
+        sectors = (len(data) + worlds.SECTOR_SIZE - 1) // worlds.SECTOR_SIZE
+        body += data.ljust(sectors * worlds.SECTOR_SIZE, "\0")
+        locations[index] = (sector << 8) | sectors
+        timestamps[index] = 1000 + index
+        sector += sectors
+    with open(path, 'wb') as f:
+        f.write(struct.pack(">1024I", *locations))
+        f.write(struct.pack(">1024I", *timestamps))
+        f.write(body)
+
+
+class WorldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("bukkitadmin-tests")
+        for d in ("world/region", "world/entities", "world_nether/DIM-1/region"):
+            os.makedirs(os.path.join(self.tmpdir, d))
+        for world in ("world", "world_nether"):
+            open(os.path.join(self.tmpdir, world, "level.dat"), 'w').close()
+        self.region = os.path.join(self.tmpdir, "world", "region", "r.0.0.mca")
+        write_region(self.region, {0: chunk_nbt(0), 1: chunk_nbt(100000, filler=50000), 33: chunk_nbt(5)})
+        write_region(os.path.join(self.tmpdir, "world", "entities", "r.0.0.mca"), {0: "entities", 1: "entities"})
+        write_region(os.path.join(self.tmpdir, "world_nether", "DIM-1", "region", "r.0.0.mca"), {5: chunk_nbt(7)})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_region_files(self):
+        self.assertEqual([d for d, _ in worlds.find_region_files(self.tmpdir)],
+                         ["world", os.path.join("world_nether", "DIM-1")])
+
+    def test_inhabited_time_gzip(self):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(chunk_nbt(1234, filler=100000)) + compressor.flush()
+        self.assertEqual(worlds.inhabited_time(data, 1), 1234)
+        self.assertIsNone(worlds.inhabited_time("garbage", 2))
+
+    def test_analyze_region(self):
+        info = worlds.analyze_region(self.region)
+        self.assertEqual(info['chunks'], {0: 0, 1: 100000, 33: 5})
+        self.assertEqual(worlds.prunable_chunks(info, 20), [0, 33])
+
+    def test_analyze_regions_pool(self):
+        results = list(worlds.analyze_regions([p for _, p in worlds.find_region_files(self.tmpdir)], processes=2))
+        self.assertEqual(len(results), 2)
+
+    def test_prune(self):
+        size = os.path.getsize(self.region)
+        freed = worlds.prune_regions({self.region: [0, 33]}, processes=1)
+        self.assertTrue(freed > 0)
+        self.assertTrue(os.path.getsize(self.region) < size)
+        self.assertEqual(worlds.analyze_region(self.region)['chunks'], {1: 100000})
+        entities = worlds.read_header(open(os.path.join(self.tmpdir, "world", "entities", "r.0.0.mca"), 'rb').read())
+        self.assertEqual(entities.keys(), [1])
+
+        worlds.prune_region((self.region, [1]))
+        self.assertFalse(os.path.exists(self.region))